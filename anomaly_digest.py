@@ -0,0 +1,262 @@
+"""
+Rolling anomaly digests for compact AI context.
+
+Keeps two deterministic summaries of the anomalous flow table, merged
+incrementally as the engine emits updates (no LLM involved):
+
+- per host: alerts as source/target, distinct flows, reasons, peers, ports,
+  peak score and largest flow, first and last seen;
+- per time bucket (BUCKET_MINUTES): alerts, reasons, top sources, targets
+  and ports, peak score.
+
+An alert is one flow's report for one dashboard window. Pathway replaces a
+report by retracting the old row and adding the new one, so a retraction
+subtracts exactly what its row added. Digests older than RETENTION_HOURS
+are dropped.
+
+Buckets are merged into one line for whatever period a question covers
+(the last hour by default). The prompt builder uses these lines instead of
+many near-identical raw anomaly documents, which are then only needed for
+drill-down.
+"""
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+BUCKET_MINUTES = int(os.environ.get("NETFLOW_DIGEST_BUCKET_MINUTES", 10))
+RETENTION_HOURS = float(os.environ.get("NETFLOW_DIGEST_HOURS", 24))
+BUCKET = BUCKET_MINUTES * 60
+# Distinct flow ids remembered per digest; beyond this the count shows "N+"
+MAX_FLOWS = 1000
+TOP = 3
+PRUNE_INTERVAL = 60.0
+
+
+def _counter_add(counter: Counter, key, sign: int):
+    if key in (None, ""):
+        return
+    counter[key] += sign
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _top(counter: Counter, n: int = TOP) -> str:
+    return ", ".join(f"{key} ×{count}" for key, count in sorted(counter.items(), key=lambda kv: (-kv[1], str(kv[0])))[:n])
+
+
+def _clock(ts: float) -> str:
+    return time.strftime("%H:%M", time.localtime(ts))
+
+
+def _size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1000 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1000
+
+
+class _Digest:
+    __slots__ = ("alerts", "flows", "reasons", "ports", "peers", "sources", "targets",
+                 "as_source", "as_target", "peak", "largest", "first", "last")
+
+    def __init__(self):
+        self.alerts = 0
+        self.flows = set()
+        self.reasons = Counter()
+        self.ports = Counter()
+        self.peers = Counter()  # host digests
+        self.sources = Counter()  # bucket digests
+        self.targets = Counter()
+        self.as_source = 0
+        self.as_target = 0
+        self.peak = 0.0
+        self.largest = 0
+        self.first = None
+        self.last = None
+
+    def apply(self, alert: dict, sign: int):
+        self.alerts += sign
+        for reason in alert["reasons"]:
+            _counter_add(self.reasons, reason, sign)
+        _counter_add(self.ports, alert["dst_port"], sign)
+        if sign > 0:
+            # Peak values and time span only grow; a retraction is always
+            # followed by a newer report of the same flow
+            if len(self.flows) < MAX_FLOWS:
+                self.flows.add(alert["flow"])
+            self.peak = max(self.peak, alert["score"])
+            self.largest = max(self.largest, alert["bytes"])
+            self.first = alert["ts"] if self.first is None else min(self.first, alert["ts"])
+            self.last = alert["ts"] if self.last is None else max(self.last, alert["ts"])
+
+    def merge(self, other: "_Digest"):
+        self.alerts += other.alerts
+        self.flows.update(list(other.flows)[: max(0, MAX_FLOWS - len(self.flows))])
+        for mine, theirs in ((self.reasons, other.reasons), (self.ports, other.ports),
+                             (self.sources, other.sources), (self.targets, other.targets)):
+            mine.update(theirs)
+        self.peak = max(self.peak, other.peak)
+        self.largest = max(self.largest, other.largest)
+        if other.first is not None:
+            self.first = other.first if self.first is None else min(self.first, other.first)
+            self.last = other.last if self.last is None else max(self.last, other.last)
+
+    def flow_count(self) -> str:
+        return f"{len(self.flows)}+" if len(self.flows) >= MAX_FLOWS else str(len(self.flows))
+
+
+def _parse(row: dict) -> dict:
+    flow = str(row.get("flow_id") or "")
+    src, _, dst = flow.partition(" -> ")
+    src_ip, _, _ = src.rpartition(":")
+    dst_ip, _, dst_port = dst.rpartition(":")
+    reasons = [r.strip() for r in str(row.get("anomaly_reason") or "").split(";") if r.strip()]
+    return {
+        "flow": flow,
+        "src_ip": src_ip if src_ip and src_ip != "?" else None,
+        "dst_ip": dst_ip if dst_ip and dst_ip != "?" else None,
+        "dst_port": dst_port if dst_port.isdigit() else None,
+        "reasons": reasons or ["Unspecified"],
+        "score": float(row.get("anomaly_score") or 0.0),
+        "bytes": int(row.get("total_bytes") or 0),
+        "ts": float(row.get("event_time") or time.time()),
+    }
+
+
+class AnomalyDigests:
+    def __init__(self):
+        self._hosts = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.updates = 0
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for the anomalous flow table."""
+        self._pending.put((row, is_addition))
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="anomaly-digest", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        last_prune = time.time()
+        while True:
+            try:
+                row, is_addition = self._pending.get(timeout=PRUNE_INTERVAL)
+                self.merge(row, is_addition)
+            except queue.Empty:
+                pass
+            if time.time() - last_prune > PRUNE_INTERVAL:
+                self.prune()
+                last_prune = time.time()
+
+    def merge(self, row: dict, is_addition: bool):
+        alert = _parse(row)
+        sign = 1 if is_addition else -1
+        with self._lock:
+            for ip, role in ((alert["src_ip"], "source"), (alert["dst_ip"], "target")):
+                if ip is None:
+                    continue
+                host = self._hosts.get(ip)
+                if host is None:
+                    if sign < 0:
+                        continue
+                    host = self._hosts[ip] = _Digest()
+                host.apply(alert, sign)
+                _counter_add(host.peers, alert["dst_ip"] if role == "source" else alert["src_ip"], sign)
+                if role == "source":
+                    host.as_source += sign
+                else:
+                    host.as_target += sign
+            bucket_start = int(alert["ts"] // BUCKET) * BUCKET
+            bucket = self._buckets.get(bucket_start)
+            if bucket is None and sign > 0:
+                bucket = self._buckets[bucket_start] = _Digest()
+            if bucket is not None:
+                bucket.apply(alert, sign)
+                _counter_add(bucket.sources, alert["src_ip"], sign)
+                _counter_add(bucket.targets, alert["dst_ip"], sign)
+            self.updates += 1
+
+    def prune(self, now: float | None = None):
+        cutoff = (time.time() if now is None else now) - RETENTION_HOURS * 3600
+        with self._lock:
+            self._hosts = {ip: d for ip, d in self._hosts.items() if d.alerts > 0 and d.last >= cutoff}
+            self._buckets = {start: d for start, d in self._buckets.items() if d.alerts > 0 and start + BUCKET >= cutoff}
+
+    # --- Digests -------------------------------------------------------------
+    def host_lines(self, ips: list) -> list:
+        """Full digests for the given hosts."""
+        with self._lock:
+            return [self._host_line(ip, self._hosts[ip]) for ip in ips if ip in self._hosts]
+
+    def busiest_line(self, top: int = TOP) -> str | None:
+        """One line naming the hosts with the most alerts and their main reason."""
+        with self._lock:
+            busiest = sorted(self._hosts.items(), key=lambda kv: (-kv[1].alerts, kv[0]))[:top]
+            if not busiest:
+                return None
+            return "Busiest hosts: " + ", ".join(
+                f"{ip} ×{d.alerts} (mostly {d.reasons.most_common(1)[0][0]}, peak {d.peak:.2f})"
+                for ip, d in busiest
+            )
+
+    def _host_line(self, ip: str, d: _Digest) -> str:
+        parts = [
+            f"Host {ip}: {d.alerts} alerts on {d.flow_count()} flows "
+            f"({d.as_source} as source, {d.as_target} as target), {_clock(d.first)}-{_clock(d.last)}",
+            f"Reasons: {_top(d.reasons)}",
+        ]
+        if d.peers:
+            parts.append(f"Peers: {_top(d.peers)}")
+        if d.ports:
+            parts.append(f"Ports: {_top(d.ports)}")
+        parts.append(f"Peak score {d.peak:.2f}, largest flow {_size(d.largest)}")
+        return " | ".join(parts)
+
+    def period_line(self, start: float | None = None, end: float | None = None) -> str | None:
+        """One digest for [start, end] (default: the last hour), merged from its buckets.
+
+        Labelled with the span of its alerts rather than the requested
+        period, so the text (and the chat cache scope hashed from it) only
+        changes when the anomalies do."""
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        period = _Digest()
+        with self._lock:
+            for bucket_start, bucket in self._buckets.items():
+                if bucket_start + BUCKET > start and bucket_start <= end:
+                    period.merge(bucket)
+        if not period.alerts:
+            return None
+        parts = [
+            f"{_clock(period.first)}-{_clock(period.last)}: {period.alerts} alerts on {period.flow_count()} flows",
+            f"Reasons: {_top(period.reasons)}",
+            f"Sources: {_top(period.sources)}",
+            f"Targets: {_top(period.targets)}",
+        ]
+        if period.ports:
+            parts.append(f"Ports: {_top(period.ports)}")
+        parts.append(f"Peak score {period.peak:.2f}")
+        return " | ".join(parts)
+
+    def covers(self, start: float) -> bool:
+        """Whether the buckets still reach back to `start`."""
+        return start >= time.time() - RETENTION_HOURS * 3600
+
+    def stats(self) -> dict:
+        return {
+            "hosts": len(self._hosts),
+            "buckets": len(self._buckets),
+            "updates": self.updates,
+            "pending": self._pending.qsize(),
+        }
+
+
+anomaly_digests = AnomalyDigests()
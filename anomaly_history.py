@@ -0,0 +1,379 @@
+"""
+Long-horizon anomaly history for the AI analyst.
+
+Every anomalous flow update from the engine is appended to an SQLite
+database (WAL mode) by a background writer in bulk transactions. Rows carry
+the flow's endpoints, reason and scores, the capture time and an hour
+bucket, with indexes for time-range, IP and port lookups and an FTS5 index
+over the anomaly reason.
+
+Pathway updates a flow's row by retracting the old version and inserting the
+new one at the same engine time. Retractions only mark rows, which searches
+skip; compaction later deletes them, so each flow window keeps its final
+state and flows retracted without a replacement (whitelisted, or scored
+back under the threshold) drop out. Hours older than NETFLOW_HISTORY_DAYS
+are dropped.
+
+`search()` turns a question into a time range ("last night", "past 3
+hours", "yesterday", "since 14:00"), IPs/ports and reason words, and
+returns matching rows formatted like the live RAG documents with a
+timestamp prefix.
+"""
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from rag_index import query_terms
+
+HISTORY_PATH = os.environ.get("NETFLOW_HISTORY_DB", "docs/anomaly_history.db")
+HISTORY_DAYS = float(os.environ.get("NETFLOW_HISTORY_DAYS", 30))
+HISTORY_ENABLED = os.environ.get("NETFLOW_HISTORY", "1").lower() not in ("0", "false", "no")
+
+BATCH_SIZE = 1000
+BATCH_WAIT = 0.5
+COMPACT_INTERVAL = 60.0
+# Rows read per index lookup before ranking in Python
+CANDIDATES = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomalies (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    added_at INTEGER NOT NULL,
+    retracted_at INTEGER,
+    ts REAL NOT NULL,
+    hour INTEGER NOT NULL,
+    flow TEXT NOT NULL,
+    src_ip TEXT, src_port TEXT, dst_ip TEXT, dst_port TEXT,
+    reason TEXT, score REAL, confidence REAL,
+    packets INTEGER, bytes INTEGER, duration REAL
+);
+CREATE INDEX IF NOT EXISTS anomalies_key ON anomalies(key, added_at);
+CREATE INDEX IF NOT EXISTS anomalies_hour ON anomalies(hour, score);
+CREATE INDEX IF NOT EXISTS anomalies_src_ip ON anomalies(src_ip, ts);
+CREATE INDEX IF NOT EXISTS anomalies_dst_ip ON anomalies(dst_ip, ts);
+CREATE INDEX IF NOT EXISTS anomalies_dst_port ON anomalies(dst_port, ts);
+CREATE INDEX IF NOT EXISTS anomalies_retracted ON anomalies(retracted_at) WHERE retracted_at IS NOT NULL;
+CREATE VIRTUAL TABLE IF NOT EXISTS anomalies_fts USING fts5(
+    reason, content='anomalies', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS anomalies_ai AFTER INSERT ON anomalies BEGIN
+    INSERT INTO anomalies_fts(rowid, reason) VALUES (new.id, new.reason);
+END;
+CREATE TRIGGER IF NOT EXISTS anomalies_ad AFTER DELETE ON anomalies BEGIN
+    INSERT INTO anomalies_fts(anomalies_fts, rowid, reason) VALUES ('delete', old.id, old.reason);
+END;
+"""
+
+COLUMNS = "ts, flow, reason, score, confidence, packets, bytes, duration"
+
+_UNITS = {"min": 60, "minute": 60, "hour": 3600, "hr": 3600, "h": 3600, "day": 86400, "week": 7 * 86400}
+_LAST_N_RE = re.compile(r"\b(?:last|past|previous)\s+(\d+)\s*(minute|min|hour|hr|h|day|week)s?\b")
+_LAST_ONE_RE = re.compile(r"\b(?:last|past|previous)\s+(minute|hour|day|week)\b")
+_SINCE_RE = re.compile(r"\bsince\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\b")
+_PARTS_OF_DAY = {"morning": (6, 12), "afternoon": (12, 18), "evening": (18, 24)}
+# SQLite caps the terms of one compound SELECT at 500
+HOURS_PER_STATEMENT = 400
+
+
+def parse_time_range(query: str, now: float | None = None) -> tuple | None:
+    """(start, end) epoch seconds for a time phrase in `query`, in local time."""
+    now = time.time() if now is None else now
+    q = query.lower()
+    current = datetime.fromtimestamp(now)
+    midnight = current.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if "last night" in q or "overnight" in q:
+        # 18:00 yesterday until 06:00 today (or now, if it's still night)
+        start = midnight - timedelta(hours=6)
+        return start.timestamp(), min(now, (midnight + timedelta(hours=6)).timestamp())
+    for part, (lo, hi) in _PARTS_OF_DAY.items():
+        if f"this {part}" in q:
+            return (midnight + timedelta(hours=lo)).timestamp(), min(now, (midnight + timedelta(hours=hi)).timestamp())
+    if "yesterday" in q:
+        return (midnight - timedelta(days=1)).timestamp(), midnight.timestamp()
+    if "today" in q:
+        return midnight.timestamp(), now
+    match = _LAST_N_RE.search(q)
+    if match:
+        return now - int(match.group(1)) * _UNITS[match.group(2)], now
+    match = _LAST_ONE_RE.search(q)
+    if match:
+        return now - _UNITS[match.group(1)], now
+    match = _SINCE_RE.search(q)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2) or 0)
+        if match.group(3) == "pm" and hour < 12:
+            hour += 12
+        elif match.group(3) == "am" and hour == 12:
+            hour = 0
+        if hour < 24 and minute < 60:
+            start = midnight + timedelta(hours=hour, minutes=minute)
+            if start.timestamp() > now:
+                start -= timedelta(days=1)
+            return start.timestamp(), now
+    return None
+
+
+def _split_endpoint(endpoint: str) -> tuple:
+    host, _, port = endpoint.rpartition(":")
+    return (host or None), (port if port.isdigit() else None)
+
+
+def format_row(row) -> str:
+    ts, flow, reason, score, confidence, packets, bytes_sent, duration = row
+    return (
+        f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))}] "
+        f"Flow: {flow} | "
+        f"Description: {reason} | "
+        f"Score: {score:.2f} | "
+        f"Confidence: {confidence:.2f} | "
+        f"Packets: {packets} | "
+        f"Bytes: {bytes_sent} | "
+        f"Duration: {duration:.2f}s"
+    )
+
+
+class AnomalyHistory:
+    def __init__(self, path: str = HISTORY_PATH, enabled: bool = HISTORY_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._pending = queue.Queue()
+        self._local = threading.local()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.inserted = 0
+        self.compacted = 0
+        self.expired = 0
+        if enabled:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        # One connection per reading thread; WAL lets them run beside the writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for the anomalous flow table; `time` is engine time."""
+        if not self.enabled:
+            return
+        self._pending.put((str(key), row, time, is_addition))
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="anomaly-history", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._pending.get(timeout=COMPACT_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + BATCH_WAIT
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        last_compact = time.time()
+        while True:
+            batch = self._next_batch()
+            try:
+                if batch:
+                    self._write(conn, batch)
+                if time.time() - last_compact > COMPACT_INTERVAL:
+                    self.compact(conn)
+                    last_compact = time.time()
+            except sqlite3.Error as e:
+                print(f"[History] Write failed ({len(batch)} updates dropped): {e}", file=sys.stderr)
+
+    def _write(self, conn: sqlite3.Connection, batch: list):
+        inserts, retractions = [], []
+        for key, row, engine_time, is_addition in batch:
+            if not is_addition:
+                # Only versions added before this retraction; the replacement
+                # inserted at the same engine time stays live
+                retractions.append((engine_time, key, engine_time))
+                continue
+            flow = str(row.get("flow_id") or "")
+            src, _, dst = flow.partition(" -> ")
+            src_ip, src_port = _split_endpoint(src)
+            dst_ip, dst_port = _split_endpoint(dst)
+            ts = float(row.get("event_time") or time.time())
+            inserts.append((
+                key, engine_time, ts, int(ts // 3600), flow, src_ip, src_port, dst_ip, dst_port,
+                row.get("anomaly_reason") or "", float(row.get("anomaly_score") or 0.0),
+                float(row.get("confidence") or 0.0), int(row.get("packet_count") or 0),
+                int(row.get("total_bytes") or 0), float(row.get("duration") or 0.0),
+            ))
+        with conn:
+            conn.executemany(
+                "INSERT INTO anomalies (key, added_at, ts, hour, flow, src_ip, src_port, dst_ip, dst_port, "
+                "reason, score, confidence, packets, bytes, duration) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                inserts,
+            )
+            conn.executemany(
+                "UPDATE anomalies SET retracted_at = ? WHERE key = ? AND retracted_at IS NULL AND added_at < ?",
+                retractions,
+            )
+        self.inserted += len(inserts)
+
+    def compact(self, conn: sqlite3.Connection | None = None):
+        """Delete retracted versions, replaced or not, and hours past retention."""
+        conn = conn or self._connect()
+        with conn:
+            self.compacted += conn.execute("DELETE FROM anomalies WHERE retracted_at IS NOT NULL").rowcount
+            cutoff_hour = int((time.time() - HISTORY_DAYS * 86400) // 3600)
+            self.expired += conn.execute("DELETE FROM anomalies WHERE hour < ?", (cutoff_hour,)).rowcount
+
+    # --- Query ---------------------------------------------------------------
+    def search(self, query: str, time_range: tuple | None = None, limit: int = 15) -> list:
+        """History rows relevant to `query`, formatted for the prompt.
+        Returns nothing when the question names no time, IP, port or reason word."""
+        if not self.enabled or not os.path.exists(self.path):
+            return []
+        # "past 3 hours" must not read as port 3
+        terms = query_terms(_SINCE_RE.sub(" ", _LAST_N_RE.sub(" ", query.lower())))
+        ips = sorted(t[3:] for t in terms if t.startswith("ip:"))
+        ports = sorted(t[5:] for t in terms if t.startswith("port:"))
+        words = sorted(t[5:] for t in terms if t.startswith("word:"))
+        start, end = time_range or (0.0, time.time() + 86400)
+        conn = self._reader()
+
+        if ips:
+            rows = self._by_column(conn, ("src_ip", "dst_ip"), ips, start, end)
+            if ports:
+                port_set = set(ports)
+                rows = [r for r in rows if r[-2] in port_set or r[-1] in port_set]
+        elif ports:
+            rows = self._by_column(conn, ("dst_port",), ports, start, end)
+        elif words and (rows := self._by_words(conn, words, start, end)):
+            pass
+        elif time_range:
+            rows = self._by_hour(conn, start, end, limit)
+        else:
+            return []
+
+        # Rank: reason words from the question, then score, then recency
+        def rank(row):
+            reason = (row[2] or "").lower()
+            return (sum(w in reason for w in words), row[3], row[0])
+
+        rows = sorted(rows, key=rank, reverse=True)
+        seen, docs = set(), []
+        for row in rows:
+            if row[1] in seen:
+                continue
+            seen.add(row[1])
+            docs.append(format_row(row[:8]))
+            if len(docs) >= limit:
+                break
+        return docs
+
+    def _by_column(self, conn, columns: tuple, values: list, start: float, end: float) -> list:
+        marks = ",".join("?" * len(values))
+        rows = []
+        for column in columns:
+            # Newest first straight off the (column, ts) index
+            rows += conn.execute(
+                f"SELECT {COLUMNS}, src_port, dst_port FROM anomalies "
+                f"WHERE {column} IN ({marks}) AND ts BETWEEN ? AND ? AND retracted_at IS NULL "
+                f"ORDER BY ts DESC LIMIT ?",
+                (*values, start, end, CANDIDATES),
+            ).fetchall()
+        return rows
+
+    def _by_hour(self, conn, start: float, end: float, limit: int) -> list:
+        # Top scores of each hour bucket, walked along the (hour, score) index;
+        # only the overall best rows are then fetched from the table
+        first, last = int(start // 3600), int(end // 3600)
+        edge = (
+            "SELECT * FROM (SELECT id, score FROM anomalies "
+            "WHERE hour = ? AND ts BETWEEN ? AND ? AND retracted_at IS NULL ORDER BY score DESC LIMIT ?)"
+        )
+        inner = (
+            "SELECT * FROM (SELECT id, score FROM anomalies "
+            "WHERE hour = ? AND retracted_at IS NULL ORDER BY score DESC LIMIT ?)"
+        )
+        parts = [
+            (edge, (hour, start, end, limit)) if hour in (first, last) else (inner, (hour, limit))
+            for hour in range(first, last + 1)
+        ]
+        candidates = []
+        for i in range(0, len(parts), HOURS_PER_STATEMENT):
+            chunk = parts[i:i + HOURS_PER_STATEMENT]
+            sql = " UNION ALL ".join(part for part, _ in chunk)
+            candidates += conn.execute(sql, [value for _, values in chunk for value in values]).fetchall()
+        # Extra rows so that duplicates of one flow don't crowd out the rest
+        best = sorted(candidates, key=lambda c: c[1], reverse=True)[: 4 * limit]
+        if not best:
+            return []
+        marks = ",".join("?" * len(best))
+        return conn.execute(
+            f"SELECT {COLUMNS}, src_port, dst_port FROM anomalies WHERE id IN ({marks})",
+            [c[0] for c in best],
+        ).fetchall()
+
+    def _by_words(self, conn, words: list, start: float, end: float) -> list:
+        # Question words that never occur in a reason simply match nothing
+        match = " OR ".join(f'"{w}"' for w in words)
+        low, high = self._id_bounds(conn, start, end)
+        return conn.execute(
+            f"SELECT {COLUMNS}, src_port, dst_port FROM anomalies WHERE id IN ("
+            f"SELECT rowid FROM anomalies_fts WHERE anomalies_fts MATCH ? AND rowid BETWEEN ? AND ? "
+            f"ORDER BY rowid DESC LIMIT ?) AND ts BETWEEN ? AND ? AND retracted_at IS NULL",
+            (match, low, high, CANDIDATES, start, end),
+        ).fetchall()
+
+    def _id_bounds(self, conn, start: float, end: float) -> tuple:
+        """Row id range covering [start, end]. Rows are appended roughly in time
+        order, so the ids of the first and last non-empty hour buckets bound it."""
+        first = conn.execute(
+            "SELECT hour FROM anomalies WHERE hour >= ? ORDER BY hour LIMIT 1", (int(start // 3600),)
+        ).fetchone()
+        last = conn.execute(
+            "SELECT hour FROM anomalies WHERE hour <= ? ORDER BY hour DESC LIMIT 1", (int(end // 3600),)
+        ).fetchone()
+        if first is None or last is None:
+            return 0, -1
+        low = conn.execute("SELECT MIN(id) FROM anomalies WHERE hour = ?", first).fetchone()[0]
+        high = conn.execute("SELECT MAX(id) FROM anomalies WHERE hour = ?", last).fetchone()[0]
+        return low, high
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "pending": self._pending.qsize(),
+            "inserted": self.inserted,
+            "compacted": self.compacted,
+            "expired": self.expired,
+            "db_mb": round(os.path.getsize(self.path) / 1e6, 1) if os.path.exists(self.path) else 0.0,
+        }
+
+
+anomaly_history = AnomalyHistory()
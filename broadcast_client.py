@@ -0,0 +1,110 @@
+"""
+Dashboard publisher shared by the Pathway engine and the system monitor.
+
+Updates go either to Django (HTTP POST to /api/update/, the default) or
+straight to ws_broadcaster.py over a Unix socket, one JSON document per line.
+Select the path with NETFLOW_DASHBOARD_SINK=http|broadcaster.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import requests
+
+DASHBOARD_SINK = os.environ.get("NETFLOW_DASHBOARD_SINK", "http")
+API_URL = os.environ.get("NETFLOW_UPDATE_URL", "http://localhost:8000/api/update/")
+BROADCAST_SOCKET = os.environ.get("NETFLOW_BROADCAST_SOCKET", "live_data/broadcast.sock")
+
+# Never let a stalled broadcaster block the caller for long
+SEND_TIMEOUT = 0.5
+RECONNECT_INTERVAL = 1.0
+
+
+class SocketPublisher:
+    """Writes newline-delimited JSON to the broadcaster's Unix socket.
+
+    Thread-safe. Messages are dropped (not queued) while the broadcaster is
+    unreachable, matching how the HTTP sink behaves when Django is down.
+    """
+
+    def __init__(self, path: str = BROADCAST_SOCKET):
+        self.path = path
+        self._sock = None
+        self._lock = threading.Lock()
+        self._last_attempt = 0.0
+        self.sent = 0
+        self.dropped = 0
+
+    def _connect(self):
+        now = time.time()
+        if now - self._last_attempt < RECONNECT_INTERVAL:
+            return None
+        self._last_attempt = now
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(SEND_TIMEOUT)
+            sock.connect(self.path)
+            self._sock = sock
+        except OSError as e:
+            print(f"[Publisher] Broadcaster unavailable at {self.path}: {e}", file=sys.stderr)
+            self._sock = None
+        return self._sock
+
+    def send_raw(self, line: bytes) -> bool:
+        with self._lock:
+            sock = self._sock or self._connect()
+            if sock is None:
+                self.dropped += 1
+                return False
+            try:
+                sock.sendall(line)
+                self.sent += 1
+                return True
+            except OSError:
+                sock.close()
+                self._sock = None
+                self.dropped += 1
+                return False
+
+    def publish(self, update: dict) -> bool:
+        line = json.dumps(update, default=str, separators=(",", ":")) + "\n"
+        return self.send_raw(line.encode("utf-8"))
+
+
+class HttpPublisher:
+    """Posts updates to Django's PacketUpdateView."""
+
+    def __init__(self, url: str = API_URL):
+        self.url = url
+        self._session = requests.Session()
+
+    def publish(self, update: dict) -> bool:
+        try:
+            self._session.post(self.url, json=update, timeout=1)
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"[Publisher] Failed to post update: {e}", file=sys.stderr)
+            return False
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            if DASHBOARD_SINK == "broadcaster":
+                _publisher = SocketPublisher()
+            else:
+                _publisher = HttpPublisher()
+        return _publisher
+
+
+def publish(update: dict) -> bool:
+    """Send a single dashboard update through the configured sink."""
+    return get_publisher().publish(update)
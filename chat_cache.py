@@ -0,0 +1,113 @@
+"""
+Response cache for the AI analyst.
+
+Answers are keyed by the normalized question, the model, the selected rows
+and a hash of the retrieved context. When new anomalies change what
+retrieval returns for a question, the key changes and the LLM is asked
+again. Entries expire after NETFLOW_CHAT_CACHE_TTL seconds and the least
+recently used are dropped beyond NETFLOW_CHAT_CACHE_SIZE.
+
+With NETFLOW_CHAT_CACHE_SEMANTIC set to a cosine threshold (e.g. 0.95),
+near-duplicate questions with the same model, rows and context are served
+from the cache too, by comparing question embeddings.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_SIZE = int(os.environ.get("NETFLOW_CHAT_CACHE_SIZE", 256))
+CACHE_TTL = float(os.environ.get("NETFLOW_CHAT_CACHE_TTL", 300))
+SEMANTIC_THRESHOLD = float(os.environ.get("NETFLOW_CHAT_CACHE_SEMANTIC", 0) or 0)
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?!. ")
+
+
+def _digest(text: str | None) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+class ChatCache:
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL, semantic_threshold: float = SEMANTIC_THRESHOLD):
+        self.size = size
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._entries = OrderedDict()  # key -> (answer, expires_at, latency, scope, query_vec)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def semantic(self) -> bool:
+        return self.size > 0 and self.semantic_threshold > 0
+
+    @staticmethod
+    def scope(model: str, selected_row: str | None, context: str) -> tuple:
+        """Everything but the question: answers are only reusable within a scope."""
+        return (model, _digest(selected_row), _digest(context))
+
+    def get(self, query: str, scope: tuple, query_vec: np.ndarray | None = None) -> str | None:
+        if self.size <= 0:
+            return None
+        key = (normalize_query(query), scope)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < now:
+                del self._entries[key]
+                entry = None
+            semantic = False
+            if entry is None and self.semantic and query_vec is not None:
+                entry_key = self._nearest(scope, query_vec, now)
+                if entry_key is not None:
+                    key, entry, semantic = entry_key, self._entries[entry_key], True
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.semantic_hits += semantic
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+    def _nearest(self, scope: tuple, query_vec: np.ndarray, now: float):
+        best_key, best_score = None, self.semantic_threshold
+        for key, (_, expires_at, _, entry_scope, vec) in self._entries.items():
+            if entry_scope != scope or vec is None or expires_at < now:
+                continue
+            score = float(np.dot(vec, query_vec))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def put(self, query: str, scope: tuple, answer: str, latency: float, query_vec: np.ndarray | None = None):
+        if self.size <= 0:
+            return
+        key = (normalize_query(query), scope)
+        with self._lock:
+            self._entries[key] = (answer, time.time() + self.ttl, latency, scope, query_vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
+
+
+chat_cache = ChatCache()
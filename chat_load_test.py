@@ -0,0 +1,237 @@
+"""
+AI analyst load test with a local OpenAI-compatible stub.
+
+1. Start the stub (simulated LLM latency, optional failures/hangs):
+       python chat_load_test.py stub --port 8090 --latency 0.8 --jitter 0.4
+2. Start the engine against it:
+       NETFLOW_LLM_BASE_URL=http://localhost:8090/v1 python main.py
+3. Fire concurrent questions and read end-to-end latency:
+       python chat_load_test.py run --concurrency 16 --requests 200
+   or stream them and also read time to first token:
+       python chat_load_test.py run --stream --concurrency 16
+
+`run` posts to the engine's query endpoint (port 8011) by default; pass
+--url http://localhost:8000/api/chat/ (or /api/chat/stream/ with --stream)
+to include the Django proxy.
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+QUESTIONS = [
+    "what's anomalous on 192.168.1.5?",
+    "is anyone scanning my network?",
+    "summarize the most suspicious flows",
+    "any signs of data exfiltration?",
+    "what is happening on port 443?",
+]
+
+
+# --- Stub server -------------------------------------------------------------
+STUB_ANSWER = (
+    "Flow 192.168.1.5:51234 -> 10.0.0.7:443 shows a sustained burst of small packets "
+    "with a high SYN ratio, which matches the scan pattern flagged by the engine. "
+    "No payload was exchanged, so this looks like reconnaissance rather than exfiltration."
+)
+
+
+def make_stub_handler(latency: float, jitter: float, fail_rate: float, hang_rate: float, ttft: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        calls = 0
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            with self.lock:
+                StubHandler.calls += 1
+            if not self.path.endswith("/chat/completions"):
+                self._reply(404, {"error": "not found"})
+                return
+
+            roll = random.random()
+            if roll < hang_rate:
+                time.sleep(3600)  # a hung provider; the client's timeout must fire
+            # Streaming spends `ttft` before the first token and the rest between tokens
+            time.sleep(max(0.0, (ttft if body.get("stream") else latency) + random.uniform(-jitter, jitter)))
+            if roll < hang_rate + fail_rate:
+                self._reply(503, {"error": "stub failure"})
+                return
+
+            prompt = body.get("messages", [{}])[-1].get("content", "")
+            if body.get("stream"):
+                self._stream(STUB_ANSWER)
+                return
+            self._reply(200, {
+                "id": f"stub-{StubHandler.calls}",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"Stub answer ({len(prompt)} prompt chars)."},
+                    "finish_reason": "stop",
+                }],
+            })
+
+        def _stream(self, answer: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = answer.split(" ")
+            gap = max(0.0, latency - ttft) / len(words)
+            events = [
+                {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+                for i, word in enumerate(words)
+            ]
+            for i, event in enumerate(events + ["[DONE]"]):
+                if 0 < i < len(events):
+                    time.sleep(gap)
+                line = event if isinstance(event, str) else json.dumps(event)
+                data = f"data: {line}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _reply(self, code: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubHandler
+
+
+def run_stub(args):
+    handler = make_stub_handler(args.latency, args.jitter, args.fail_rate, args.hang_rate, args.ttft)
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), handler)
+    server.daemon_threads = True
+    print(f"Stub OpenAI server on http://localhost:{args.port}/v1 "
+          f"(latency {args.latency}±{args.jitter}s, fail {args.fail_rate:.0%}, hang {args.hang_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# --- Load generator ----------------------------------------------------------
+def ask(session: requests.Session, url: str, question: str, timeout: float) -> tuple[float, bool, str]:
+    started = time.perf_counter()
+    try:
+        response = session.post(url, json={"messages": question, "model": None, "selected_row": None}, timeout=timeout)
+        text = response.text
+        ok = response.ok and "Error" not in text
+    except requests.exceptions.RequestException as e:
+        ok, text = False, str(e)
+    return time.perf_counter() - started, ok, text
+
+
+def ask_stream(session: requests.Session, url: str, question: str, timeout: float) -> tuple[float, bool, str, float | None]:
+    """Like ask(), for the SSE endpoints; also returns time to first token."""
+    started = time.perf_counter()
+    ttft, ok, text = None, False, ""
+    try:
+        with session.post(url, json={"messages": question, "model": None, "selected_row": None},
+                          stream=True, timeout=timeout) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                if "delta" in event and ttft is None:
+                    ttft = time.perf_counter() - started
+                if event.get("error"):
+                    text = event["error"]
+                    break
+                if event.get("done"):
+                    ok = True
+                    break
+    except (requests.exceptions.RequestException, ValueError) as e:
+        text = str(e)
+    return time.perf_counter() - started, ok, text, ttft
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_load(args):
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if args.unique:
+            question = f"{question} (#{i})"
+        if args.stream:
+            return ask_stream(local.session, args.url, question, args.timeout)
+        return ask(local.session, args.url, question, args.timeout) + (None,)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] for r in results]
+    ok = [r[0] for r in results if r[1]]
+    errors = [r[2] for r in results if not r[1]]
+    print(f"Questions: {len(results)} at concurrency {args.concurrency} in {elapsed:.1f}s "
+          f"({len(results) / elapsed:.1f}/s)")
+    print(f"Answered:  {len(ok)}   errors: {len(errors)}")
+    print(f"Latency (all) ms: p50 {percentile(latencies, 50) * 1000:.0f}  "
+          f"p99 {percentile(latencies, 99) * 1000:.0f}  mean {statistics.fmean(latencies) * 1000:.0f}")
+    if ok:
+        print(f"Latency (ok)  ms: p50 {percentile(ok, 50) * 1000:.0f}  p99 {percentile(ok, 99) * 1000:.0f}")
+    ttfts = [r[3] for r in results if r[3] is not None]
+    if ttfts:
+        print(f"First token   ms: p50 {percentile(ttfts, 50) * 1000:.0f}  p99 {percentile(ttfts, 99) * 1000:.0f}")
+    if errors:
+        print(f"First error: {errors[0][:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetFlow AI analyst load test")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stub = sub.add_parser("stub", help="Run a stub OpenAI-compatible server")
+    stub.add_argument("--port", type=int, default=8090)
+    stub.add_argument("--latency", type=float, default=0.8, help="Mean response time (s)")
+    stub.add_argument("--ttft", type=float, default=0.3, help="Time to first token when streaming (s)")
+    stub.add_argument("--jitter", type=float, default=0.3)
+    stub.add_argument("--fail-rate", type=float, default=0.0, help="Fraction answered with HTTP 503")
+    stub.add_argument("--hang-rate", type=float, default=0.0, help="Fraction that never answer")
+
+    run = sub.add_parser("run", help="Send concurrent questions and report latency")
+    run.add_argument("--url", default=None,
+                     help="Default: engine query endpoint (8011), or its stream endpoint (8012) with --stream")
+    run.add_argument("--stream", action="store_true", help="Use the SSE endpoints and report time to first token")
+    run.add_argument("--unique", action="store_true", help="Make every question distinct so the answer cache never hits")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--requests", type=int, default=100)
+    run.add_argument("--timeout", type=float, default=60.0)
+
+    args = parser.parse_args()
+    if args.command == "stub":
+        run_stub(args)
+    else:
+        if args.url is None:
+            args.url = "http://localhost:8012/stream" if args.stream else "http://localhost:8011/"
+        run_load(args)
+
+
+if __name__ == "__main__":
+    main()
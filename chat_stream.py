@@ -0,0 +1,159 @@
+"""
+Streaming side path for the AI analyst.
+
+Pathway's REST connector answers a query with one complete response, so
+token streaming runs beside the dataflow in the engine process. POST /stream
+on port 8012 takes the same JSON as the query endpoint on 8011 and answers
+with Server-Sent Events:
+
+    data: {"delta": "..."}                                answer text as generated
+    data: {"done": true, "ttft": 0.41, "total": 3.2, "cached": false}
+    data: {"error": "..."}
+
+Retrieval, the answer cache and the pooled LLM client are shared with the
+dataflow path. GET /stats reports time-to-first-token and total latency.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chat_cache import chat_cache
+from llm_client import LLMError, llm_client
+
+STREAM_PORT = int(os.environ.get("NETFLOW_CHAT_STREAM_PORT", 8012))
+MAX_BODY = 256 * 1024
+# Recent (ttft, total) pairs for the latency percentiles in stats()
+_latencies = deque(maxlen=500)
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+
+def stats() -> dict:
+    samples = list(_latencies)
+    ttft = [t for t, _ in samples]
+    total = [t for _, t in samples]
+    return {
+        "streams": len(samples),
+        "ttft_p50": _percentile(ttft, 50),
+        "ttft_p99": _percentile(ttft, 99),
+        "total_p50": _percentile(total, 50),
+        "total_p99": _percentile(total, 99),
+    }
+
+
+def make_handler(prepare):
+    """`prepare(query, model, selected_row)` returns (prompt, model, cache scope, query vector)."""
+
+    class ChatStreamHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _event(self, payload: dict):
+            # One HTTP chunk per event so clients can hand it over as soon as it arrives
+            data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _json(self, code: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._json(200, stats())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/stream":
+                self._json(404, {"error": "not found"})
+                return
+            started = time.time()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length > MAX_BODY:
+                    raise ValueError("request too large")
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                self._json(400, {"error": str(e)})
+                return
+            query = body.get("messages")
+            if not query:
+                self._json(400, {"error": "No query provided"})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                self._answer(query, body.get("model"), body.get("selected_row"), started)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Analyst went away; leaving the generator closes the upstream call
+                self.close_connection = True
+
+        def _answer(self, query, model, selected_row, started):
+            if not llm_client.has_credentials():
+                self._event({"error": "Error: OPENROUTER_API_KEY is not set."})
+                return
+            prompt, target_model, scope, query_vec = prepare(query, model, selected_row)
+
+            cached = chat_cache.get(query, scope, query_vec)
+            if cached is not None:
+                self._event({"delta": cached})
+                elapsed = round(time.time() - started, 3)
+                self._event({"done": True, "ttft": elapsed, "total": elapsed, "cached": True})
+                return
+
+            ttft = None
+            parts = []
+            try:
+                for delta in llm_client.stream_chat(prompt, target_model):
+                    if ttft is None:
+                        ttft = time.time() - started
+                    parts.append(delta)
+                    self._event({"delta": delta})
+            except LLMError as e:
+                self._event({"error": f"LLM Error ({target_model}): {e}"})
+                return
+
+            total = time.time() - started
+            ttft = total if ttft is None else ttft
+            _latencies.append((ttft, total))
+            answer = "".join(parts)
+            if answer:
+                chat_cache.put(query, scope, answer, total, query_vec)
+            self._event({"done": True, "ttft": round(ttft, 3), "total": round(total, 3), "cached": False})
+            print(f"[ChatStream] {target_model}: first token {ttft:.2f}s, total {total:.2f}s", flush=True)
+
+    return ChatStreamHandler
+
+
+def serve(prepare, port: int = STREAM_PORT) -> ThreadingHTTPServer | None:
+    """Start the side server on a daemon thread."""
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), make_handler(prepare))
+    except OSError as e:
+        print(f"[ChatStream] Could not bind port {port}: {e}", file=sys.stderr)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="chat-stream", daemon=True).start()
+    print(f"[ChatStream] Streaming answers on http://0.0.0.0:{port}/stream", flush=True)
+    return server
@@ -0,0 +1,95 @@
+import time
+from collections import deque
+
+# Per-process registry of connected clients, exposed by StreamStatsView
+CLIENTS = {}
+
+
+class ClientFlowControl:
+    """Byte-budgeted send window for one WebSocket client.
+
+    Clients acknowledge frames with {"action": "ack", "seq": n}. Frames sent
+    but not yet acknowledged count against the budget. Once the budget is
+    exhausted the client stops receiving live frames; when it catches up it
+    is resynced with a single delta from the snapshot ring. Superseded state
+    is dropped by key. Alerts from skipped frames are held by the consumer
+    and delivered with the resync, never truncated. Clients that never ack
+    are not flow controlled.
+    """
+
+    def __init__(self, budget_bytes: int, max_lag: float):
+        self.budget_bytes = budget_bytes
+        self.max_lag = max_lag
+        self.enabled = False
+        self.in_flight = deque()
+        self.in_flight_bytes = 0
+        self.sent_seq = 0
+        self.acked_seq = 0
+        self.behind = False
+        self.resyncing = False
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.skipped_frames = 0
+        self.resyncs = 0
+        self.connected_at = time.time()
+
+    def on_sent(self, seq: int, nbytes: int):
+        self.sent_seq = max(self.sent_seq, seq or 0)
+        self.frames_sent += 1
+        self.bytes_sent += nbytes
+        if self.enabled:
+            self.in_flight.append((seq or 0, nbytes, time.monotonic()))
+            self.in_flight_bytes += nbytes
+
+    def on_ack(self, seq: int):
+        self.enabled = True
+        self.acked_seq = max(self.acked_seq, seq)
+        while self.in_flight and self.in_flight[0][0] <= seq:
+            _, nbytes, _ = self.in_flight.popleft()
+            self.in_flight_bytes -= nbytes
+
+    def admit(self, nbytes: int) -> bool:
+        """Whether a live frame of `nbytes` may be sent now."""
+        if not self.enabled:
+            return True
+        if not self.behind and self.in_flight_bytes + nbytes > self.budget_bytes:
+            self.behind = True
+        if self.behind:
+            self.skipped_frames += 1
+            return False
+        return True
+
+    def ready_to_resync(self) -> bool:
+        return self.behind and not self.resyncing and self.in_flight_bytes <= self.budget_bytes // 2
+
+    def start_resync(self):
+        self.resyncing = True
+        self.resyncs += 1
+
+    def resynced(self):
+        self.behind = False
+        self.resyncing = False
+
+    def lag_seconds(self) -> float:
+        if not self.in_flight:
+            return 0.0
+        return time.monotonic() - self.in_flight[0][2]
+
+    def too_far_behind(self) -> bool:
+        return self.enabled and self.lag_seconds() > self.max_lag
+
+    def stats(self) -> dict:
+        return {
+            "flow_controlled": self.enabled,
+            "sent_seq": self.sent_seq,
+            "acked_seq": self.acked_seq,
+            "lag_frames": max(0, self.sent_seq - self.acked_seq) if self.enabled else None,
+            "lag_seconds": round(self.lag_seconds(), 3),
+            "in_flight_bytes": self.in_flight_bytes,
+            "behind": self.behind,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "skipped_frames": self.skipped_frames,
+            "resyncs": self.resyncs,
+            "connected_for": round(time.time() - self.connected_at, 1),
+        }
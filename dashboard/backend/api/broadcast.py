@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import secrets
+import threading
+import time
+import zlib
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install msgpack
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+GROUP_NAME = "packets"
+# Clients with a server-side subscription (see api/subscriptions.py)
+FILTERED_GROUP = "packets.filtered"
+# Served by the process that ingests updates; answers snapshot/resume requests
+SNAPSHOT_CHANNEL = "netflow.snapshot"
+
+# Wire encodings a client can negotiate via Sec-WebSocket-Protocol
+# ("netflow.msgpack") or the query string (?encoding=msgpack).
+# JSON text frames stay the default.
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_DEFLATE = "deflate"  # zlib-wrapped JSON, DecompressionStream("deflate") in browsers
+SUBPROTOCOL_PREFIX = "netflow."
+
+
+def available_encodings() -> list:
+    encodings = [ENCODING_JSON, ENCODING_DEFLATE]
+    if msgpack is not None:
+        encodings.append(ENCODING_MSGPACK)
+    return encodings
+
+
+def group_for(encoding: str) -> str:
+    return GROUP_NAME if encoding == ENCODING_JSON else f"{GROUP_NAME}.{encoding}"
+
+
+def encode_message(message, encoding: str = ENCODING_JSON) -> dict:
+    """Encode once and return a channel-layer event carrying the ready-to-send
+    payload, so consumers don't serialize per client. The frame's seq/stream
+    ride along unencoded for flow control."""
+    event = {"type": "send_packet_update", "seq": message.get("seq"), "stream": message.get("stream")}
+    if encoding == ENCODING_MSGPACK:
+        event["bytes"] = msgpack.packb(message, default=str)
+        return event
+    text = json.dumps(message, default=str, separators=(",", ":"))
+    if encoding == ENCODING_DEFLATE:
+        event["bytes"] = zlib.compress(text.encode("utf-8"), 6)
+    else:
+        event["text"] = text
+    return event
+
+
+def has_no_members(channel_layer, group: str) -> bool:
+    """True only when the layer can tell (InMemoryChannelLayer) that nobody
+    is listening, so we can skip encoding for that group."""
+    groups = getattr(channel_layer, "groups", None)
+    return groups is not None and not groups.get(group)
+
+
+DEFAULTS = {
+    # Frames per second pushed to browsers
+    "FLUSH_HZ": 5,
+    # Keys not refreshed for this long are forgotten
+    "STATE_TTL": 30.0,
+    # Recent frames kept for resuming clients (60 s at 5 Hz)
+    "RING_SIZE": 300,
+    # Unacknowledged bytes a client may have in flight before live frames
+    # are held back and later replaced by one merged delta
+    "CLIENT_BUFFER_BYTES": 1024 * 1024,
+    # Clients whose oldest unacknowledged frame is older than this are disconnected
+    "MAX_CLIENT_LAG": 15.0,
+    # Per-type cap on changed entries per frame, ranked by the given field;
+    # the rest wait for the next frame.
+    # The dashboard keeps 50 flows on screen.
+    "TOP_N": {
+        "flow": ("anomaly_score", 50),
+        "graph_edge": ("weight", 200),
+    },
+}
+
+
+def stream_setting(name):
+    return getattr(settings, "NETFLOW_STREAM", {}).get(name, DEFAULTS[name])
+
+
+def update_kind(update: dict) -> str:
+    """Flow pulses carry no `type`; everything else is tagged by the engine."""
+    return update.get("type") or "flow"
+
+
+def update_key(update: dict) -> tuple:
+    kind = update_kind(update)
+    if kind == "flow":
+        return (kind, update.get("flow") or update.get("flow_id"))
+    if kind == "graph_edge":
+        return (kind, update.get("source"), update.get("target"), update.get("dst_port"))
+    if kind == "critical_alert":
+        # Every alert is delivered; the engine already dedups per flow and reason
+        return (kind, update.get("flow"), update.get("reason"), update.get("detected_at"))
+    return (kind,)
+
+
+def is_alert(update: dict) -> bool:
+    """Critical alerts and flows flagged with a reason. Flow control and
+    snapshot caps never drop these; only superseded state is merged away."""
+    kind = update_kind(update)
+    return kind == "critical_alert" or (kind == "flow" and bool(update.get("anomaly_reason")))
+
+
+def alert_key(update: dict) -> tuple:
+    """Versions of a flow alert are superseded only by ones with the same reason."""
+    return (*update_key(update), update.get("anomaly_reason"))
+
+
+def _strip_port(endpoint: str | None) -> str | None:
+    if not endpoint:
+        return None
+    host, sep, port = endpoint.rpartition(":")
+    return host if sep and port.isdigit() else endpoint
+
+
+# Update kinds that reference hosts; the rest (system_stats, ...) are global
+IP_KINDS = frozenset({"flow", "graph_edge", "critical_alert"})
+
+
+def update_ips(update: dict) -> list:
+    """IPs an update refers to; flow ids look like 'a:1234 -> b:80'."""
+    kind = update_kind(update)
+    if kind in ("flow", "critical_alert"):
+        flow = update.get("flow") or update.get("flow_id") or ""
+        return [ip for ip in (_strip_port(p.strip()) for p in flow.split("->")) if ip]
+    if kind == "graph_edge":
+        return [ip for ip in (_strip_port(update.get("source")), _strip_port(update.get("target"))) if ip]
+    return []
+
+
+def build_index(updates: list) -> dict:
+    """Positions of each update keyed by type and by IP, computed once per
+    frame at the send site so subscribers only touch what they asked for."""
+    by_type, by_ip = {}, {}
+    for pos, update in enumerate(updates):
+        by_type.setdefault(update_kind(update), []).append(pos)
+        for ip in update_ips(update):
+            by_ip.setdefault(ip, []).append(pos)
+    return {"by_type": by_type, "by_ip": by_ip}
+
+
+def _rank(update: dict, field: str) -> float:
+    try:
+        return float(update.get(field) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class BroadcastCoalescer:
+    """Keeps the latest update per flow/edge/port key and flushes one merged
+    frame per tick containing only the keys that changed since the last one.
+
+    The latest-per-key state doubles as a materialized view for snapshots, and
+    recent frames are kept in a sequence-numbered ring so reconnecting clients
+    can catch up with just the delta.
+
+    `submit` is called from sync views (worker threads); the flush loop and
+    the snapshot service run on the ASGI event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+        self._dirty = set()
+        self._tasks = []
+        # Changes on restart so clients can't resume against a different history
+        self.stream_id = secrets.token_hex(4)
+        self.seq = 0
+        self._ring = deque(maxlen=int(stream_setting("RING_SIZE")))
+        self.received = 0
+        self.frames_sent = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and not any(t.done() for t in self._tasks)
+
+    def submit(self, updates):
+        now = time.time()
+        with self._lock:
+            for update in updates:
+                if not isinstance(update, dict):
+                    continue
+                # Retractions from Pathway's HTTP sink are always followed by the replacement row
+                if update.get("diff") == -1:
+                    continue
+                key = update_key(update)
+                self._state[key] = (update, now)
+                self._dirty.add(key)
+                self.received += 1
+
+    async def ensure_started(self):
+        if not self.running:
+            for task in self._tasks:
+                task.cancel()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run()), loop.create_task(self._serve_snapshots())]
+
+    @staticmethod
+    def _select(by_kind: dict, keep_alerts: bool = False) -> tuple[list, list]:
+        """Caps each kind's (key, update) pairs at its TOP_N. Returns the
+        frame and the keys that missed the cut. With keep_alerts, alerts
+        are kept on top of the cap."""
+        top_n = stream_setting("TOP_N")
+        frame, overflow = [], []
+        for kind, entries in by_kind.items():
+            if kind in top_n:
+                field, limit = top_n[kind]
+                entries.sort(key=lambda e: _rank(e[1], field), reverse=True)
+                cut = entries[limit:]
+                entries = entries[:limit]
+                if keep_alerts:
+                    entries.extend(e for e in cut if is_alert(e[1]))
+                    cut = [e for e in cut if not is_alert(e[1])]
+                overflow.extend(key for key, _ in cut)
+            frame.extend(update for _, update in entries)
+        return frame, overflow
+
+    def _take_frame(self) -> list:
+        now = time.time()
+        ttl = stream_setting("STATE_TTL")
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            by_kind = {}
+            for key in dirty:
+                entry = self._state.get(key)
+                if entry is not None:
+                    by_kind.setdefault(key[0], []).append((key, entry[0]))
+
+            stale = [k for k, (_, ts) in self._state.items() if now - ts > ttl]
+            for key in stale:
+                del self._state[key]
+
+            frame, overflow = self._select(by_kind)
+            # Changes that missed the cut go out in a later frame
+            self._dirty.update(overflow)
+        return frame
+
+    def snapshot(self) -> list:
+        """Current view, capped the same way as frames except for alerts."""
+        with self._lock:
+            by_kind = {}
+            for key, (update, _) in self._state.items():
+                by_kind.setdefault(key[0], []).append((key, update))
+        return self._select(by_kind, keep_alerts=True)[0]
+
+    def delta_since(self, since: int) -> list | None:
+        """Updates from frames after `since`, merged by key. None if the ring
+        no longer reaches back that far."""
+        if since > self.seq:
+            return None
+        if since == self.seq:
+            return []
+        if not self._ring or self._ring[0][0] > since + 1:
+            return None
+        merged = {}
+        for seq, frame in self._ring:
+            if seq > since:
+                for update in frame:
+                    merged[update_key(update)] = update
+        return list(merged.values())
+
+    async def _serve_snapshots(self):
+        channel_layer = get_channel_layer()
+        while True:
+            request = await channel_layer.receive(SNAPSHOT_CHANNEL)
+            try:
+                reply_to = request["reply_to"]
+                since = request.get("since")
+                updates = None
+                # Anything but a sequence number gets a full snapshot
+                if str(since).isdigit() and request.get("stream") == self.stream_id:
+                    updates = self.delta_since(int(since))
+                kind = "delta"
+                if updates is None:
+                    kind, updates = "snapshot", self.snapshot()
+                await channel_layer.send(reply_to, {
+                    "type": "send_snapshot",
+                    "kind": kind,
+                    "seq": self.seq,
+                    "stream": self.stream_id,
+                    "updates": updates,
+                })
+            except Exception:
+                logger.exception("Snapshot request failed")
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        interval = 1.0 / max(float(stream_setting("FLUSH_HZ")), 0.1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                frame = self._take_frame()
+                if not frame:
+                    continue
+                self.seq += 1
+                self._ring.append((self.seq, frame))
+                message = {"type": "batch", "seq": self.seq, "stream": self.stream_id, "updates": frame}
+                # Sent alongside the encoded payload so clients skipping the frame can hold them
+                alerts = [u for u in frame if is_alert(u)]
+                for encoding in available_encodings():
+                    group = group_for(encoding)
+                    if has_no_members(channel_layer, group):
+                        continue
+                    await channel_layer.group_send(group, {**encode_message(message, encoding), "alerts": alerts})
+                if not has_no_members(channel_layer, FILTERED_GROUP):
+                    await channel_layer.group_send(FILTERED_GROUP, {
+                        "type": "send_filtered_update",
+                        "seq": self.seq,
+                        "stream": self.stream_id,
+                        "updates": frame,
+                        "index": build_index(frame),
+                    })
+                self.frames_sent += 1
+            except Exception:
+                logger.exception("Broadcast flush failed")
+
+
+coalescer = BroadcastCoalescer()
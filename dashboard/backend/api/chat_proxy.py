@@ -0,0 +1,100 @@
+"""
+Async client for the engine's chat endpoints.
+
+One httpx.AsyncClient holds keep-alive connections to the engine for the
+whole process. At most NETFLOW_CHAT_PROXY_CONCURRENCY requests are in flight;
+one that can't get a connection within NETFLOW_CHAT_PROXY_QUEUE_TIMEOUT
+seconds fails with httpx.PoolTimeout instead of queueing behind a slow model.
+
+Identical questions (same text, model and selected rows) that arrive while
+one is already being answered share that upstream call. The call is
+cancelled once every analyst waiting on it has disconnected.
+"""
+import asyncio
+import json
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+ENGINE_URL = os.environ.get("NETFLOW_ENGINE_URL", "http://localhost:8011")
+# Engine side path that streams answers as Server-Sent Events (chat_stream.py)
+ENGINE_STREAM_URL = os.environ.get("NETFLOW_CHAT_STREAM_URL", "http://localhost:8012/stream")
+MAX_CONCURRENCY = int(os.environ.get("NETFLOW_CHAT_PROXY_CONCURRENCY", 32))
+QUEUE_TIMEOUT = float(os.environ.get("NETFLOW_CHAT_PROXY_QUEUE_TIMEOUT", 5))
+TIMEOUT = httpx.Timeout(30.0, connect=3.05, pool=QUEUE_TIMEOUT)
+
+
+class ChatProxy:
+    def __init__(self):
+        self._loop = None
+        self._client = None
+        self._inflight = {}  # payload key -> [upstream task, waiters]
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def _bind(self) -> httpx.AsyncClient:
+        # The client and in-flight tasks belong to one event loop. Daphne runs
+        # a single loop per process; the dev server gets a fresh one per request.
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._inflight = {}
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+                timeout=TIMEOUT,
+            )
+        return self._client
+
+    async def _call(self, client: httpx.AsyncClient, payload: dict):
+        self.calls += 1
+        response = await client.post(ENGINE_URL, json=payload)
+        return response.status_code, response.json()
+
+    async def ask(self, payload: dict):
+        """Returns (status code, JSON body) from the engine's query endpoint."""
+        client = self._bind()
+        key = json.dumps(payload, sort_keys=True)
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(self._call(client, payload)), 0]
+            self._inflight[key] = entry
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            # shield: one analyst leaving must not cancel the others' answer
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                self.cancelled += 1
+                self._forget(key, entry)
+                entry[0].cancel()
+                logger.info("Chat request cancelled: all clients disconnected")
+
+    def _forget(self, key: str, entry: list):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def stream(self, payload: dict):
+        """Yields the engine's SSE stream as raw bytes; closing the generator
+        closes the upstream request."""
+        async with self._bind().stream("POST", ENGINE_STREAM_URL, json=payload) as response:
+            async for chunk in response.aiter_raw():
+                yield chunk
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._inflight),
+        }
+
+
+chat_proxy = ChatProxy()
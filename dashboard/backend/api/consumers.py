@@ -1,13 +1,211 @@
+import asyncio
 import json
+import time
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from .backpressure import CLIENTS, ClientFlowControl
+from .broadcast import (
+    ENCODING_JSON, FILTERED_GROUP, SNAPSHOT_CHANNEL, SUBPROTOCOL_PREFIX,
+    alert_key, available_encodings, build_index, encode_message, group_for, is_alert, stream_setting,
+    update_key,
+)
+from .subscriptions import Subscription
+
+# Close code sent to clients that fall too far behind (private-use range)
+CLOSE_TOO_SLOW = 4008
+
 class PacketConsumer(AsyncWebsocketConsumer):
+    def negotiate_encoding(self):
+        """Pick the wire encoding: subprotocol first, then ?encoding=, else JSON."""
+        supported = available_encodings()
+        for proto in self.scope.get("subprotocols", []):
+            encoding = proto[len(SUBPROTOCOL_PREFIX):] if proto.startswith(SUBPROTOCOL_PREFIX) else None
+            if encoding in supported:
+                return encoding, proto
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        encoding = query.get("encoding", [ENCODING_JSON])[0]
+        return (encoding if encoding in supported else ENCODING_JSON), None
+
     async def connect(self):
-        await self.channel_layer.group_add("packets", self.channel_name)
-        await self.accept()
+        self.encoding, subprotocol = self.negotiate_encoding()
+        self.subscription = None
+        self.pending = {}
+        # Alerts from frames this client skipped, delivered with the resync
+        self.held_alerts = {}
+        self.pending_flush = None
+        self.last_sent = 0.0
+        self.last_seq = 0
+        self.stream_id = None
+        self.flow = ClientFlowControl(
+            budget_bytes=int(stream_setting("CLIENT_BUFFER_BYTES")),
+            max_lag=float(stream_setting("MAX_CLIENT_LAG")),
+        )
+        self.dropped = False
+        CLIENTS[self.channel_name] = self
+        self.group_name = group_for(self.encoding)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept(subprotocol=subprotocol)
+
+        # Reconnecting clients pass ?since=<seq>&stream=<id> to get only what they missed
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        since = query.get("since", [None])[0]
+        await self.request_snapshot(
+            since=int(since) if since and since.isdigit() else None,
+            stream=query.get("stream", [None])[0],
+        )
+
+    async def request_snapshot(self, since=None, stream=None):
+        await self.channel_layer.send(SNAPSHOT_CHANNEL, {
+            "type": "snapshot.request",
+            "reply_to": self.channel_name,
+            "since": since,
+            "stream": stream,
+        })
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("packets", self.channel_name)
+        CLIENTS.pop(self.channel_name, None)
+        if self.pending_flush:
+            self.pending_flush.cancel()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def switch_group(self, group_name):
+        if group_name != self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.group_name = group_name
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or "")
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+
+        action = message.get("action")
+        if action == "ack":
+            try:
+                self.flow.on_ack(int(message.get("seq") or 0))
+            except (TypeError, ValueError):
+                return
+            if self.flow.ready_to_resync():
+                # Caught up again: replace everything skipped with one merged delta
+                self.flow.start_resync()
+                await self.request_snapshot(since=self.flow.sent_seq, stream=self.stream_id)
+        elif action == "subscribe":
+            try:
+                self.subscription = Subscription.from_message(message)
+            except (TypeError, ValueError) as e:
+                await self.send(text_data=json.dumps({"type": "error", "error": f"Invalid subscription: {e}"}))
+                return
+            self.pending = {}
+            await self.switch_group(FILTERED_GROUP)
+            await self.send(text_data=json.dumps({"type": "subscribed"}))
+            await self.request_snapshot()
+        elif action == "unsubscribe":
+            self.subscription = None
+            self.pending = {}
+            await self.switch_group(group_for(self.encoding))
+            await self.send(text_data=json.dumps({"type": "unsubscribed"}))
+            await self.request_snapshot()
+        elif action == "resume":
+            since = message.get("since")
+            await self.request_snapshot(
+                since=int(since) if str(since).isdigit() else None,
+                stream=message.get("stream"),
+            )
+
+    async def send_encoded(self, event):
+        # Payloads are pre-encoded once at the group_send site
+        if "bytes" in event:
+            payload = event["bytes"]
+            await self.send(bytes_data=payload)
+        elif "text" in event:
+            payload = event["text"]
+            await self.send(text_data=payload)
+        else:
+            payload = json.dumps(event["data"])
+            await self.send(text_data=payload)
+        self.flow.on_sent(event.get("seq"), len(payload))
+
+    async def admit_live_frame(self, event, nbytes):
+        """Flow control for live frames; False means skip this frame."""
+        if self.dropped:
+            return False
+        if self.flow.too_far_behind():
+            self.dropped = True
+            CLIENTS.pop(self.channel_name, None)
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self.close(code=CLOSE_TOO_SLOW)
+            return False
+        self.stream_id = event.get("stream") or self.stream_id
+        return self.flow.admit(nbytes)
+
+    def hold_alerts(self, updates):
+        for update in updates or ():
+            if is_alert(update):
+                self.held_alerts[alert_key(update)] = update
 
     async def send_packet_update(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        payload = event.get("bytes") or event.get("text") or ""
+        if await self.admit_live_frame(event, len(payload)):
+            await self.send_encoded(event)
+        else:
+            self.hold_alerts(event.get("alerts"))
+
+    async def send_filtered_update(self, event):
+        if self.subscription is None:
+            return
+        self.last_seq = event["seq"]
+        if not await self.admit_live_frame(event, 0):
+            # The resync delta covers superseded state; alerts are held
+            self.hold_alerts(self.pending.values())
+            self.hold_alerts(self.subscription.select(event["updates"], event["index"]))
+            self.pending = {}
+            return
+        selected = self.subscription.select(event["updates"], event["index"])
+        if not selected:
+            return
+        for update in selected:
+            self.pending[update_key(update)] = update
+
+        wait = self.last_sent + self.subscription.min_interval - time.monotonic()
+        if wait <= 0:
+            await self.flush_pending()
+        elif self.pending_flush is None:
+            self.pending_flush = asyncio.get_running_loop().call_later(
+                wait, lambda: asyncio.ensure_future(self.flush_pending())
+            )
+
+    async def flush_pending(self):
+        self.pending_flush = None
+        if not self.pending:
+            return
+        updates, self.pending = list(self.pending.values()), {}
+        self.last_sent = time.monotonic()
+        await self.send_encoded(encode_message({
+            "type": "batch",
+            "seq": self.last_seq,
+            "stream": self.stream_id,
+            "updates": updates,
+        }, self.encoding))
+
+    async def send_snapshot(self, event):
+        updates = event["updates"]
+        if self.held_alerts:
+            # Held alerts go first so the delta's newer state wins on screen
+            present = {alert_key(u) for u in updates if is_alert(u)}
+            held = [u for key, u in self.held_alerts.items() if key not in present]
+            updates, self.held_alerts = held + updates, {}
+        if self.subscription is not None:
+            updates = self.subscription.select(updates, build_index(updates))
+        self.stream_id = event["stream"]
+        self.flow.resynced()
+        await self.send_encoded(encode_message({
+            "type": event["kind"],
+            "seq": event["seq"],
+            "stream": event["stream"],
+            "updates": updates,
+        }, self.encoding))
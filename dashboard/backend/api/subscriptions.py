@@ -0,0 +1,106 @@
+import ipaddress
+
+from .broadcast import IP_KINDS, update_kind
+
+# Clients that never subscribe keep receiving the shared, pre-encoded firehose.
+# A subscription message looks like:
+#   {"action": "subscribe", "types": ["flow", "critical_alert"], "min_score": 0.5,
+#    "ips": ["192.168.1.5", "10.0.0.0/24"], "max_rate": 2}
+
+MAX_FILTER_IPS = 256
+# Per-subscription memo of CIDR membership for IPs seen in frames
+MAX_CIDR_CACHE = 4096
+
+
+class Subscription:
+    """A compiled client filter. Raises ValueError on malformed requests."""
+
+    def __init__(self, types=None, min_score=None, ips=None, max_rate=None):
+        if isinstance(types, str):
+            types = [types]
+        elif types is not None and not isinstance(types, list):
+            raise ValueError("types must be a list")
+        if not all(isinstance(t, str) for t in types or ()):
+            raise ValueError("types must be strings")
+        self.types = frozenset(types) if types else None
+        self.min_score = float(min_score) if min_score is not None else None
+        self.max_rate = float(max_rate) if max_rate else None
+        if self.max_rate is not None and self.max_rate <= 0:
+            raise ValueError("max_rate must be positive")
+
+        self.exact_ips = set()
+        self.networks = []
+        for entry in (ips or [])[:MAX_FILTER_IPS]:
+            if "/" in str(entry):
+                self.networks.append(ipaddress.ip_network(entry, strict=False))
+            else:
+                self.exact_ips.add(str(ipaddress.ip_address(entry)))
+        self.filters_ips = bool(self.exact_ips or self.networks)
+        self._cidr_cache = {}
+
+    @classmethod
+    def from_message(cls, message: dict):
+        return cls(
+            types=message.get("types"),
+            min_score=message.get("min_score"),
+            ips=message.get("ips"),
+            max_rate=message.get("max_rate"),
+        )
+
+    @property
+    def min_interval(self) -> float:
+        return 1.0 / self.max_rate if self.max_rate else 0.0
+
+    def _ip_matches(self, ip: str) -> bool:
+        if ip in self.exact_ips:
+            return True
+        if not self.networks:
+            return False
+        hit = self._cidr_cache.get(ip)
+        if hit is None:
+            try:
+                addr = ipaddress.ip_address(ip)
+                hit = any(addr in net for net in self.networks)
+            except ValueError:
+                hit = False
+            if len(self._cidr_cache) >= MAX_CIDR_CACHE:
+                self._cidr_cache.clear()
+            self._cidr_cache[ip] = hit
+        return hit
+
+    def select(self, updates: list, index: dict) -> list:
+        candidates = None
+
+        if self.types is not None:
+            candidates = set()
+            for kind in self.types:
+                candidates.update(index["by_type"].get(kind, ()))
+
+        if self.filters_ips:
+            ip_hits = set()
+            by_ip = index["by_ip"]
+            if self.networks:
+                for ip, positions in by_ip.items():
+                    if self._ip_matches(ip):
+                        ip_hits.update(positions)
+            else:
+                for ip in self.exact_ips:
+                    ip_hits.update(by_ip.get(ip, ()))
+            # IP-less messages (system_stats, ...) only pass if asked for by type
+            for kind in (self.types or ()):
+                if kind not in IP_KINDS:
+                    ip_hits.update(index["by_type"].get(kind, ()))
+            candidates = ip_hits if candidates is None else candidates & ip_hits
+
+        positions = sorted(candidates) if candidates is not None else range(len(updates))
+        selected = []
+        for pos in positions:
+            update = updates[pos]
+            if self.min_score is not None and update_kind(update) == "flow":
+                try:
+                    if float(update.get("anomaly_score") or 0) < self.min_score:
+                        continue
+                except (TypeError, ValueError):
+                    continue
+            selected.append(update)
+        return selected
@@ -1,3 +1,145 @@
-from django.test import TestCase
+import asyncio
+import json
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, override_settings
+
+from .backpressure import ClientFlowControl
+from .broadcast import SNAPSHOT_CHANNEL, BroadcastCoalescer
+from .consumers import PacketConsumer
+
+STREAM = {
+    "FLUSH_HZ": 5,
+    "STATE_TTL": 30.0,
+    "RING_SIZE": 3,
+    "CLIENT_BUFFER_BYTES": 1000,
+    "MAX_CLIENT_LAG": 15.0,
+    "TOP_N": {"flow": ("anomaly_score", 2)},
+}
+
+
+def flow(n, score=0.1, reason=""):
+    return {"flow": f"10.0.0.{n}:1000 -> 10.0.1.1:80", "anomaly_score": score, "anomaly_reason": reason}
+
+
+def flush(coalescer):
+    """One tick of the flush loop, without the channel layer."""
+    frame = coalescer._take_frame()
+    if frame:
+        coalescer.seq += 1
+        coalescer._ring.append((coalescer.seq, frame))
+    return frame
+
+
+@override_settings(NETFLOW_STREAM=STREAM)
+class BroadcastCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.coalescer = BroadcastCoalescer()
+
+    def test_delta_since_current_seq_is_empty(self):
+        self.coalescer.submit([flow(1)])
+        flush(self.coalescer)
+        self.assertEqual(self.coalescer.delta_since(1), [])
+
+    def test_delta_since_future_seq_needs_snapshot(self):
+        self.coalescer.submit([flow(1)])
+        flush(self.coalescer)
+        self.assertIsNone(self.coalescer.delta_since(2))
+
+    def test_delta_since_merges_frames_by_key(self):
+        for score in (0.1, 0.2, 0.3):
+            self.coalescer.submit([flow(1, score)])
+            flush(self.coalescer)
+        self.assertEqual(self.coalescer.delta_since(1), [flow(1, 0.3)])
+
+    def test_delta_since_before_ring_needs_snapshot(self):
+        for n in range(5):
+            self.coalescer.submit([flow(n)])
+            flush(self.coalescer)
+        # Frames 3-5 are left in a ring of 3
+        self.assertIsNone(self.coalescer.delta_since(1))
+        self.assertEqual(self.coalescer.delta_since(2), [flow(2), flow(3), flow(4)])
+
+    def test_overflow_goes_out_in_next_frame(self):
+        self.coalescer.submit([flow(n, score=n / 10) for n in range(1, 6)])
+        self.assertEqual(flush(self.coalescer), [flow(5, 0.5), flow(4, 0.4)])
+        self.assertEqual(flush(self.coalescer), [flow(3, 0.3), flow(2, 0.2)])
+        self.assertEqual(flush(self.coalescer), [flow(1, 0.1)])
+        self.assertEqual(flush(self.coalescer), [])
+
+    def test_snapshot_keeps_alerts_beyond_top_n(self):
+        self.coalescer.submit([flow(n, score=0.9) for n in range(1, 4)])
+        self.coalescer.submit([flow(4, score=0.1, reason="Port Scan (many destination ports)")])
+        snapshot = self.coalescer.snapshot()
+        self.assertEqual(len(snapshot), 3)
+        self.assertIn(flow(4, score=0.1, reason="Port Scan (many destination ports)"), snapshot)
+
+    async def test_bad_since_gets_full_snapshot(self):
+        self.coalescer.submit([flow(1)])
+        flush(self.coalescer)
+        layer = get_channel_layer()
+        server = asyncio.create_task(self.coalescer._serve_snapshots())
+        try:
+            for since in ("abc", "1.5", None):
+                reply_to = await layer.new_channel()
+                await layer.send(SNAPSHOT_CHANNEL, {"reply_to": reply_to, "since": since, "stream": self.coalescer.stream_id})
+                reply = await asyncio.wait_for(layer.receive(reply_to), 1)
+                self.assertEqual(reply["kind"], "snapshot")
+        finally:
+            server.cancel()
+
+
+class ClientFlowControlTests(SimpleTestCase):
+    def test_not_flow_controlled_until_first_ack(self):
+        flow_control = ClientFlowControl(budget_bytes=100, max_lag=15.0)
+        flow_control.on_sent(1, 500)
+        self.assertTrue(flow_control.admit(500))
+
+    def test_skips_over_budget_and_resyncs_when_drained(self):
+        flow_control = ClientFlowControl(budget_bytes=100, max_lag=15.0)
+        flow_control.on_ack(0)
+        flow_control.on_sent(1, 80)
+        self.assertFalse(flow_control.admit(40))
+        # Once behind, frames are skipped even if they would fit
+        self.assertFalse(flow_control.admit(1))
+        self.assertFalse(flow_control.ready_to_resync())
+        flow_control.on_ack(1)
+        self.assertTrue(flow_control.ready_to_resync())
+        flow_control.start_resync()
+        flow_control.resynced()
+        self.assertTrue(flow_control.admit(40))
+
+
+class HeldAlertTests(SimpleTestCase):
+    def setUp(self):
+        self.consumer = PacketConsumer()
+        self.consumer.encoding = "json"
+        self.consumer.subscription = None
+        self.consumer.held_alerts = {}
+        self.consumer.dropped = False
+        self.consumer.stream_id = None
+        self.consumer.flow = ClientFlowControl(budget_bytes=100, max_lag=15.0)
+        self.sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            self.sent.append(json.loads(text_data))
+
+        self.consumer.send = send
+
+    async def test_skipped_alerts_are_delivered_with_the_resync(self):
+        alert = {"type": "critical_alert", "flow": "a:1 -> b:2", "reason": "Port Scan", "detected_at": 1.0}
+        self.consumer.flow.on_ack(0)
+        self.consumer.flow.on_sent(1, 100)
+        await self.consumer.send_packet_update({"text": "x" * 50, "seq": 2, "stream": "s", "alerts": [alert]})
+        self.assertEqual(self.sent, [])
+
+        await self.consumer.send_snapshot({"kind": "delta", "seq": 2, "stream": "s", "updates": [flow(1)]})
+        self.assertEqual(self.sent[0]["updates"], [alert, flow(1)])
+        self.assertEqual(self.consumer.held_alerts, {})
+
+    async def test_held_alert_superseded_by_the_delta(self):
+        old = flow(1, 0.5, "Port Scan (many destination ports)")
+        new = flow(1, 0.6, "Port Scan (many destination ports)")
+        self.consumer.hold_alerts([old])
+        await self.consumer.send_snapshot({"kind": "delta", "seq": 2, "stream": "s", "updates": [new]})
+        self.assertEqual(self.sent[0]["updates"], [new])
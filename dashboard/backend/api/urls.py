@@ -1,9 +1,11 @@
 from django.urls import path
-from .views import PacketUpdateView, ChatProxyView, NetworkDevicesView, SpoofStartView, SpoofStopView, WhitelistSettingsView, NetworkInterfacesView
+from .views import PacketUpdateView, StreamStatsView, ChatProxyView, ChatStreamView, NetworkDevicesView, SpoofStartView, SpoofStopView, WhitelistSettingsView, NetworkInterfacesView
 
 urlpatterns = [
     path('update/', PacketUpdateView.as_view(), name='packet-update'),
+    path('stream/stats/', StreamStatsView.as_view(), name='stream-stats'),
     path('chat/', ChatProxyView.as_view(), name='chat-proxy'),
+    path('chat/stream/', ChatStreamView.as_view(), name='chat-stream'),
     path('network/devices/', NetworkDevicesView.as_view(), name='network-devices'),
     path('network/interfaces/', NetworkInterfacesView.as_view(), name='network-interfaces'),
     path('network/spoof/start/', SpoofStartView.as_view(), name='spoof-start'),
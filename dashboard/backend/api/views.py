@@ -1,15 +1,22 @@
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-import requests
+import httpx
 import json
 import subprocess
 import os
 import re
 from pathlib import Path
 
+from .backpressure import CLIENTS
+from .broadcast import coalescer
+from .chat_proxy import chat_proxy
+
 class NetworkInterfacesView(APIView):
     """Returns available network interfaces from the OS."""
     def get(self, request):
@@ -40,42 +47,86 @@ class NetworkInterfacesView(APIView):
 
 class PacketUpdateView(APIView):
     def post(self, request):
-        channel_layer = get_channel_layer()
         data = request.data
         
         updates = data if isinstance(data, list) else [data]
         
-        for update in updates:
-            async_to_sync(channel_layer.group_send)(
-                "packets",
+        # Merged into the next coalesced frame instead of one group_send per update
+        coalescer.submit(updates)
+        if not coalescer.running:
+            async_to_sync(coalescer.ensure_started)()
+        return Response({"status": f"queued {len(updates)} updates"}, status=status.HTTP_200_OK)
+
+class StreamStatsView(APIView):
+    """Live stream health for this process: coalescer counters, per-client lag and chat proxy counters."""
+    def get(self, request):
+        return Response({
+            "coalescer": {
+                "stream": coalescer.stream_id,
+                "seq": coalescer.seq,
+                "received": coalescer.received,
+                "frames_sent": coalescer.frames_sent,
+            },
+            "clients": [
                 {
-                    "type": "send_packet_update",
-                    "data": update
+                    "client": str(consumer.scope.get("client")),
+                    "encoding": consumer.encoding,
+                    "subscribed": consumer.subscription is not None,
+                    **consumer.flow.stats(),
                 }
-            )
-        return Response({"status": f"broadcasted {len(updates)} updates"}, status=status.HTTP_200_OK)
+                for consumer in list(CLIENTS.values())
+            ],
+            "chat_proxy": chat_proxy.stats(),
+        })
 
-class ChatProxyView(APIView):
-    def post(self, request):
-        query = request.data.get("messages")
-        model = request.data.get("model")
-        
-        if not query:
-            return Response({"error": "No query provided"}, status=status.HTTP_400_BAD_REQUEST)
-        
+def _chat_payload(request):
+    """Returns (payload, None) or (None, error response) for a chat request body."""
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None, JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not data.get("messages"):
+        return None, JsonResponse({"error": "No query provided"}, status=400)
+    return {
+        "messages": data.get("messages"),
+        "model": data.get("model"),
+        "selected_row": data.get("selected_row"),
+    }, None
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ChatProxyView(View):
+    """Forwards a question to the engine without holding a worker thread."""
+    async def post(self, request):
+        payload, error = _chat_payload(request)
+        if error:
+            return error
         try:
-            response = requests.post(
-                "http://localhost:8011",
-                json={
-                    "messages": query, 
-                    "model": model,
-                    "selected_row": request.data.get("selected_row")
-                },
-                timeout=30
-            )
-            return Response(response.json(), status=response.status_code)
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            status_code, data = await chat_proxy.ask(payload)
+        except httpx.PoolTimeout:
+            return JsonResponse({"error": "Too many questions in flight, try again shortly"}, status=503)
+        except (httpx.HTTPError, ValueError) as e:
+            return JsonResponse({"error": str(e) or type(e).__name__}, status=500)
+        return JsonResponse(data, status=status_code, safe=False)
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ChatStreamView(View):
+    """Relays the engine's SSE answer to the browser as it is generated."""
+    async def post(self, request):
+        payload, error = _chat_payload(request)
+        if error:
+            return error
+
+        async def relay():
+            try:
+                async for chunk in chat_proxy.stream(payload):
+                    yield chunk
+            except httpx.HTTPError as e:
+                yield f"data: {json.dumps({'error': str(e) or type(e).__name__})}\n\n".encode()
+
+        response = StreamingHttpResponse(relay(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 SPOOF_PROCESSES = []
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,10 +76,37 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 ASGI_APPLICATION = 'backend.asgi.application'
 
 # Channel layer configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# The in-memory layer only works inside one process. Multi-worker deployments
+# (start_sentinel.py --workers N) set NETFLOW_CHANNEL_LAYER=redis and share a
+# local Redis instance.
+if os.environ.get('NETFLOW_CHANNEL_LAYER') == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                # redis-py's pool raises past 100 connections, which a burst of
+                # browsers connecting to one worker (group_add + snapshot) exceeds
+                'hosts': [{
+                    'address': os.environ.get('NETFLOW_REDIS_URL', 'redis://127.0.0.1:6379'),
+                    'max_connections': 1024,
+                }],
+                'capacity': 500,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Live stream coalescing (see api/broadcast.py for defaults)
+NETFLOW_STREAM = {
+    'FLUSH_HZ': 5,
+    'STATE_TTL': 30.0,
+    'CLIENT_BUFFER_BYTES': 1024 * 1024,
+    'MAX_CLIENT_LAG': 15.0,
 }
 
 # CORS configuration
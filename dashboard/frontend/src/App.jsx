@@ -136,6 +136,8 @@ const App = () => {
   const [theme, setTheme] = useState(localStorage.getItem('theme') || 'dark');
   const messageQueue = useRef([]);
   const lastGraphUpdate = useRef(0);
+  // Critical alerts already shown, so snapshots and resumes don't repeat them
+  const criticalSeen = useRef(new Set());
 
   const [setupStep, setSetupStep] = useState(1);
   const [monitoringMethod, setMonitoringMethod] = useState(1);
@@ -148,7 +150,7 @@ const App = () => {
   }, [isMonitoring]);
   const [selectedModel, setSelectedModel] = useState("arcee-ai/trinity-large-preview:free");
   const [showSettings, setShowSettings] = useState(false);
-  const [whitelist, setWhitelist] = useState({ ips: [], ports: [], anomaly_threshold: 0, capture_interface: 'wlo1', logging: { all_packets: true, anomalies: true, rag_context: true, graph_edges: true } });
+  const [whitelist, setWhitelist] = useState({ ips: [], ports: [], anomaly_threshold: 0, capture_interface: 'wlo1', logging: { all_packets: true, anomalies: true, rag_context: true, graph_edges: true, critical_alerts: true } });
   const [portsText, setPortsText] = useState('');
   const [isLoadingDevices, setIsLoadingDevices] = useState(false);
   const [isSpoofingLoading, setIsSpoofingLoading] = useState(false);
@@ -202,7 +204,7 @@ const App = () => {
     try {
       const res = await axios.get('http://localhost:8000/api/settings/whitelist/');
       const data = res.data;
-      if (!data.logging) data.logging = { all_packets: true, anomalies: true, rag_context: true, graph_edges: true };
+      if (!data.logging) data.logging = { all_packets: true, anomalies: true, rag_context: true, graph_edges: true, critical_alerts: true };
       setWhitelist(data);
       setPortsText((data.ports || []).join(', '));
     } catch (e) { console.error(e); }
@@ -222,14 +224,72 @@ const App = () => {
   useEffect(() => {
     // WebSocket Connection
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const ws = new WebSocket(`${protocol}//${window.location.hostname}:8000/ws/packets/`);
-
-    ws.onmessage = (event) => {
-      if (!isMonitoringRef.current) return;
+    const wsPort = import.meta.env.VITE_WS_PORT || 8000;
+    let ws = null;
+    let reconnectTimer = null;
+    let closed = false;
+    // Last frame seen, so a reconnect only receives what was missed
+    const cursor = { seq: null, stream: null };
+
+    const showCriticalAlerts = (alerts) => {
+      const seen = criticalSeen.current;
+      if (seen.size > 5000) seen.clear();
+      const fresh = alerts.filter(a => {
+        const key = `${a.flow}|${a.reason}|${a.detected_at}`;
+        if (seen.has(key)) return false;
+        seen.add(key);
+        return true;
+      });
+      if (fresh.length === 0) return;
+      setChatMessages(prev => [...prev, ...fresh.map(a => {
+        // Detection-to-screen latency (capture time of the triggering packet to now)
+        const latency = Date.now() / 1000 - Number(a.detected_at);
+        return {
+          role: 'assistant',
+          _key: `critical-${a.flow}-${a.reason}-${a.detected_at}`,
+          text: `🚨 CRITICAL: ${a.reason} | ${a.flow || 'Unknown flow'} | Score: ${Number(a.score).toFixed(2)} · on screen ${latency.toFixed(2)}s after detection`,
+        };
+      })]);
+    };
 
-      const data = JSON.parse(event.data);
-      messageQueue.current.push(data);
+    const connect = () => {
+      const resume = cursor.seq !== null ? `?since=${cursor.seq}&stream=${cursor.stream}` : '';
+      ws = new WebSocket(`${protocol}//${window.location.hostname}:${wsPort}/ws/packets/${resume}`);
+      // The direct broadcaster greets with a legacy hello: no acks, resume or subscriptions
+      let legacy = false;
+
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'hello') {
+          legacy = Boolean(data.legacy);
+          return;
+        }
+        if (data.type === 'error') {
+          console.warn('Stream:', data.error);
+          return;
+        }
+        if (data.seq !== undefined && !legacy) {
+          cursor.seq = data.seq;
+          cursor.stream = data.stream;
+          // Acks drive the server's per-client flow control
+          if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ action: 'ack', seq: data.seq }));
+        }
+        if (!isMonitoringRef.current) return;
+
+        // Django coalesces updates into merged frames (snapshot/delta on connect);
+        // the direct broadcaster sends them one by one
+        const updates = (data.type === 'batch' || data.type === 'snapshot' || data.type === 'delta') ? data.updates : [data];
+        // Critical alerts skip the 2 s UI loop
+        const critical = updates.filter(u => u.type === 'critical_alert');
+        if (critical.length > 0) showCriticalAlerts(critical);
+        messageQueue.current.push(...(critical.length > 0 ? updates.filter(u => u.type !== 'critical_alert') : updates));
+      };
+
+      ws.onclose = () => {
+        if (!closed) reconnectTimer = setTimeout(connect, 2000);
+      };
     };
+    connect();
 
     // UI Update Loop (Throttled to 2 seconds)
     const updateInterval = setInterval(() => {
@@ -248,9 +308,9 @@ const App = () => {
         time: formatTime(representativeData.last_packet_time)
       }].slice(-30));
 
-      const flowUpdates = latestBatch.filter(d => d.type !== 'graph_edge' && d.type !== 'port_alert' && d.type !== 'system_stats');
+      const flowUpdates = latestBatch.filter(d => d.type !== 'graph_edge' && d.type !== 'top_talkers' && d.type !== 'system_stats');
       const graphUpdates = latestBatch.filter(d => d.type === 'graph_edge');
-      const alertUpdates = latestBatch.filter(d => d.type === 'port_alert');
+      const talkerUpdates = latestBatch.filter(d => d.type === 'top_talkers');
       const sysUpdates = latestBatch.filter(d => d.type === 'system_stats');
 
       if (sysUpdates.length > 0) {
@@ -319,18 +379,10 @@ const App = () => {
         setChartHistory(prev => [...prev, { packet_count: 0, time: formatTime(Date.now() / 1000) }].slice(-30));
       }
 
-      if (alertUpdates.length > 0) {
-        setPortAlerts(prev => {
-          const portMap = new Map(prev.map(p => [p.port, p]));
-
-          alertUpdates.forEach(update => {
-            portMap.set(update.port, update);
-          });
-
-          const aggregated = Array.from(portMap.values());
-
-          return aggregated.slice(-20);
-        });
+      // Each top_talkers message is the whole window's ranking; the newest wins
+      if (talkerUpdates.length > 0) {
+        const latest = talkerUpdates[talkerUpdates.length - 1];
+        setPortAlerts((latest.ports?.packets || []).map(([port, packets, bytes]) => ({ port, packets, bytes })));
       }
 
       // 3. Graph Updates (Throttled to 5s)
@@ -455,6 +507,8 @@ const App = () => {
     }, 2000);
 
     return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
       ws.close();
       clearInterval(updateInterval);
     };
@@ -507,15 +561,68 @@ Encryption: ${r.encryption}
 ----------------------------
 ` : '';
 
+    const payload = { messages: message, model: selectedModel, selected_row: rowContext };
+    const replyId = `reply-${Date.now()}`;
+    let started = false;
+    const updateReply = (patch) => {
+      setChatMessages(prev => {
+        if (!prev.some(m => m.id === replyId)) {
+          return [...prev, { id: replyId, role: 'assistant', text: '', ...patch(null) }];
+        }
+        return prev.map(m => (m.id === replyId ? { ...m, ...patch(m) } : m));
+      });
+    };
+
     try {
-      const response = await axios.post('http://localhost:8000/api/chat/', {
-        messages: message,
-        model: selectedModel,
-        selected_row: rowContext
+      // Stream the answer token by token (Server-Sent Events over a POST)
+      const response = await fetch('http://localhost:8000/api/chat/stream/', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
       });
-      setChatMessages(prev => [...prev, { role: 'assistant', text: response.data.result || response.data }]);
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+          if (!raw.startsWith('data:')) continue;
+          const event = JSON.parse(raw.slice(5));
+          if (event.delta) {
+            if (!started) {
+              started = true;
+              setIsTyping(false);
+            }
+            updateReply(m => ({ text: (m ? m.text : '') + event.delta }));
+          } else if (event.error) {
+            started = true;
+            updateReply(m => ({ text: (m && m.text ? m.text + '\n\n' : '') + event.error }));
+          } else if (event.done) {
+            const timing = event.cached
+              ? `cached · ${event.total.toFixed(2)}s`
+              : `first token ${event.ttft.toFixed(2)}s · total ${event.total.toFixed(2)}s`;
+            updateReply(() => ({ timing }));
+          }
+        }
+      }
     } catch (error) {
-      setChatMessages(prev => [...prev, { role: 'assistant', text: 'Error connecting to analysis engine.' }]);
+      if (!started) {
+        // Streaming unavailable: fall back to the one-shot endpoint
+        try {
+          const response = await axios.post('http://localhost:8000/api/chat/', payload);
+          setChatMessages(prev => [...prev, { role: 'assistant', text: response.data.result || response.data }]);
+        } catch (fallbackError) {
+          setChatMessages(prev => [...prev, { role: 'assistant', text: 'Error connecting to analysis engine.' }]);
+        }
+      } else {
+        updateReply(m => ({ text: (m ? m.text : '') + '\n\n_Connection lost before the answer finished._' }));
+      }
     } finally {
       setIsTyping(false);
     }
@@ -724,6 +831,7 @@ Encryption: ${r.encryption}
                     { key: 'anomalies', label: 'Anomaly Events', path: 'docs/anomalies.csv', desc: 'Flows that exceed the anomaly threshold' },
                     { key: 'rag_context', label: 'RAG Context', path: 'docs/rag_context.csv', desc: 'Context fed to the AI assistant' },
                     { key: 'graph_edges', label: 'Graph Edges', path: 'logs/debug_graph_edges.csv', desc: 'Network topology edges' },
+                    { key: 'critical_alerts', label: 'Critical Alerts', path: 'logs/critical_alerts.csv', desc: 'Fast-lane alerts with detection latency' },
                   ].map(({ key, label, path, desc }) => {
                     const enabled = whitelist.logging?.[key] ?? true;
                     return (
@@ -983,7 +1091,7 @@ Encryption: ${r.encryption}
               <div className="flex-1 overflow-y-auto p-4 space-y-4 scrollbar-thin scrollbar-thumb-[var(--scrollbar-thumb)] scrollbar-track-transparent min-h-0">
                 {chatMessages.map((msg, i) => (
                   <div
-                    key={i}
+                    key={msg.id || msg._key || i}
                     className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}
                   >
                     <div
@@ -1004,6 +1112,9 @@ Encryption: ${r.encryption}
                           )
                         }}
                       >{msg.text}</ReactMarkdown>
+                      {msg.timing && (
+                        <div className="mt-2 text-[10px] font-mono text-[var(--text-secondary)]">{msg.timing}</div>
+                      )}
                     </div>
                   </div>
                 ))}
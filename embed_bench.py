@@ -0,0 +1,132 @@
+"""
+Embedder benchmark: PyTorch SentenceTransformer vs. ONNX Runtime int8.
+
+Encodes a corpus of anomaly documents with each backend and reports batch
+throughput, single-question latency, and retrieval agreement with the
+full-precision model (recall@k of its top-k neighbours, plus mean cosine
+between the two backends' vectors for the same text).
+
+The corpus is taken from docs/rag_index.npz when present, otherwise
+synthetic documents in the engine's format are generated.
+
+Usage:
+    python embed_bench.py [--docs 2000] [--threads 2] [--k 10]
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+import numpy as np
+
+import embedders
+from rag_index import INDEX_PATH
+
+REASONS = [
+    "Potential SYN Flood / Scan",
+    "High Volume Transfer (Potential Exfiltration)",
+    "Potential Slow DoS Pattern",
+    "Potential SYN Flood / Scan; Potential Slow DoS Pattern",
+]
+
+QUERIES = [
+    "what's anomalous on 192.168.1.5?",
+    "is anyone scanning my network",
+    "show me possible data exfiltration",
+    "which hosts are sending a lot of bytes",
+    "slow dos attack on port 80",
+    "syn flood against the web server",
+    "traffic to port 22 from 10.0.0.7",
+    "why is this flow anomalous",
+    "most suspicious flows in the last minutes",
+    "high confidence alerts on port 443",
+]
+
+
+def synthetic_docs(n: int) -> list:
+    rng = random.Random(7)
+    docs = []
+    for _ in range(n):
+        src = f"192.168.1.{rng.randint(2, 254)}:{rng.randint(1024, 65535)}"
+        dst = f"10.0.{rng.randint(0, 3)}.{rng.randint(2, 254)}:{rng.choice([22, 53, 80, 443, 3389, 8080])}"
+        docs.append(
+            f"Flow: {src} -> {dst} | "
+            f"Description: {rng.choice(REASONS)} | "
+            f"Score: {rng.random():.2f} | "
+            f"Confidence: {rng.random():.2f} | "
+            f"Packets: {rng.randint(20, 5000)} | "
+            f"Bytes: {rng.randint(1000, 5_000_000)} | "
+            f"Duration: {rng.random() * 10:.2f}s"
+        )
+    return docs
+
+
+def load_corpus(n: int) -> list:
+    if os.path.exists(INDEX_PATH):
+        with np.load(INDEX_PATH, allow_pickle=False) as data:
+            texts = [str(t) for t in data["texts"]][-n:]
+        if texts:
+            print(f"Corpus: {len(texts)} documents from {INDEX_PATH}")
+            return texts
+    print(f"Corpus: {n} synthetic documents")
+    return synthetic_docs(n)
+
+
+def bench(embedder, docs: list, queries: list) -> dict:
+    embedder.encode(docs[:8])  # warm-up
+    started = time.perf_counter()
+    doc_vecs = embedder.encode(docs)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    query_vecs = []
+    for query in queries * 3:
+        t0 = time.perf_counter()
+        vec = embedder.encode([query])[0]
+        latencies.append(time.perf_counter() - t0)
+        if len(query_vecs) < len(queries):
+            query_vecs.append(vec)
+    return {
+        "docs_per_s": len(docs) / elapsed,
+        "query_ms_p50": statistics.median(latencies) * 1000,
+        "doc_vecs": doc_vecs,
+        "query_vecs": np.array(query_vecs),
+    }
+
+
+def top_k(doc_vecs, query_vecs, k) -> list:
+    scores = query_vecs @ doc_vecs.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetFlow embedder benchmark")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=embedders.EMBED_THREADS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    args = parser.parse_args()
+
+    docs = load_corpus(args.docs)
+    print(f"Threads per backend: {args.threads}\n")
+
+    results = {}
+    for backend in args.backends:
+        embedder = embedders.BACKENDS[backend](embedders.MODEL_NAME, threads=args.threads)
+        results[backend] = bench(embedder, docs, QUERIES)
+
+    reference = results.get("torch")
+    print(f"{'backend':<8} {'docs/s':>9} {'query p50 (ms)':>15} {'recall@' + str(args.k):>10} {'cosine':>8}")
+    for backend, r in results.items():
+        recall = cosine = "-"
+        if reference is not None and backend != "torch" and r["doc_vecs"].shape == reference["doc_vecs"].shape:
+            ref_hits = top_k(reference["doc_vecs"], reference["query_vecs"], args.k)
+            hits = top_k(r["doc_vecs"], r["query_vecs"], args.k)
+            recall = f"{np.mean([len(a & b) / args.k for a, b in zip(ref_hits, hits)]):.3f}"
+            cosine = f"{np.mean(np.sum(r['doc_vecs'] * reference['doc_vecs'], axis=1)):.4f}"
+        print(f"{backend:<8} {r['docs_per_s']:>9.1f} {r['query_ms_p50']:>15.2f} {recall:>10} {cosine:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Text embedders for the AI analyst's retrieval.
+
+Two interchangeable backends produce L2-normalized float32 vectors:
+
+  torch  SentenceTransformer, full-precision PyTorch (default)
+  onnx   ONNX Runtime with the int8-quantized MiniLM export published in the
+         model's Hugging Face repo (pip install onnxruntime)
+
+Select with NETFLOW_EMBEDDER=torch|onnx. Both run on at most
+NETFLOW_EMBED_THREADS cores (default: a quarter of the machine) so
+embedding doesn't starve the packet pipeline.
+"""
+import os
+
+import numpy as np
+
+EMBEDDER = os.environ.get("NETFLOW_EMBEDDER", "torch")
+MODEL_NAME = os.environ.get("NETFLOW_RAG_MODEL", "all-MiniLM-L6-v2")
+EMBED_THREADS = int(os.environ.get("NETFLOW_EMBED_THREADS", max(1, (os.cpu_count() or 4) // 4)))
+# Repo-relative file, or a local path (e.g. your own quantize_dynamic output)
+ONNX_FILE = os.environ.get("NETFLOW_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+BATCH_SIZE = 64
+MAX_TOKENS = 256
+
+
+def embedder_id(backend: str = EMBEDDER, model_name: str = MODEL_NAME) -> str:
+    """Names the vector space an index was built in; vectors from different
+    ids must not be mixed."""
+    if backend == "onnx":
+        return f"{model_name}/onnx:{os.path.basename(ONNX_FILE)}"
+    return f"{model_name}/{backend}"
+
+
+def _hub_repo(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str = MODEL_NAME, threads: int = EMBED_THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = embedder_id("torch", model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list, batch_size: int = BATCH_SIZE) -> np.ndarray:
+        vectors = self.model.encode(
+            texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class OnnxEmbedder:
+    """Mean-pooled MiniLM on ONNX Runtime. Matches SentenceTransformer's
+    pooling and normalization, so vectors are comparable up to quantization
+    error."""
+
+    def __init__(self, model_name: str = MODEL_NAME, threads: int = EMBED_THREADS, onnx_file: str = ONNX_FILE):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if os.path.exists(onnx_file):
+            model_path = onnx_file
+            tokenizer_path = os.path.join(os.path.dirname(onnx_file), "tokenizer.json")
+        else:
+            from huggingface_hub import hf_hub_download
+            repo = _hub_repo(model_name)
+            model_path = hf_hub_download(repo, onnx_file)
+            tokenizer_path = hf_hub_download(repo, "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=MAX_TOKENS)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.name = f"{model_name}/onnx:{os.path.basename(onnx_file)}"
+        dim = self.session.get_outputs()[0].shape[-1]
+        self.dim = dim if isinstance(dim, int) else None
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, texts: list, batch_size: int = BATCH_SIZE) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        # Sort by length so padding stays short within a batch
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            vectors = self._encode_batch([texts[i] for i in idx])
+            if out.shape[1] != vectors.shape[1]:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[idx] = vectors
+        return out
+
+
+BACKENDS = {
+    "torch": SentenceTransformerEmbedder,
+    "onnx": OnnxEmbedder,
+}
+
+
+def load_embedder(backend: str = EMBEDDER, model_name: str = MODEL_NAME):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedder '{backend}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](model_name)
@@ -0,0 +1,139 @@
+"""
+Fast lane for critical anomalies.
+
+Regular flow reports wait for the 2 s dashboard pulse window. Two kinds of
+events skip it and are published as soon as the engine sees them:
+
+- packets with an abnormal TCP flag combination (XMAS/NULL scans, SYN+FIN,
+  ...; see features/feature_tcp_flags.py);
+- flow windows whose score reaches the critical score.
+
+Each alert is a `critical_alert` dashboard message carrying `detected_at`
+(capture time of the triggering packet) so both the engine and the browser
+can measure detection-to-screen latency. A flow is re-alerted for the same
+reason at most once per DEDUP_SECONDS unless its score rises by
+ESCALATION. Alerts go through the regular dashboard sink
+(broadcast_client.py) from a worker thread and are appended to
+logs/critical_alerts.csv.
+"""
+import csv
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+from broadcast_client import publish
+
+DEDUP_SECONDS = float(os.environ.get("NETFLOW_FAST_LANE_DEDUP_SECONDS", 10))
+# A flow alerted within DEDUP_SECONDS is alerted again once its score has risen this much
+ESCALATION = 0.1
+LOG_PATH = "logs/critical_alerts.csv"
+LOG_FIELDS = ["detected_at", "published_at", "latency", "source", "flow", "reason", "score", "packet_count", "total_bytes"]
+# Latency samples kept for the percentiles in stats()
+LATENCY_SAMPLES = 1000
+
+
+class FastLane:
+    def __init__(self, log_path: str = LOG_PATH):
+        self.log_path = log_path
+        # Overridden by main.py with the logging.critical_alerts toggle
+        self.log_enabled = lambda: True
+        self._sent = {}  # (flow, reason) -> (score, sent_at)
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._worker = None
+        # Pathway may call back from several threads; only one may start the worker
+        self._worker_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.published = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    # --- Ingest --------------------------------------------------------------
+    def on_packet(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for packets with abnormal TCP flags."""
+        if is_addition:
+            self.offer({
+                "source": "packet",
+                "flow": row.get("flow_id"),
+                "reason": f"Abnormal TCP flags ({row.get('abnormal_flags')})",
+                "score": 1.0,
+                "packet_count": 1,
+                "total_bytes": row.get("size_int") or 0,
+                "detected_at": row.get("timestamp"),
+            })
+
+    def on_flow(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for flow windows with a critical reason."""
+        if is_addition:
+            self.offer({
+                "source": "flow",
+                "flow": row.get("flow_id"),
+                "reason": row.get("anomaly_reason"),
+                "score": row.get("anomaly_score") or 0.0,
+                "packet_count": row.get("packet_count") or 0,
+                "total_bytes": row.get("total_bytes") or 0,
+                "detected_at": row.get("event_time"),
+            })
+
+    def offer(self, alert: dict) -> bool:
+        """Queues an alert unless the same flow and reason was just sent."""
+        now = time.time()
+        key = (alert["flow"], alert["reason"])
+        score = float(alert["score"] or 0.0)
+        with self._lock:
+            last = self._sent.get(key)
+            if last is not None and now - last[1] < DEDUP_SECONDS and score < last[0] + ESCALATION:
+                self.deduplicated += 1
+                return False
+            self._sent[key] = (score, now)
+            if len(self._sent) > 10000:
+                self._sent = {k: v for k, v in self._sent.items() if now - v[1] < DEDUP_SECONDS}
+        self._pending.put({"type": "critical_alert", **alert, "score": score, "detected_at": float(alert["detected_at"] or now)})
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="fast-lane", daemon=True)
+                self._worker.start()
+        return True
+
+    # --- Delivery ------------------------------------------------------------
+    def _run(self):
+        while True:
+            alert = self._pending.get()
+            alert["published_at"] = time.time()
+            if publish(alert):
+                self.published += 1
+            else:
+                self.failed += 1
+            latency = alert["published_at"] - alert["detected_at"]
+            self._latencies.append(latency)
+            try:
+                if self.log_enabled():
+                    self._log(alert, latency)
+            except OSError as e:
+                print(f"[FastLane] Failed to log alert: {e}", file=sys.stderr)
+
+    def _log(self, alert: dict, latency: float):
+        new_file = not os.path.exists(self.log_path)
+        with open(self.log_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=LOG_FIELDS, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerow({**alert, "latency": f"{latency:.3f}"})
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        percentile = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+        return {
+            "published": self.published,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "pending": self._pending.qsize(),
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+        }
+
+
+fast_lane = FastLane()
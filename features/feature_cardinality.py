@@ -0,0 +1,277 @@
+"""
+Distinct-count sketches for scan and DDoS detection.
+
+Per-flow rules can't see a scan spread over thousands of one-packet flows,
+or a flood from thousands of sources. Three counters are kept over a
+sliding window (WINDOW_SECONDS, in panes of PANE_SECONDS) instead:
+
+- src_ports:   per source, distinct destination ports (vertical scan);
+- src_hosts:   per source, distinct destination hosts (horizontal sweep);
+- dst_sources: per destination, distinct sources (distributed flood).
+
+Each key holds a HyperLogLog per pane. Keys start sparse (the raw hashes,
+exact) and switch to 2^PRECISION one-byte registers (1 KB at the default
+precision, ~3% error) once they pass SPARSE_LIMIT values, so the many
+sources of a spoofed flood stay small. Panes merge by union (register-wise
+max), and a window's estimate is the union of its panes.
+
+Only connection-initiating packets are counted: TCP SYN without ACK, and
+for other protocols packets from the endpoint that spoke first. A server
+answering many clients therefore has no fan-out of its own. The initiator
+of each recent connection is kept (MAX_CONNECTIONS, for IDLE_SECONDS after
+its last counted packet) so `initiator()` can tell which side of a flow
+the scan or flood reasons belong to.
+
+Estimates are refreshed as packets arrive and read with `estimate()`;
+main.py compares them with thresholds from whitelist.json "cardinality".
+"""
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+PRECISION = int(os.environ.get("NETFLOW_HLL_PRECISION", 10))
+REGISTERS = 1 << PRECISION
+SPARSE_LIMIT = 32
+WINDOW_SECONDS = int(os.environ.get("NETFLOW_CARDINALITY_WINDOW", 10))
+PANE_SECONDS = 2
+# Keys tracked per counter and pane; further keys are ignored until the pane rolls over
+MAX_KEYS = 50000
+# Connections whose initiator is remembered
+MAX_CONNECTIONS = 1 << 18
+IDLE_SECONDS = 60
+BATCH_SIZE = 4096
+FLUSH_INTERVAL = 0.5
+
+COUNTERS = ("src_ports", "src_hosts", "dst_sources")
+_MASK = (1 << 64) - 1
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def _hash(value) -> int:
+    return hash(value) & _MASK
+
+
+def _registers(hashes) -> np.ndarray:
+    registers = np.zeros(REGISTERS, dtype=np.uint8)
+    for h in hashes:
+        index = h >> (64 - PRECISION)
+        rest = (h << PRECISION) & _MASK
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - PRECISION + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return registers
+
+
+def _estimate(registers: np.ndarray) -> int:
+    raw = _ALPHA * REGISTERS * REGISTERS / np.ldexp(1.0, -registers.astype(np.int32)).sum()
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * REGISTERS and zeros:
+        # Linear counting for small cardinalities
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
+
+
+class HyperLogLog:
+    """Sparse set of 64-bit hashes until SPARSE_LIMIT, then dense registers."""
+
+    __slots__ = ("sparse", "dense")
+
+    def __init__(self):
+        self.sparse = set()
+        self.dense = None
+
+    def add(self, h: int):
+        if self.dense is None:
+            self.sparse.add(h)
+            if len(self.sparse) > SPARSE_LIMIT:
+                self.dense = _registers(self.sparse)
+                self.sparse = None
+        else:
+            index = h >> (64 - PRECISION)
+            rest = (h << PRECISION) & _MASK
+            rank = 64 - rest.bit_length() + 1 if rest else 64 - PRECISION + 1
+            if rank > self.dense[index]:
+                self.dense[index] = rank
+
+    def nbytes(self) -> int:
+        return self.dense.nbytes if self.dense is not None else 8 * len(self.sparse)
+
+    @staticmethod
+    def union_estimate(sketches: list) -> int:
+        dense = [s.dense for s in sketches if s.dense is not None]
+        sparse = set()
+        for s in sketches:
+            if s.dense is None:
+                sparse |= s.sparse
+        if not dense:
+            if len(sparse) <= SPARSE_LIMIT:
+                return len(sparse)
+            return _estimate(_registers(sparse))
+        merged = np.maximum.reduce(dense) if len(dense) > 1 else dense[0].copy()
+        if sparse:
+            np.maximum(merged, _registers(sparse), out=merged)
+        return _estimate(merged)
+
+
+def _endpoint(value) -> str | None:
+    # Tunnelled packets list every layer's address ("outer,inner"); use the outer one
+    value = str(value or "").split(",")[0]
+    return value or None
+
+
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def _connection(src: str, sport, dst: str, dport) -> tuple:
+    """Direction-free key of a connection and the sender's end of it."""
+    a, b = (src, str(sport or "")), (dst, str(dport or ""))
+    return (a, b) if a <= b else (b, a), a
+
+
+class CardinalityMonitor:
+    def __init__(self, window: int = WINDOW_SECONDS, pane: int = PANE_SECONDS):
+        self.window = window
+        self.pane = pane
+        self._panes = {}  # pane start -> {counter: {key: HyperLogLog}}
+        self._estimates = {name: {} for name in COUNTERS}
+        self._initiators = {}  # connection -> [initiating endpoint, last counted packet time]
+        self._pending = []
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.packets = 0
+        self.counted = 0
+        self.dropped_keys = 0
+        self.dropped_connections = 0
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for packets."""
+        if not is_addition:
+            return
+        src, dst = _endpoint(row.get("src_ip")), _endpoint(row.get("dst_ip"))
+        if src is None or dst is None:
+            return
+        syn = row.get("tcp_flags_syn")
+        # Non-TCP packets have no flag fields; later TCP packets never open a connection
+        opens = None if not syn else _flag(syn) and not _flag(row.get("tcp_flags_ack"))
+        with self._pending_lock:
+            self._pending.append((float(row.get("timestamp") or 0.0), src, row.get("src_port"), dst, row.get("dst_port"), opens))
+            full = len(self._pending) >= BATCH_SIZE
+        if full:
+            self.flush()
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="cardinality", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Adds queued packets to their panes and refreshes the touched keys' estimates."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        with self._lock:
+            newest = max(max(ts for ts, *_ in batch) // self.pane * self.pane, max(self._panes, default=0))
+            touched = {name: set() for name in COUNTERS}
+            expired = [s for s in self._panes if s <= newest - self.window]
+            for start in expired:
+                for name, sketches in self._panes.pop(start).items():
+                    touched[name].update(sketches)
+            if expired:
+                cutoff = newest - IDLE_SECONDS
+                self._initiators = {c: entry for c, entry in self._initiators.items() if entry[1] >= cutoff}
+            for ts, src, sport, dst, dport, opens in batch:
+                start = ts // self.pane * self.pane
+                if start <= newest - self.window or not self._initiating(ts, src, sport, dst, dport, opens):
+                    continue
+                pane = self._panes.get(start)
+                if pane is None:
+                    pane = self._panes[start] = {name: {} for name in COUNTERS}
+                for name, key, value in (("src_ports", src, dport), ("src_hosts", src, dst), ("dst_sources", dst, src)):
+                    if value is None:
+                        continue
+                    sketches = pane[name]
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        if len(sketches) >= MAX_KEYS:
+                            self.dropped_keys += 1
+                            continue
+                        sketch = sketches[key] = HyperLogLog()
+                    sketch.add(_hash(value))
+                    touched[name].add(key)
+                self.counted += 1
+            self.packets += len(batch)
+            for name, keys in touched.items():
+                estimates = self._estimates[name]
+                for key in keys:
+                    sketches = [pane[name][key] for pane in self._panes.values() if key in pane[name]]
+                    if sketches:
+                        estimates[key] = HyperLogLog.union_estimate(sketches)
+                    else:
+                        estimates.pop(key, None)
+
+    def _initiating(self, ts: float, src: str, sport, dst: str, dport, opens: bool | None) -> bool:
+        """Whether a packet opens or continues a connection from its initiator.
+        TCP connections are opened by a SYN without ACK; other protocols by
+        whichever endpoint sent first."""
+        connection, sender = _connection(src, sport, dst, dport)
+        entry = self._initiators.get(connection)
+        if opens or (opens is None and entry is None):
+            if entry is None and len(self._initiators) >= MAX_CONNECTIONS:
+                self.dropped_connections += 1
+            else:
+                self._initiators[connection] = [sender, ts]
+            return True
+        if opens is None and entry[0] == sender:
+            entry[1] = ts
+            return True
+        return False
+
+    # --- Queries -------------------------------------------------------------
+    def estimate(self, counter: str, key) -> int:
+        """Distinct values seen for `key` over the window (0 if unseen)."""
+        return self._estimates[counter].get(_endpoint(key), 0)
+
+    def initiator(self, ip_a, port_a, ip_b, port_b) -> tuple | None:
+        """(client, server) IPs of a recent connection in either direction,
+        None if its opening packet wasn't seen."""
+        a, b = _endpoint(ip_a), _endpoint(ip_b)
+        if a is None or b is None:
+            return None
+        connection, first = _connection(a, port_a, b, port_b)
+        entry = self._initiators.get(connection)
+        if entry is None:
+            return None
+        return (a, b) if entry[0] == first else (b, a)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sketch_bytes = sum(s.nbytes() for pane in self._panes.values() for sketches in pane.values() for s in sketches.values())
+            dense = sum(s.dense is not None for pane in self._panes.values() for sketches in pane.values() for s in sketches.values())
+            top = {name: max(estimates.values(), default=0) for name, estimates in self._estimates.items()}
+        return {
+            "packets": self.packets,
+            "counted_packets": self.counted,
+            "connections": len(self._initiators),
+            "dropped_connections": self.dropped_connections,
+            "panes": len(self._panes),
+            "keys": {name: len(estimates) for name, estimates in self._estimates.items()},
+            "dense_sketches": dense,
+            "sketch_bytes": sketch_bytes,
+            "dropped_keys": self.dropped_keys,
+            "max_estimate": top,
+        }
+
+
+cardinality = CardinalityMonitor()
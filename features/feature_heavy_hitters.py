@@ -0,0 +1,264 @@
+"""
+Top talkers over a sliding window in fixed memory.
+
+Packets are counted per source IP, destination IP, destination port and
+flow, by packets and by bytes. Exact per-key state would grow with every
+port a scan touches, so each dimension keeps, per pane (one hop of the
+window):
+
+- a Space-Saving summary of at most CAPACITY keys, which always contains
+  every key above EPSILON of the pane's traffic;
+- a Count-Min sketch (WIDTH x DEPTH) of packets and bytes, which never
+  under-estimates and over-estimates by at most EPSILON of the traffic.
+
+The window's candidates are the union of its panes' summaries; each is
+estimated from the sum of the panes' sketches, so a key that is heavy over
+the whole window is reported even if it never led a single pane.
+
+EPSILON (NETFLOW_HEAVY_HITTERS_EPSILON) is the accuracy/memory knob: halving
+it doubles both the summaries and the sketch width.
+
+Every hop the window's top keys go to the dashboard as one `top_talkers`
+message (see broadcast_client.py).
+"""
+import heapq
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from broadcast_client import publish
+
+EPSILON = float(os.environ.get("NETFLOW_HEAVY_HITTERS_EPSILON", 0.005))
+# Count-Min rows; estimates hold with probability 1 - e^-DEPTH
+DEPTH = 4
+WIDTH = math.ceil(math.e / EPSILON)
+CAPACITY = math.ceil(1 / EPSILON)
+WINDOW_SECONDS = 5
+HOP_SECONDS = 1
+TOP_N = 10
+# Packets aggregated per batch before they are merged into the pane
+BATCH_SIZE = 4096
+
+DIMENSIONS = ("sources", "destinations", "ports", "flows")
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(0x5EED)
+_HASH_A = _rng.integers(1, _PRIME, size=(DEPTH, 1), dtype=np.int64)
+_HASH_B = _rng.integers(0, _PRIME, size=(DEPTH, 1), dtype=np.int64)
+
+
+def _buckets(keys: list) -> np.ndarray:
+    """DEPTH x len(keys) Count-Min columns for the keys."""
+    hashes = np.fromiter((hash(k) % _PRIME for k in keys), dtype=np.int64, count=len(keys))
+    return (_HASH_A * hashes + _HASH_B) % _PRIME % WIDTH
+
+
+class SpaceSaving:
+    """Mergeable Space-Saving summary: key -> [packets, bytes, error].
+
+    Counts are upper bounds; `error` is how much of a count may belong to
+    keys that were evicted before this one was (re)admitted.
+    """
+
+    __slots__ = ("entries", "capacity")
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.entries = {}
+        self.capacity = capacity
+
+    def floor(self) -> int:
+        """Largest packet count an unmonitored key may have."""
+        if len(self.entries) < self.capacity:
+            return 0
+        return min(e[0] for e in self.entries.values())
+
+    def merge_counts(self, packets: Counter, bytes_: Counter):
+        """Adds exact counts for a batch, keeping the CAPACITY largest keys."""
+        floor = self.floor()
+        for key, n in packets.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [floor + n, bytes_[key], floor]
+            else:
+                entry[0] += n
+                entry[1] += bytes_[key]
+        if len(self.entries) > self.capacity:
+            keep = heapq.nlargest(self.capacity, self.entries.items(), key=lambda kv: kv[1][0])
+            self.entries = dict(keep)
+
+
+class CountMin:
+    __slots__ = ("table",)
+
+    def __init__(self):
+        # [packets, bytes] x DEPTH x WIDTH
+        self.table = np.zeros((2, DEPTH, WIDTH), dtype=np.int64)
+
+    def add(self, keys: list, packets: np.ndarray, bytes_: np.ndarray):
+        columns = _buckets(keys)
+        rows = np.arange(DEPTH)[:, None]
+        np.add.at(self.table[0], (rows, columns), packets)
+        np.add.at(self.table[1], (rows, columns), bytes_)
+
+    def estimate(self, keys: list) -> np.ndarray:
+        """2 x len(keys): estimated packets and bytes per key."""
+        columns = _buckets(keys)
+        rows = np.arange(DEPTH)[:, None]
+        return self.table[:, rows, columns].min(axis=1)
+
+
+class _Pane:
+    __slots__ = ("start", "summaries", "sketches", "packets")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.summaries = {dim: SpaceSaving() for dim in DIMENSIONS}
+        self.sketches = {dim: CountMin() for dim in DIMENSIONS}
+        self.packets = 0
+
+
+def _keys(row: dict):
+    # Tunnelled packets list every layer's address ("outer,inner"); count the outer one
+    src = (row.get("src_ip") or "?").split(",")[0]
+    dst = (row.get("dst_ip") or "?").split(",")[0]
+    dport = row.get("dst_port") or "?"
+    return (src, dst, dport, f"{src}:{row.get('src_port') or '?'} -> {dst}:{dport}")
+
+
+class HeavyHitters:
+    def __init__(self, window: int = WINDOW_SECONDS, hop: int = HOP_SECONDS):
+        self.window = window
+        self.hop = hop
+        self._panes = {}  # pane start -> _Pane
+        self._window = {dim: CountMin() for dim in DIMENSIONS}  # sum of the panes' sketches
+        self._pending = []
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.packets = 0
+        self.late = 0
+        self.published = 0
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for packets."""
+        if not is_addition:
+            return
+        with self._pending_lock:
+            self._pending.append((float(row.get("timestamp") or 0.0), int(row.get("size_int") or 0), _keys(row)))
+            full = len(self._pending) >= BATCH_SIZE
+        if full:
+            self.flush()
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="heavy-hitters", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        published_at = 0
+        while True:
+            time.sleep(self.hop)
+            if self.packets + len(self._pending) == published_at:
+                continue
+            message = self.top()
+            published_at = self.packets
+            if publish(message):
+                self.published += 1
+
+    def flush(self):
+        """Merges queued packets into their panes."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        by_pane = {}
+        for ts, size, keys in batch:
+            by_pane.setdefault(int(ts // self.hop) * self.hop, []).append((size, keys))
+        with self._lock:
+            newest = max(max(by_pane), max(self._panes, default=0))
+            for start in [s for s in self._panes if s <= newest - self.window]:
+                self._expire(start)
+            for start, packets in by_pane.items():
+                if start <= newest - self.window:
+                    self.late += len(packets)
+                    continue
+                pane = self._panes.get(start)
+                if pane is None:
+                    pane = self._panes[start] = _Pane(start)
+                self._add(pane, packets)
+
+    def _add(self, pane: _Pane, packets: list):
+        for i, dim in enumerate(DIMENSIONS):
+            counts, sizes = Counter(), Counter()
+            for size, keys in packets:
+                counts[keys[i]] += 1
+                sizes[keys[i]] += size
+            pane.summaries[dim].merge_counts(counts, sizes)
+            keys = list(counts)
+            packet_counts = np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+            byte_counts = np.fromiter((sizes[k] for k in keys), dtype=np.int64, count=len(keys))
+            pane.sketches[dim].add(keys, packet_counts, byte_counts)
+            self._window[dim].add(keys, packet_counts, byte_counts)
+        pane.packets += len(packets)
+        self.packets += len(packets)
+
+    def _expire(self, start: int):
+        pane = self._panes.pop(start)
+        for dim in DIMENSIONS:
+            self._window[dim].table -= pane.sketches[dim].table
+
+    # --- Output --------------------------------------------------------------
+    def top(self, n: int = TOP_N) -> dict:
+        """Compact top_talkers message: per dimension, the top `n` keys by
+        packets and by bytes as [key, packets, bytes] triples."""
+        self.flush()
+        with self._lock:
+            message = {"type": "top_talkers", "window": self.window, "time": max(self._panes, default=0) + self.hop}
+            message["packets"] = sum(p.packets for p in self._panes.values())
+            for dim in DIMENSIONS:
+                summaries = [pane.summaries[dim] for pane in self._panes.values()]
+                candidates = set()
+                for summary in summaries:
+                    candidates.update(summary.entries)
+                if not candidates:
+                    message[dim] = {"packets": [], "bytes": []}
+                    continue
+                keys = list(candidates)
+                estimates = self._window[dim].estimate(keys)
+                # The summaries give a second upper bound on packets, much
+                # tighter than the sketch for keys in the long tail
+                floors = [summary.floor() for summary in summaries]
+                rows = []
+                for key, packets, bytes_ in zip(keys, estimates[0], estimates[1]):
+                    bound = sum(s.entries[key][0] if key in s.entries else f for s, f in zip(summaries, floors))
+                    rows.append([key, int(min(packets, bound)), int(bytes_)])
+                message[dim] = {
+                    "packets": heapq.nlargest(n, rows, key=lambda r: r[1]),
+                    "bytes": heapq.nlargest(n, rows, key=lambda r: r[2]),
+                }
+        return message
+
+    def stats(self) -> dict:
+        with self._lock:
+            sketch_bytes = sum(s.table.nbytes for p in self._panes.values() for s in p.sketches.values())
+            sketch_bytes += sum(s.table.nbytes for s in self._window.values())
+            monitored = sum(len(s.entries) for p in self._panes.values() for s in p.summaries.values())
+        return {
+            "packets": self.packets,
+            "late": self.late,
+            "published": self.published,
+            "panes": len(self._panes),
+            "epsilon": EPSILON,
+            "width": WIDTH,
+            "depth": DEPTH,
+            "capacity": CAPACITY,
+            "monitored_keys": monitored,
+            "sketch_bytes": sketch_bytes,
+        }
+
+
+heavy_hitters = HeavyHitters()
@@ -0,0 +1,368 @@
+"""
+Per-host baseline profiles.
+
+Global thresholds treat a backup server that always pushes 50 MB like a
+laptop that suddenly does. Each host gets a profile of what is normal for
+it instead, learned from the flow windows it takes part in. The engine
+updates a window's row on every packet, and its sliding windows overlap.
+Only the last version of a closed window is learned, and per flow only
+windows that don't overlap one already learned, so each packet counts once:
+
+- rate and bytes: EWMA mean and variance of log packets/s and log bytes
+  per flow window;
+- peers and ports: distinct remote hosts and remote ports per period
+  (PERIOD_SECONDS), counted in 128-bit linear-counting bitmaps and folded
+  into an EWMA of their log when the period ends;
+- hours: flow counts per local hour of day, halved once a host's total
+  passes HOUR_CAP so old habits fade.
+
+All state lives in fixed arrays indexed by an interned host id (about 190
+bytes per host, see stats()); new hosts are ignored while the table is
+full, and hosts idle for IDLE_SECONDS are dropped once it is 90% full. The
+table is saved to PROFILES_PATH every PERSIST_SECONDS and on exit, and
+restored on start, so baselines survive restarts.
+
+`deviation()` gives scoring.py, per flow, how far each aspect is above
+the endpoints' usual range (in standard deviations) and whether the flow
+falls in an hour the host is rarely active.
+"""
+import atexit
+import math
+import os
+import sys
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+PROFILES_PATH = os.environ.get("NETFLOW_HOST_PROFILES_PATH", "models/host_profiles.npz")
+MAX_HOSTS = int(os.environ.get("NETFLOW_HOST_PROFILES_MAX", 65536))
+PERIOD_SECONDS = 60
+PERSIST_SECONDS = 300
+IDLE_SECONDS = 7 * 86400
+ALPHA = 0.05
+# Flow windows / periods before a host's rate and bytes / peers and ports are trusted
+WARMUP_FLOWS = 20
+WARMUP_PERIODS = 5
+# Standard-deviation floor in log space, so steady hosts don't alert on noise
+MIN_STD = 0.5
+# Hours are judged once a host has a day of history; an hour holding less
+# than HOUR_MIN_SHARE of its flows is unusual
+HOUR_MIN_SHARE = 0.01
+HOUR_WARMUP = 100
+HOUR_CAP = 100000
+BITS = 128
+FLUSH_INTERVAL = 0.5
+# main.py's flow window length; a window is closed once packets this much
+# (plus LATENESS_SECONDS) newer than its first one have been seen
+WINDOW_SECONDS = 5.0
+LATENESS_SECONDS = 1.0
+
+ASPECTS = ("rate", "bytes", "peers", "ports")
+_SATURATED = BITS * math.log(BITS)
+
+
+def _bits(values: list) -> tuple[np.ndarray, np.ndarray]:
+    """Bitmap word and bit mask for each value."""
+    index = np.fromiter((hash(v) % BITS for v in values), dtype=np.int64, count=len(values))
+    return index >> 6, np.left_shift(np.uint64(1), (index & 63).astype(np.uint64))
+
+
+def _distinct(bitmaps: np.ndarray) -> np.ndarray:
+    """Linear-counting estimate per bitmap (last axis: uint64 words)."""
+    zeros = BITS - np.bitwise_count(bitmaps).sum(axis=-1, dtype=np.int64)
+    with np.errstate(divide="ignore"):
+        return np.where(zeros > 0, BITS * np.log(BITS / np.maximum(zeros, 1)), _SATURATED)
+
+
+def _features(packets, bytes_, duration) -> np.ndarray:
+    """Log rate and log bytes per flow window. Rates are taken over at least
+    a second: one or two packets in a few milliseconds aren't a burst."""
+    packets = np.asarray(packets, dtype=np.float64)
+    duration = np.maximum(np.asarray(duration, dtype=np.float64), 1.0)
+    return np.column_stack([np.log1p(packets / duration), np.log1p(np.asarray(bytes_, dtype=np.float64))])
+
+
+def _ewma(mean: np.ndarray, var: np.ndarray, value: np.ndarray, first: np.ndarray):
+    """One EWMA step in place (rows where `first` start from `value`)."""
+    delta = value - mean
+    mean += np.where(first[:, None], delta, ALPHA * delta)
+    var[:] = np.where(first[:, None], 0.0, (1 - ALPHA) * (var + ALPHA * delta * delta))
+
+
+class HostProfiles:
+    def __init__(self, path: str = PROFILES_PATH, capacity: int = MAX_HOSTS):
+        self.path = path
+        self.capacity = capacity
+        self._ids = {}
+        self._hosts = []
+        self.mean = np.zeros((capacity, len(ASPECTS)), dtype=np.float32)
+        self.var = np.zeros((capacity, len(ASPECTS)), dtype=np.float32)
+        self.flows = np.zeros(capacity, dtype=np.int32)
+        self.periods = np.zeros(capacity, dtype=np.int32)
+        self.bitmaps = np.zeros((capacity, 2, BITS // 64), dtype=np.uint64)  # [peers, ports]
+        self.hours = np.zeros((capacity, 24), dtype=np.float32)
+        self.first_seen = np.zeros(capacity)
+        self.last_seen = np.zeros(capacity)
+        self.period = None
+        self._open = {}  # row key -> latest version of a window still filling
+        self._learned = {}  # flow -> first packet time of its last learned window
+        self._watermark = 0.0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.updates = 0
+        self.dropped_updates = 0
+        self.saved_at = None
+        self.load()
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for flow windows. Keeps the latest version
+        of each window; flush() learns it after the window has closed."""
+        if not row.get("src_ip") or not row.get("dst_ip"):
+            return
+        window = (
+            float(row.get("event_time") or 0.0), row["src_ip"], row["dst_ip"], row.get("src_port"), row.get("dst_port"),
+            int(row.get("packet_count") or 0), int(row.get("total_bytes") or 0), float(row.get("duration") or 0.0),
+        )
+        with self._pending_lock:
+            if is_addition:
+                self._open[key] = window
+                self._watermark = max(self._watermark, window[0])
+            elif self._open.get(key) == window:
+                # Retracted without a replacement (e.g. the flow became whitelisted)
+                del self._open[key]
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="host-profiles", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        saved = time.time()
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+            if time.time() - saved >= PERSIST_SECONDS:
+                saved = time.time()
+                self.save()
+
+    def _close_windows(self):
+        """Moves windows whose first packet is older than the window length
+        (plus lateness) behind the newest packet to the pending batch,
+        skipping ones that overlap a window already learned for their flow."""
+        cutoff = self._watermark - WINDOW_SECONDS - LATENESS_SECONDS
+        closed = []
+        for key, window in self._open.items():
+            # event_time - duration is the window's first packet
+            first = window[0] - window[7]
+            if first < cutoff:
+                closed.append((first, -window[5], key))
+        # Of the windows starting at the same packet, the fullest is learned
+        for first, _, key in sorted(closed):
+            window = self._open.pop(key)
+            flow = window[1:5]
+            if first >= self._learned.get(flow, -math.inf) + WINDOW_SECONDS:
+                self._learned[flow] = first
+                self._pending.append(window)
+        if closed:
+            self._learned = {flow: t for flow, t in self._learned.items() if t >= cutoff - WINDOW_SECONDS}
+
+    def flush(self):
+        """Folds closed flow windows into both endpoints' profiles."""
+        with self._pending_lock:
+            self._close_windows()
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        ts, src, dst, sport, dport, packets, bytes_, duration = zip(*batch)
+        ts = np.array(ts * 2)
+        x = _features(packets, bytes_, duration)
+        x = np.concatenate([x, x])
+        # Flow ids are canonical (not directional): each endpoint's peer and
+        # remote port are the other side's
+        hosts, peers, ports = src + dst, dst + src, dport + sport
+        row_periods = (ts // PERIOD_SECONDS).astype(np.int64)
+        with self._lock:
+            # Usually a single period; a replayed backlog can span several
+            for period in np.unique(row_periods).tolist():
+                if self.period is None:
+                    self.period = period
+                elif period > self.period:
+                    self._end_period(period * PERIOD_SECONDS)
+                    self.period = period
+                rows = np.flatnonzero(row_periods == period)
+                if len(rows) == len(ts):
+                    self._add(hosts, peers, ports, ts, x)
+                else:
+                    pick = rows.tolist()
+                    self._add([hosts[i] for i in pick], [peers[i] for i in pick], [ports[i] for i in pick], ts[rows], x[rows])
+            self.updates += len(batch)
+
+    def _add(self, hosts, peers, ports, ts: np.ndarray, x: np.ndarray):
+        ids = self._intern(hosts)
+        known = ids >= 0
+        if not known.all():
+            ids, ts, x = ids[known], ts[known], x[known]
+            peers = [p for p, k in zip(peers, known) if k]
+            ports = [p for p, k in zip(ports, known) if k]
+        if not len(ids):
+            return
+
+        unique, inverse, counts = np.unique(ids, return_inverse=True, return_counts=True)
+        sums = np.zeros((len(unique), 2))
+        np.add.at(sums, inverse, x)
+        mean, var = self.mean[unique, :2], self.var[unique, :2]
+        _ewma(mean, var, sums / counts[:, None], self.flows[unique] == 0)
+        self.mean[unique, :2], self.var[unique, :2] = mean, var
+        self.flows[unique] += counts.astype(np.int32)
+
+        for kind, values in enumerate((peers, ports)):
+            word, mask = _bits(values)
+            np.bitwise_or.at(self.bitmaps[:, kind], (ids, word), mask)
+        np.add.at(self.hours, (ids, self._hour(ts)), 1)
+        self.first_seen[unique[self.first_seen[unique] == 0]] = np.inf
+        np.minimum.at(self.first_seen, ids, ts)
+        np.maximum.at(self.last_seen, ids, ts)
+
+    def _intern(self, hosts) -> np.ndarray:
+        out = np.empty(len(hosts), dtype=np.int64)
+        for i, host in enumerate(hosts):
+            host_id = self._ids.get(host)
+            if host_id is None:
+                if len(self._hosts) >= self.capacity:
+                    self.dropped_updates += 1
+                    host_id = -1
+                else:
+                    host_id = self._ids[host] = len(self._hosts)
+                    self._hosts.append(host)
+            out[i] = host_id
+        return out
+
+    def _end_period(self, now: float):
+        """Folds the period's distinct peers and ports into the EWMAs."""
+        n = len(self._hosts)
+        active = np.flatnonzero(self.bitmaps[:n].any(axis=(1, 2)))
+        if len(active):
+            value = np.log1p(_distinct(self.bitmaps[active]))
+            mean, var = self.mean[active, 2:], self.var[active, 2:]
+            _ewma(mean, var, value, self.periods[active] == 0)
+            self.mean[active, 2:], self.var[active, 2:] = mean, var
+            self.periods[active] += 1
+            self.bitmaps[active] = 0
+        busy = self.hours[:n].sum(axis=1) > HOUR_CAP
+        self.hours[:n][busy] *= 0.5
+        if n >= 0.9 * self.capacity:
+            self._compact(now)
+
+    def _compact(self, now: float):
+        """Drops hosts idle for IDLE_SECONDS, renumbering the rest."""
+        n = len(self._hosts)
+        keep = np.flatnonzero(self.last_seen[:n] >= now - IDLE_SECONDS)
+        if len(keep) == n:
+            return
+        for array in (self.mean, self.var, self.flows, self.periods, self.bitmaps, self.hours, self.first_seen, self.last_seen):
+            array[:len(keep)] = array[keep]
+            array[len(keep):n] = 0
+        self._hosts = [self._hosts[i] for i in keep]
+        self._ids = {host: i for i, host in enumerate(self._hosts)}
+
+    @staticmethod
+    def _hour(ts: np.ndarray) -> np.ndarray:
+        return ((ts + time.localtime().tm_gmtoff) // 3600 % 24).astype(np.int64)
+
+    # --- Scoring -------------------------------------------------------------
+    def deviation(self, src_ip: list, dst_ip: list, packets, bytes_, duration, event_time) -> tuple[np.ndarray, np.ndarray]:
+        """Per flow: standard deviations above the usual rate, bytes, peers
+        and ports of either endpoint (n x 4, 0 while a host warms up), and
+        whether the flow falls in an hour either endpoint is rarely active."""
+        x = _features(packets, bytes_, duration)
+        ts = np.asarray(event_time, dtype=np.float64)
+        hour = self._hour(ts)
+        z = np.zeros((len(x), len(ASPECTS)))
+        rare_hour = np.zeros(len(x), dtype=bool)
+        with self._lock:
+            for hosts in (src_ip, dst_ip):
+                ids = np.fromiter((self._ids.get(h, -1) for h in hosts), dtype=np.int64, count=len(hosts))
+                rows = np.flatnonzero(ids >= 0)
+                if not len(rows):
+                    continue
+                host = ids[rows]
+                current = np.column_stack([x[rows], np.log1p(_distinct(self.bitmaps[host]))])
+                std = np.maximum(np.sqrt(self.var[host]), MIN_STD)
+                side = (current - self.mean[host]) / std
+                side[:, :2] *= (self.flows[host] >= WARMUP_FLOWS)[:, None]
+                side[:, 2:] *= (self.periods[host] >= WARMUP_PERIODS)[:, None]
+                z[rows] = np.maximum(z[rows], side)
+                total = self.hours[host].sum(axis=1)
+                rare_hour[rows] |= (
+                    (total >= HOUR_WARMUP)
+                    & (ts[rows] - self.first_seen[host] >= 86400)
+                    & (self.hours[host, hour[rows]] < HOUR_MIN_SHARE * total)
+                )
+        return z, rare_hour
+
+    # --- Persistence ---------------------------------------------------------
+    def save(self):
+        with self._lock:
+            n = len(self._hosts)
+            if not n:
+                return
+            state = {
+                "hosts": np.array(self._hosts), "mean": self.mean[:n], "var": self.var[:n], "flows": self.flows[:n],
+                "periods": self.periods[:n], "bitmaps": self.bitmaps[:n], "hours": self.hours[:n],
+                "first_seen": self.first_seen[:n], "last_seen": self.last_seen[:n], "period": self.period or 0,
+            }
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp = f"{self.path}.tmp.npz"
+                np.savez_compressed(tmp, **state)
+                os.replace(tmp, self.path)
+                self.saved_at = time.time()
+            except OSError as e:
+                print(f"[HostProfiles] Failed to save {self.path}: {e}", file=sys.stderr)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        names = ("mean", "var", "flows", "periods", "bitmaps", "hours", "first_seen", "last_seen")
+        try:
+            with np.load(self.path) as data:
+                n = min(len(data["hosts"]), self.capacity)
+                state = {name: data[name][:n] for name in names}
+                hosts = [str(h) for h in data["hosts"][:n]]
+                period = int(data["period"]) or None
+            for name in names:
+                if state[name].shape[1:] != getattr(self, name).shape[1:]:
+                    raise ValueError(f"{name} has shape {state[name].shape}")
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            print(f"[HostProfiles] Ignoring unreadable {self.path}: {e}", file=sys.stderr)
+            return
+        for name in names:
+            getattr(self, name)[:n] = state[name]
+        self._hosts, self.period = hosts, period
+        self._ids = {host: i for i, host in enumerate(self._hosts)}
+        print(f"[HostProfiles] Restored {n} host profiles from {self.path}")
+
+    def stats(self) -> dict:
+        arrays = (self.mean, self.var, self.flows, self.periods, self.bitmaps, self.hours, self.first_seen, self.last_seen)
+        with self._lock:
+            n = len(self._hosts)
+            warm = int(np.count_nonzero(self.flows[:n] >= WARMUP_FLOWS))
+        return {
+            "hosts": n,
+            "warm_hosts": warm,
+            "capacity": self.capacity,
+            "bytes_per_host": sum(a.nbytes for a in arrays) // self.capacity,
+            "open_windows": len(self._open),
+            "updates": self.updates,
+            "dropped_updates": self.dropped_updates,
+            "saved_at": self.saved_at,
+        }
+
+
+host_profiles = HostProfiles()
+atexit.register(host_profiles.save)
@@ -0,0 +1,366 @@
+"""
+TCP connection-state tracking.
+
+A compact table follows every TCP connection through its handshake from the
+packets' flag fields:
+
+    SYN -> SYN_SENT -> (SYN+ACK) SYN_RECEIVED -> (ACK) ESTABLISHED
+    FIN / RST at any point -> closed
+
+Per destination it keeps the number of half-open connections (SYN seen,
+handshake not finished) and how many of the recent connection attempts
+completed. A SYN flood shows up as many half-open connections with a low
+completion ratio. A bulk transfer shows up as one established connection,
+however small its ACK packets are.
+
+The table is open-addressed with linear probing over fixed arrays. Each
+entry is a 64-bit key hash, a state byte, a last-seen second and a
+destination id: 17 bytes, capacity NETFLOW_TCP_TABLE_SIZE. Half-open
+entries expire after HALF_OPEN_TIMEOUT and idle connections after
+IDLE_TIMEOUT. When the table is too full the oldest half-open entries are
+evicted first and new ones are counted but not stored, so memory stays
+fixed under a flood.
+"""
+import os
+import threading
+import time
+from array import array
+
+import numpy as np
+
+CAPACITY = 1 << max(10, (int(os.environ.get("NETFLOW_TCP_TABLE_SIZE", 1 << 18)) - 1).bit_length())
+HALF_OPEN_TIMEOUT = 10
+IDLE_TIMEOUT = 300
+# Attempts and completions per destination are counted over two windows of this length
+WINDOW_SECONDS = 10
+SWEEP_INTERVAL = 2
+# Sweep early / evict half-open entries / refuse new entries above these fill ratios
+SWEEP_LOAD = 0.6
+EVICT_LOAD = 0.5
+MAX_LOAD = 0.75
+BATCH_SIZE = 4096
+FLUSH_INTERVAL = 0.5
+
+EMPTY, SYN_SENT, SYN_RECEIVED, ESTABLISHED, CLOSED = range(5)
+STATE_NAMES = {SYN_SENT: "syn_sent", SYN_RECEIVED: "syn_received", ESTABLISHED: "established", CLOSED: "closed"}
+_STATE_MASK = 0x07
+# Set when the connection's client is the first endpoint of the canonical tuple
+_CLIENT_FIRST = 0x08
+_MASK = (1 << 64) - 1
+
+
+def _flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def _endpoint(ip) -> str:
+    # Tunnelled packets list every layer's address ("outer,inner"); use the outer one
+    return str(ip or "").split(",")[0]
+
+
+def _canonical(ip_a, port_a, ip_b, port_b):
+    """(key hash, whether (ip_a, port_a) is the first endpoint)."""
+    a, b = (_endpoint(ip_a), str(port_a or "0")), (_endpoint(ip_b), str(port_b or "0"))
+    first = a <= b
+    return hash((a, b) if first else (b, a)) & _MASK, first
+
+
+class _Destination:
+    __slots__ = ("half_open", "window", "attempts", "completed", "prev_attempts", "prev_completed", "resets")
+
+    def __init__(self):
+        self.half_open = 0
+        self.window = 0
+        self.attempts = self.completed = self.prev_attempts = self.prev_completed = self.resets = 0
+
+    def roll(self, now: int):
+        window = now // WINDOW_SECONDS
+        if window != self.window:
+            recent = window == self.window + 1
+            self.prev_attempts = self.attempts if recent else 0
+            self.prev_completed = self.completed if recent else 0
+            self.attempts = self.completed = 0
+            self.window = window
+
+    def ratio(self) -> float:
+        attempts = self.attempts + self.prev_attempts
+        return (self.completed + self.prev_completed) / attempts if attempts else 1.0
+
+
+class TcpStateTable:
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._keys = array("Q", bytes(8 * capacity))
+        self._state = bytearray(capacity)
+        self._seen = array("I", bytes(4 * capacity))
+        self._dst = array("I", bytes(4 * capacity))
+        self._dst_ids = {}  # ip -> id
+        self._dst_ips = []  # id -> ip
+        self._destinations = {}  # ip -> _Destination
+        self._used = 0  # live entries + tombstones
+        self._live = 0
+        self._now = 0
+        self._swept = 0
+        self._used_at_sweep = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.packets = 0
+        self.expired = 0
+        self.evicted = 0
+        self.overflow = 0
+
+    # --- Ingest --------------------------------------------------------------
+    def record(self, key, row: dict, time: int, is_addition: bool):
+        """pw.io.subscribe callback for packets."""
+        # Non-TCP packets have no flag fields
+        if not is_addition or not row.get("tcp_flags_syn"):
+            return
+        with self._pending_lock:
+            self._pending.append((
+                int(row.get("timestamp") or 0), row.get("src_ip"), row.get("src_port"), row.get("dst_ip"), row.get("dst_port"),
+                _flag(row.get("tcp_flags_syn")), _flag(row.get("tcp_flags_ack")),
+                _flag(row.get("tcp_flags_fin")), _flag(row.get("tcp_flags_rst")),
+            ))
+            full = len(self._pending) >= BATCH_SIZE
+        if full:
+            self.flush()
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="tcp-state", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        with self._lock:
+            for packet in batch:
+                if packet[0] > self._now:
+                    self._now = packet[0]
+                if (self._now - self._swept >= SWEEP_INTERVAL
+                        or self._used >= max(SWEEP_LOAD * self.capacity, self._used_at_sweep + self.capacity // 16)):
+                    self._sweep()
+                self._apply(*packet)
+            self.packets += len(batch)
+
+    def _destination(self, ip: str) -> _Destination:
+        dest = self._destinations.get(ip)
+        if dest is None:
+            dest = self._destinations[ip] = _Destination()
+        dest.roll(self._now)
+        return dest
+
+    def _find(self, key: int):
+        """(slot, found): the key's slot, or the first reusable slot for it."""
+        slot = key & self._mask
+        free = -1
+        while True:
+            state = self._state[slot] & _STATE_MASK
+            if state == EMPTY:
+                return (slot if free < 0 else free), False
+            if state == CLOSED:
+                if free < 0:
+                    free = slot
+            elif self._keys[slot] == key:
+                return slot, True
+            slot = (slot + 1) & self._mask
+
+    def _apply(self, ts, src, sport, dst, dport, syn, ack, fin, rst):
+        key, first = _canonical(src, sport, dst, dport)
+        slot, found = self._find(key)
+        state = self._state[slot] & _STATE_MASK if found else EMPTY
+        from_client = found and bool(self._state[slot] & _CLIENT_FIRST) == first
+
+        if syn and not ack:
+            dest_ip = _endpoint(dst)
+            dest = self._destination(dest_ip)
+            dest.attempts += 1
+            if state in (SYN_SENT, SYN_RECEIVED):
+                self._seen[slot] = ts  # retransmitted SYN
+                return
+            if not found and self._full():
+                self.overflow += 1
+                return
+            if not found:
+                self._insert(slot, key)
+            self._state[slot] = SYN_SENT | (_CLIENT_FIRST if first else 0)
+            self._seen[slot] = ts
+            self._dst[slot] = self._dst_id(dest_ip)
+            dest.half_open += 1
+        elif not found:
+            # Joined mid-stream: remember ongoing connections while there is room
+            if not (fin or rst) and ack and self._live < EVICT_LOAD * self.capacity and not self._full():
+                self._insert(slot, key)
+                self._state[slot] = ESTABLISHED
+                self._seen[slot] = ts
+                self._dst[slot] = self._dst_id(_endpoint(dst))
+        elif fin or rst:
+            if state in (SYN_SENT, SYN_RECEIVED):
+                dest = self._destination(self._dst_ips[self._dst[slot]])
+                dest.half_open -= 1
+                dest.resets += rst
+            self._close(slot)
+        elif syn and ack:
+            if state == SYN_SENT and not from_client:
+                self._state[slot] = SYN_RECEIVED | (self._state[slot] & _CLIENT_FIRST)
+            self._seen[slot] = ts
+        else:
+            if state == SYN_RECEIVED and from_client:
+                self._state[slot] = ESTABLISHED | (self._state[slot] & _CLIENT_FIRST)
+                dest = self._destination(self._dst_ips[self._dst[slot]])
+                dest.half_open -= 1
+                dest.completed += 1
+            self._seen[slot] = ts
+
+    def _full(self) -> bool:
+        # Probing needs empty slots, so tombstones count against the limit too
+        return self._live >= MAX_LOAD * self.capacity or self._used >= 0.9 * self.capacity
+
+    def _insert(self, slot: int, key: int):
+        if self._state[slot] == EMPTY:
+            self._used += 1
+        self._keys[slot] = key
+        self._live += 1
+
+    def _close(self, slot: int):
+        self._state[slot] = CLOSED
+        self._live -= 1
+
+    def _dst_id(self, ip: str) -> int:
+        dst_id = self._dst_ids.get(ip)
+        if dst_id is None:
+            dst_id = self._dst_ids[ip] = len(self._dst_ips)
+            self._dst_ips.append(ip)
+        return dst_id
+
+    # --- Maintenance ---------------------------------------------------------
+    def _sweep(self):
+        """Expires idle entries, evicts half-open ones under pressure and
+        rebuilds the table once tombstones pile up. Vectorized over the arrays."""
+        self._swept = self._now
+        state = np.frombuffer(self._state, dtype=np.uint8)
+        seen = np.frombuffer(self._seen, dtype=np.uint32)
+        kind = state & _STATE_MASK
+        half_open = (kind == SYN_SENT) | (kind == SYN_RECEIVED)
+        expired = (half_open & (seen < self._now - HALF_OPEN_TIMEOUT)) | ((kind == ESTABLISHED) & (seen < self._now - IDLE_TIMEOUT))
+        self.expired += int(expired.sum())
+        drop = expired
+        live = self._live - int(expired.sum())
+        if live > EVICT_LOAD * self.capacity:
+            # Oldest half-open entries first, down to EVICT_LOAD
+            candidates = np.flatnonzero(half_open & ~expired)
+            excess = min(len(candidates), int(live - EVICT_LOAD * self.capacity))
+            if excess > 0:
+                oldest = candidates[np.argpartition(seen[candidates], excess - 1)[:excess]]
+                drop = drop.copy()
+                drop[oldest] = True
+                self.evicted += excess
+        dropped_half_open = np.flatnonzero(drop & half_open)
+        if len(dropped_half_open):
+            dst = np.frombuffer(self._dst, dtype=np.uint32)
+            ids, counts = np.unique(dst[dropped_half_open], return_counts=True)
+            for dst_id, count in zip(ids.tolist(), counts.tolist()):
+                self._destination(self._dst_ips[dst_id]).half_open -= count
+        dropped = int(drop.sum())
+        if dropped:
+            state[drop] = CLOSED
+            self._live -= dropped
+        if self._used - self._live > 0.25 * self.capacity or self._used >= SWEEP_LOAD * self.capacity:
+            self._rebuild()
+        self._used_at_sweep = self._used
+        # Forget destinations with nothing in flight and no recent attempts
+        quiet = [ip for ip, d in self._destinations.items()
+                 if d.half_open <= 0 and self._now // WINDOW_SECONDS - d.window > 1]
+        for ip in quiet:
+            del self._destinations[ip]
+
+    def _rebuild(self):
+        """Re-inserts live entries into clean arrays, dropping tombstones."""
+        keys = np.frombuffer(self._keys, dtype=np.uint64)
+        state = np.frombuffer(self._state, dtype=np.uint8)
+        seen = np.frombuffer(self._seen, dtype=np.uint32)
+        dst = np.frombuffer(self._dst, dtype=np.uint32)
+        kind = state & _STATE_MASK
+        live = np.flatnonzero((kind != EMPTY) & (kind != CLOSED))
+        live_keys, live_state, live_seen, live_dst = keys[live].copy(), state[live].copy(), seen[live].copy(), dst[live].copy()
+
+        # Intern only the destinations still referenced
+        old_ips = self._dst_ips
+        used_ids, remapped = np.unique(live_dst, return_inverse=True)
+        self._dst_ips = [old_ips[i] for i in used_ids.tolist()]
+        self._dst_ids = {ip: i for i, ip in enumerate(self._dst_ips)}
+
+        new_keys = np.zeros(self.capacity, dtype=np.uint64)
+        new_state = np.zeros(self.capacity, dtype=np.uint8)
+        new_seen = np.zeros(self.capacity, dtype=np.uint32)
+        new_dst = np.zeros(self.capacity, dtype=np.uint32)
+        home = live_keys & np.uint64(self._mask)
+        pending = np.arange(len(live))
+        probe = 0
+        # Linear probing in rounds: each round places, per free slot, one of
+        # the entries whose next probe lands there
+        while len(pending):
+            slots = ((home[pending] + np.uint64(probe)) & np.uint64(self._mask)).astype(np.int64)
+            free = new_state[slots] == EMPTY
+            candidates, positions = np.unique(slots[free], return_index=True)
+            placed = pending[free][positions]
+            new_keys[candidates] = live_keys[placed]
+            new_state[candidates] = live_state[placed]
+            new_seen[candidates] = live_seen[placed]
+            new_dst[candidates] = remapped[placed]
+            done = np.zeros(len(live), dtype=bool)
+            done[placed] = True
+            pending = pending[~done[pending]]
+            probe += 1
+        self._keys = array("Q", new_keys.tobytes())
+        self._state = bytearray(new_state.tobytes())
+        self._seen = array("I", new_seen.tobytes())
+        self._dst = array("I", new_dst.tobytes())
+        self._used = self._live = len(live)
+
+    # --- Queries -------------------------------------------------------------
+    def connection_state(self, ip_a, port_a, ip_b, port_b) -> str | None:
+        """State of the TCP connection between two endpoints, in either direction."""
+        key, _ = _canonical(ip_a, port_a, ip_b, port_b)
+        with self._lock:
+            slot, found = self._find(key)
+            return STATE_NAMES.get(self._state[slot] & _STATE_MASK) if found else None
+
+    def destination(self, ip) -> dict:
+        """Half-open connections and recent handshake completion for a destination."""
+        with self._lock:
+            dest = self._destinations.get(_endpoint(ip))
+            if dest is None:
+                return {"half_open": 0, "attempts": 0, "completion": 1.0}
+            dest.roll(self._now)
+            return {"half_open": dest.half_open, "attempts": dest.attempts + dest.prev_attempts, "completion": dest.ratio()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            busiest = max(self._destinations.items(), key=lambda kv: kv[1].half_open, default=(None, None))
+            return {
+                "packets": self.packets,
+                "connections": self._live,
+                "capacity": self.capacity,
+                "table_bytes": len(self._keys) * 8 + len(self._state) + len(self._seen) * 4 + len(self._dst) * 4,
+                "half_open": sum(d.half_open for d in self._destinations.values()),
+                "most_half_open": {"ip": busiest[0], "half_open": busiest[1].half_open} if busiest[0] else None,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "overflow": self.overflow,
+            }
+
+
+tcp_state = TcpStateTable()
@@ -0,0 +1,85 @@
+"""Run from the repository root: python -m unittest features.test_feature_tcp_state"""
+import unittest
+
+from features.feature_tcp_state import HALF_OPEN_TIMEOUT, SWEEP_INTERVAL, TcpStateTable
+
+
+def packet(ts, src, sport, dst, dport, flags=""):
+    return {
+        "timestamp": ts, "src_ip": src, "src_port": sport, "dst_ip": dst, "dst_port": dport,
+        "tcp_flags_syn": "1" if "S" in flags else "0", "tcp_flags_ack": "1" if "A" in flags else "0",
+        "tcp_flags_fin": "1" if "F" in flags else "0", "tcp_flags_rst": "1" if "R" in flags else "0",
+    }
+
+
+class TcpStateTableTests(unittest.TestCase):
+    def setUp(self):
+        self.table = TcpStateTable(capacity=1024)
+
+    def send(self, *packets):
+        for row in packets:
+            self.table.record(None, row, 0, True)
+        self.table.flush()
+
+    def handshake(self, ts, client, cport, server, sport):
+        self.send(
+            packet(ts, client, cport, server, sport, "S"),
+            packet(ts, server, sport, client, cport, "SA"),
+            packet(ts, client, cport, server, sport, "A"),
+        )
+
+    def test_handshake_establishes_in_both_tuple_orders(self):
+        # The client sorts first in one connection and last in the other
+        for client, server in (("10.0.0.1", "10.0.0.9"), ("10.0.0.9", "10.0.0.1")):
+            self.handshake(100, client, "40000", server, "443")
+            self.assertEqual(self.table.connection_state(client, "40000", server, "443"), "established")
+            self.assertEqual(self.table.connection_state(server, "443", client, "40000"), "established")
+            dest = self.table.destination(server)
+            self.assertEqual((dest["half_open"], dest["completion"]), (0, 1.0))
+
+    def test_syn_ack_from_client_does_not_advance(self):
+        self.send(
+            packet(100, "10.0.0.1", "40000", "10.0.0.2", "80", "S"),
+            packet(100, "10.0.0.1", "40000", "10.0.0.2", "80", "SA"),
+            packet(100, "10.0.0.1", "40000", "10.0.0.2", "80", "A"),
+        )
+        self.assertEqual(self.table.connection_state("10.0.0.1", "40000", "10.0.0.2", "80"), "syn_sent")
+        self.assertEqual(self.table.destination("10.0.0.2")["half_open"], 1)
+
+    def test_half_open_expires_after_timeout(self):
+        self.send(*(packet(100, "10.0.0.1", str(40000 + i), "10.0.0.2", "80", "S") for i in range(5)))
+        self.assertEqual(self.table.destination("10.0.0.2")["half_open"], 5)
+        later = 100 + HALF_OPEN_TIMEOUT + SWEEP_INTERVAL + 1
+        self.send(packet(later, "10.0.0.3", "1", "10.0.0.4", "80", "S"))
+        self.assertEqual(self.table.destination("10.0.0.2")["half_open"], 0)
+        self.assertEqual(self.table.expired, 5)
+        self.assertIsNone(self.table.connection_state("10.0.0.1", "40000", "10.0.0.2", "80"))
+
+    def test_eviction_keeps_half_open_counts(self):
+        # More SYNs than the table holds: the oldest half-open entries are evicted
+        self.send(*(packet(100 + i // 200, "10.0.0.1", str(10000 + i), "10.0.0.2", "80", "S") for i in range(900)))
+        self.assertGreater(self.table.evicted, 0)
+        self.assertEqual(self.table.destination("10.0.0.2")["half_open"], self.table.stats()["connections"])
+        self.assertIsNone(self.table.connection_state("10.0.0.1", "10000", "10.0.0.2", "80"))
+        self.assertEqual(self.table.connection_state("10.0.0.1", "10899", "10.0.0.2", "80"), "syn_sent")
+
+    def test_lookups_after_rebuild(self):
+        self.handshake(100, "10.0.0.1", "40000", "10.0.0.2", "443")
+        self.send(packet(100, "10.0.0.5", "40001", "10.0.0.6", "80", "S"))
+        # Connections to other destinations, closed again, leave tombstones
+        # and destination ids that the rebuild drops
+        for i in range(300):
+            self.handshake(100, "10.0.1.1", str(20000 + i), f"10.0.2.{i % 250}", "22")
+            self.send(packet(100, "10.0.1.1", str(20000 + i), f"10.0.2.{i % 250}", "22", "F"))
+        self.table._rebuild()
+        self.assertEqual(self.table.stats()["connections"], 2)
+        self.assertEqual(self.table.connection_state("10.0.0.2", "443", "10.0.0.1", "40000"), "established")
+        self.assertEqual(self.table.connection_state("10.0.0.5", "40001", "10.0.0.6", "80"), "syn_sent")
+        # The surviving half-open entry still points at its destination
+        self.send(packet(101, "10.0.0.5", "40001", "10.0.0.6", "80", "R"))
+        self.assertEqual(self.table.destination("10.0.0.6")["half_open"], 0)
+        self.assertIsNone(self.table.connection_state("10.0.0.5", "40001", "10.0.0.6", "80"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -47,7 +47,7 @@ FIELD_MAP = [
     "payload_len_udp", "info"
 ]
 
-OUTPUT_FILE = "live_data/stream.jsonl"
+OUTPUT_FILE = os.environ.get("NETFLOW_STREAM_FILE", "live_data/stream.jsonl")
 packet_queue = queue.Queue(maxsize=100000)
 
 def file_writer_worker():
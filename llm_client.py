@@ -0,0 +1,155 @@
+"""
+Pooled, bounded client for OpenAI-compatible chat completions.
+
+Used by the engine's chat UDF. One keep-alive session is shared by all
+questions. At most NETFLOW_LLM_CONCURRENCY calls are in flight; a question
+that can't get a slot within NETFLOW_LLM_QUEUE_TIMEOUT fails immediately
+instead of piling up. After repeated connection failures or timeouts the
+endpoint is skipped for a short cooldown, so a dead provider costs
+milliseconds per question instead of a full timeout.
+
+Point NETFLOW_LLM_BASE_URL at any OpenAI-compatible server (e.g. the stub
+in chat_load_test.py) to test without OpenRouter.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+LLM_BASE_URL = os.environ.get("NETFLOW_LLM_BASE_URL", DEFAULT_BASE_URL).rstrip("/")
+LLM_MAX_CONCURRENCY = int(os.environ.get("NETFLOW_LLM_CONCURRENCY", 4))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("NETFLOW_LLM_QUEUE_TIMEOUT", 5))
+# Below the dashboard proxy's 30 s timeout, so the analyst sees our error
+LLM_TIMEOUT = float(os.environ.get("NETFLOW_LLM_TIMEOUT", 25))
+CONNECT_TIMEOUT = 3.05
+
+# Consecutive failures that trip the breaker, and how long it stays open
+FAILURE_THRESHOLD = 3
+COOLDOWN = 15.0
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMClient:
+    def __init__(self, base_url: str = LLM_BASE_URL, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def has_credentials(self) -> bool:
+        # Local OpenAI-compatible servers usually don't need a key
+        return bool(os.environ.get("OPENROUTER_API_KEY")) or self.base_url != DEFAULT_BASE_URL
+
+    def _record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self._failures = 0
+                return
+            self.errors += 1
+            self._failures += 1
+            if self._failures >= FAILURE_THRESHOLD:
+                self._open_until = time.monotonic() + COOLDOWN
+
+    def _acquire(self):
+        wait = self._open_until - time.monotonic()
+        if wait > 0:
+            self.rejected += 1
+            raise LLMError(f"endpoint unavailable after repeated failures, retrying in {wait:.0f}s")
+        if not self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            self.rejected += 1
+            raise LLMError("too many questions in flight, try again shortly")
+        self.calls += 1
+
+    def _post(self, prompt: str, model: str, stream: bool = False) -> requests.Response:
+        headers = {"Content-Type": "application/json"}
+        api_key = os.environ.get("OPENROUTER_API_KEY")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            payload["stream"] = True
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            headers=headers,
+            json=payload,
+            # With stream=True the read timeout applies between chunks
+            timeout=(CONNECT_TIMEOUT, LLM_TIMEOUT),
+            stream=stream,
+        )
+        # Client errors (bad model, quota) say nothing about endpoint health
+        self._record(response.status_code < 500)
+        response.raise_for_status()
+        return response
+
+    def chat(self, prompt: str, model: str) -> str:
+        """Returns the completion text. Raises LLMError on any failure."""
+        self._acquire()
+        try:
+            return self._post(prompt, model).json()["choices"][0]["message"]["content"]
+        except requests.exceptions.HTTPError as e:
+            raise LLMError(f"{e} - {e.response.text}") from e
+        except (KeyError, IndexError, ValueError) as e:
+            # Includes requests' JSONDecodeError
+            raise LLMError(f"unexpected response: {e}") from e
+        except requests.exceptions.RequestException as e:
+            self._record(False)
+            raise LLMError(str(e)) from e
+        finally:
+            self._slots.release()
+
+    def stream_chat(self, prompt: str, model: str):
+        """Yields answer text as the provider streams it (OpenAI-style SSE).
+        Raises LLMError on any failure; closing the generator closes the
+        upstream connection."""
+        self._acquire()
+        try:
+            with self._post(prompt, model, stream=True) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    # Skip keep-alive comments (": OPENROUTER PROCESSING") and blank separators
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("error"):
+                        raise LLMError(str(chunk["error"]))
+                    delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except requests.exceptions.HTTPError as e:
+            raise LLMError(f"{e} - {e.response.text}") from e
+        except (KeyError, IndexError, ValueError) as e:
+            raise LLMError(f"unexpected response: {e}") from e
+        except requests.exceptions.RequestException as e:
+            self._record(False)
+            raise LLMError(str(e)) from e
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "breaker_open": time.monotonic() < self._open_until,
+        }
+
+
+llm_client = LLMClient()
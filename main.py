@@ -1,19 +1,15 @@
-import pandas as pd
+import time
+_PROCESS_START = time.time()
+
+import asyncio
 import uuid
 import os
-import requests
+import sys
+import threading
 import json
-import torch
-from sentence_transformers import SentenceTransformer, util
 import pathway as pw
 import datetime
 from typing import Any
-from pathway.stdlib.indexing.nearest_neighbors import BruteForceKnnFactory
-from pathway.xpacks.llm import llms
-from pathway.xpacks.llm.document_store import DocumentStore
-from pathway.xpacks.llm.llms import LiteLLMChat
-from pathway.xpacks.llm.embedders import SentenceTransformerEmbedder
-import os
 from dotenv import load_dotenv
 
 from features.feature_tcp_flags import detect_abnormal_flags
@@ -22,10 +18,93 @@ from features.feature_small_packets import detect_small_packet_flow
 from features.feature_sequence import analyze_sequence
 from features.feature_encryption import get_encryption_label
 from features.feature_flow_stats import compute_flow_stats
-import uuid
+from features.feature_heavy_hitters import heavy_hitters
+from features.feature_cardinality import cardinality
+from features.feature_tcp_state import tcp_state
+from features.feature_host_profiles import host_profiles
+import scoring
+from scoring import scorer
+from rules import rule_set
+from broadcast_client import DASHBOARD_SINK, API_URL, publish
+from rag_index import query_terms, rag_index
+from anomaly_history import anomaly_history, parse_time_range
+from anomaly_digest import anomaly_digests
+from fast_lane import fast_lane
+from llm_client import LLMError, llm_client
+from chat_cache import chat_cache
+import chat_stream
 
 load_dotenv()
 
+# "full" loads the embedding model in the background once packets flow;
+# "lite" never touches the ML stack (keyword-only AI context).
+ENGINE_MODE = os.environ.get("NETFLOW_MODE", "full")
+# Start the warm-up this long after launch even if no packet has arrived
+WARMUP_DELAY = float(os.environ.get("NETFLOW_WARMUP_DELAY", 10))
+
+_first_packet = threading.Event()
+STARTUP = {"first_packet_seconds": None, "warmup_seconds": None}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _mark_first_packet():
+    if _first_packet.is_set():
+        return
+    STARTUP["first_packet_seconds"] = round(time.time() - _PROCESS_START, 3)
+    _first_packet.set()
+    print(f"[Startup] mode={ENGINE_MODE} first packet processed after "
+          f"{STARTUP['first_packet_seconds']:.2f}s, RSS {_rss_mb()} MB", flush=True)
+
+
+def _warm_up():
+    # Let the packet pipeline come up first; the model load competes for CPU
+    _first_packet.wait(timeout=WARMUP_DELAY)
+    started = time.time()
+    try:
+        rag_index.warm_up()
+    except Exception as e:
+        print(f"[Startup] Model warm-up failed: {e}", file=sys.stderr, flush=True)
+        return
+    STARTUP["warmup_seconds"] = round(time.time() - started, 3)
+    if rag_index.embeddings_enabled:
+        print(f"[Startup] Embedding model ready after {STARTUP['warmup_seconds']:.2f}s warm-up, "
+              f"RSS {_rss_mb()} MB", flush=True)
+
+
+def engine_status() -> dict:
+    return {
+        "ready": rag_index.ready,
+        "mode": ENGINE_MODE,
+        "uptime": round(time.time() - _PROCESS_START, 1),
+        **STARTUP,
+        "rss_mb": _rss_mb(),
+        "rag": rag_index.stats(),
+        "history": anomaly_history.stats(),
+        "digests": anomaly_digests.stats(),
+        "delta": delta_stats(),
+        "fast_lane": fast_lane.stats(),
+        "heavy_hitters": heavy_hitters.stats(),
+        "cardinality": cardinality.stats(),
+        "tcp_state": tcp_state.stats(),
+        "host_profiles": host_profiles.stats(),
+        "scoring": scorer.stats(),
+        "rules": rule_set.stats(),
+        "llm": llm_client.stats(),
+        "chat_cache": chat_cache.stats(),
+        "chat_stream": chat_stream.stats(),
+    }
+
 class PacketSchema(pw.Schema):
     timestamp: float
     protocols: str
@@ -49,8 +128,11 @@ class PacketSchema(pw.Schema):
     fragmentation: str | None
 
 
+# Written by live_capture.py; startup_bench.py points it at a scratch file
+STREAM_FILE = os.environ.get("NETFLOW_STREAM_FILE", "live_data/stream.jsonl")
+
 packets = pw.io.jsonlines.read(
-    "live_data/stream.jsonl",
+    STREAM_FILE,
     schema=PacketSchema,
     mode="streaming"
 )
@@ -59,6 +141,8 @@ packets = pw.io.jsonlines.read(
 # Log all raw traffic — gated by logging.all_packets flag
 @pw.udf
 def _gate_all_packets(_unused: float) -> bool:
+    if not _first_packet.is_set():
+        _mark_first_packet()
     return _is_logging_enabled("all_packets")
 
 pw.io.csv.write(
@@ -148,43 +232,86 @@ def mask_if_whitelisted(value: Any, whitelisted: bool) -> Any:
 def has_flags(flags: list[str]) -> bool:
     return len(flags) > 0
 
-@pw.udf
-def check_anomaly(
-    packet_count: int,
-    mean_size: float,
-    total_bytes: int,
-    duration: float,
-    dst_port: str | None
-) -> str:
-    reasons = []
-    
-    # Safe cast port
-    dport = 0
-    try:
-        dport = int(dst_port) if dst_port else 0
-    except ValueError:
-        pass
-
-    # 1. SYN Flood / Port Scan
-    # Increase threshold to 500 for local high-traffic bursts
-    rate = packet_count / max(duration, 0.001)
-    # if(packet_count > 10):
-    #     reasons.append("Potential SYN Flood / Scan")
-    if rate > 20 and mean_size < 100:
-        reasons.append("Potential SYN Flood / Scan")
-
-    # 2. Data Exfiltration (simplified proxy check)
-    if total_bytes > 50000 and packet_count > 100:
-         reasons.append(f"High Volume Transfer (Potential Exfiltration)")
-
-    # 3. Beaconing (Skipped - requires IAT)
-
-    # 4. Slow DoS (Relaxed)
-    if duration > 2.0 and packet_count > 20:
-        reasons.append("Potential Slow DoS Pattern")
+# Fan-out / fan-in detections from distinct-count sketches over the last
+# 10 s of packets (see features/feature_cardinality.py). Thresholds are
+# hot-reloaded from whitelist.json "cardinality".
+CARDINALITY_DEFAULTS = {"scan_ports": 100, "scan_hosts": 50, "ddos_sources": 200}
 
-
-    return "; ".join(reasons) if reasons else ""
+def cardinality_reasons(src_ip: str | None, src_port: str | None, dst_ip: str | None, dst_port: str | None) -> list[str]:
+    _update_whitelist_if_needed()
+    limits = {**CARDINALITY_DEFAULTS, **WHITELIST.get("cardinality", {})}
+    # Flow ids are canonical (not directional): scan reasons go to flows the
+    # high fan-out host opened, DDoS to flows toward the high fan-in host
+    endpoints = cardinality.initiator(src_ip, src_port, dst_ip, dst_port)
+    if endpoints is None:
+        return []
+    client, server = endpoints
+    reasons = []
+    if cardinality.estimate("src_ports", client) >= limits["scan_ports"]:
+        reasons.append("Port Scan (many destination ports)")
+    if cardinality.estimate("src_hosts", client) >= limits["scan_hosts"]:
+        reasons.append("Host Sweep (many destination hosts)")
+    if cardinality.estimate("dst_sources", server) >= limits["ddos_sources"]:
+        reasons.append("Potential DDoS (many sources)")
+    return reasons
+
+# Half-open connections and handshake completion per destination from the TCP
+# state table (see features/feature_tcp_state.py). Thresholds are hot-reloaded
+# from whitelist.json "tcp_state".
+TCP_STATE_DEFAULTS = {"syn_half_open": 100, "syn_min_completion": 0.2}
+
+def tcp_reasons(src_ip: str | None, dst_ip: str | None) -> list[str]:
+    _update_whitelist_if_needed()
+    limits = {**TCP_STATE_DEFAULTS, **WHITELIST.get("tcp_state", {})}
+    for ip in (src_ip, dst_ip):
+        if not ip:
+            continue
+        dest = tcp_state.destination(ip)
+        if dest["half_open"] >= limits["syn_half_open"] and dest["completion"] < limits["syn_min_completion"]:
+            return ["SYN Flood (half-open connections)"]
+    return []
+
+def is_established(src_ip, src_port, dst_ip, dst_port) -> bool:
+    return tcp_state.connection_state(src_ip, src_port, dst_ip, dst_port) == "established"
+
+# Flow windows are scored in micro-batches by scoring.py: the rules of
+# rules.json (see rules.py), per-host baselines and an offline-trained
+# isolation forest, all vectorized. Rules are hot-reloaded from rules.json,
+# model weights and thresholds from whitelist.json "scoring"; the model file
+# itself is reloaded whenever train_scoring_model.py rewrites it.
+SCORING_DEFAULTS = {"baseline_weight": 0.3, "baseline_z": 4.0, "forest_weight": 0.3, "forest_threshold": 0.62}
+
+@pw.udf(max_batch_size=scoring.BATCH_SIZE)
+def score_flows(
+    packet_count: list[int],
+    mean_size: list[float],
+    total_bytes: list[int],
+    duration: list[float],
+    src_ip: list[str | None],
+    dst_ip: list[str | None],
+    src_port: list[str | None],
+    dst_port: list[str | None],
+    event_time: list[float],
+    syn_count: list[int],
+    fin_count: list[int],
+    rst_count: list[int],
+    abnormal_count: list[int],
+) -> list[tuple[float, str, float]]:
+    _update_whitelist_if_needed()
+    settings = {**SCORING_DEFAULTS, **WHITELIST.get("scoring", {})}
+    flows = {
+        "packet_count": packet_count, "mean_size": mean_size, "total_bytes": total_bytes, "duration": duration,
+        "src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "event_time": event_time,
+        "syn_count": syn_count, "fin_count": fin_count, "rst_count": rst_count, "abnormal_count": abnormal_count,
+    }
+    endpoints = list(zip(src_ip, src_port, dst_ip, dst_port))
+    return scorer.score(
+        flows,
+        established=[is_established(*e) for e in endpoints],
+        handshake=[tcp_reasons(s, d) for s, d in zip(src_ip, dst_ip)],
+        fanout=[cardinality_reasons(*e) for e in endpoints],
+        settings=settings,
+    )
 
 @pw.udf
 def safe_float_udf(x: str | None) -> float:
@@ -254,13 +381,23 @@ def to_int_udf(x: str | None) -> int:
         return 0
 
 
+@pw.udf(return_type=int)
+def flag_int(val: str | None) -> int:
+    return 1 if val is not None and str(val).lower() in ("1", "true", "yes") else 0
+
+
 packets_with_key = packets.select(
     *pw.this,
     flow_key = canonical_key(pw.this.src_ip, pw.this.dst_ip, pw.this.src_port, pw.this.dst_port, pw.this.protocols),
     # Ensure types for UDF
     ts_float = pw.this.timestamp,
     size_int = to_int_udf(pw.this.packet_size),
-    seq_str = pw.apply(lambda x: str(x) if x else "0", pw.this.tcp_seq)
+    seq_str = pw.apply(lambda x: str(x) if x else "0", pw.this.tcp_seq),
+    # Per-packet flags, summed per flow for rules.json flag counts
+    syn_int = flag_int(pw.this.tcp_flags_syn),
+    fin_int = flag_int(pw.this.tcp_flags_fin),
+    rst_int = flag_int(pw.this.tcp_flags_rst),
+    abnormal_int = pw.if_else(pw.this.abnormal_flags.is_not_none(), 1, 0)
 )
 
 
@@ -282,6 +419,10 @@ flow_stats = packets_with_key.groupby(pw.this.flow_key).windowby(
     dst_port=pw.reducers.max(pw.this.dst_port),
     is_encrypted=pw.reducers.max(pw.this.is_encrypted),
     flow_key=pw.reducers.max(pw.this.flow_key),
+    syn_count=pw.reducers.sum(pw.this.syn_int),
+    fin_count=pw.reducers.sum(pw.this.fin_int),
+    rst_count=pw.reducers.sum(pw.this.rst_int),
+    abnormal_count=pw.reducers.sum(pw.this.abnormal_int),
 )
 
 
@@ -320,7 +461,11 @@ flow_features = flow_stats.select(
     dst_ip=get_dip(pw.this.flow_key),
     src_port=get_sport(pw.this.flow_key),
     dst_port=get_dport(pw.this.flow_key),
-    is_encrypted=pw.this.is_encrypted
+    is_encrypted=pw.this.is_encrypted,
+    syn_count=pw.this.syn_count,
+    fin_count=pw.this.fin_count,
+    rst_count=pw.this.rst_count,
+    abnormal_count=pw.this.abnormal_count
 ).filter(
     pw.this.src_port != pw.this.dst_port
 )
@@ -364,37 +509,6 @@ threshold_flows = flows_internal.filter(
     )
 )
 
-@pw.udf(return_type=float)
-def anomaly_score(packet_count, mean_size, total_bytes, duration):
-    rate = packet_count / max(duration, 0.001)
-
-    score = 0.0
-    # if packet_count > 5:
-    #     return 1.0
-    if packet_count > 50 and mean_size < 120:
-        score += 0.4
-
-    if total_bytes > 2000:
-        score += 0.3
-
-    if duration > 5:
-        score += 0.3
-
-    return min(score, 1.0)
-
-
-@pw.udf(return_type=float)
-def confidence(packet_count, duration):
-    if duration == 0:
-        return 0.0
-    density = packet_count / duration
-    if density > 50:
-        return 0.9
-    if density > 10:
-        return 0.7
-    return 0.5
-
-
 @pw.udf
 def filter_flags(flags: tuple[str | None, ...]) -> list[str]:
     return [f for f in flags if f is not None]
@@ -417,28 +531,31 @@ def mask_score(score: float, whitelisted: bool) -> float:
 
 flow_analysis = flows_with_whitelist.select(
     *pw.this,
-    raw_score=anomaly_score(
-        pw.this.packet_count,
-        pw.this.mean_size,
-        pw.this.total_bytes,
-        pw.this.duration
-    ),
-    anomaly_reason=check_anomaly(
+    scored=score_flows(
         pw.this.packet_count,
         pw.this.mean_size,
         pw.this.total_bytes,
         pw.this.duration,
-        pw.this.dst_port
+        pw.this.src_ip,
+        pw.this.dst_ip,
+        pw.this.src_port,
+        pw.this.dst_port,
+        pw.this.event_time,
+        pw.this.syn_count,
+        pw.this.fin_count,
+        pw.this.rst_count,
+        pw.this.abnormal_count
     )
 ).select(
+    *pw.this,
+    raw_score=pw.this.scored[0],
+    anomaly_reason=pw.this.scored[1],
+    confidence=pw.this.scored[2]
+).without(pw.this.scored).select(
     *pw.this,
     anomaly_score=mask_score(
         pw.this.raw_score,
         pw.this.whitelisted
-    ),
-    confidence=confidence(
-        pw.this.packet_count,
-        pw.this.duration
     )
 )
 debug_8080 = flow_analysis.filter(
@@ -461,6 +578,7 @@ flow_pulse = flow_analysis.windowby(
     total_bytes=pw.reducers.max(pw.this.total_bytes),
     duration=pw.reducers.max(pw.this.duration),
     event_time=pw.reducers.max(pw.this.event_time),
+    window_start=pw.this._pw_window_start,
     # Aliases for Frontend
     flow=pw.reducers.max(pw.this.flow_id), 
     last_packet_time=pw.reducers.max(pw.this.event_time),
@@ -468,6 +586,91 @@ flow_pulse = flow_analysis.windowby(
     whitelisted=pw.reducers.max(pw.this.whitelisted),
 )
 
+# Delta suppression: a flow is re-reported every window even when nothing
+# changed. Only reports that differ from the last one sent for the flow go
+# downstream (dashboard, anomaly log, AI context), plus a keyframe every
+# keyframe_seconds so consumers can resync. Thresholds are hot-reloaded from
+# whitelist.json "delta_suppression".
+DELTA_DEFAULTS = {"enabled": True, "score": 0.05, "counters_pct": 0.2, "keyframe_seconds": 30}
+DELTA_STATE_TTL = 300.0
+_delta_lock = threading.Lock()
+_delta_last = {}  # flow_id -> (score, reason, packets, bytes, sent_at) of the last report sent
+_delta_decided = {}  # (flow_id, window_start) -> sent
+_delta_stats = {"forwarded": 0, "suppressed": 0, "keyframes": 0}
+_delta_pruned_at = time.time()
+
+def _delta_settings() -> dict:
+    _update_whitelist_if_needed()
+    return {**DELTA_DEFAULTS, **WHITELIST.get("delta_suppression", {})}
+
+def _relative_change(new, old) -> float:
+    return abs((new or 0) - (old or 0)) / max(abs(old or 0), 1)
+
+def _prune_delta_state(now: float):
+    global _delta_last, _delta_decided, _delta_pruned_at
+    cutoff = now - DELTA_STATE_TTL
+    _delta_last = {flow: last for flow, last in _delta_last.items() if last[4] >= cutoff}
+    newest = max((window for _, window in _delta_decided), default=0.0)
+    _delta_decided = {key: sent for key, sent in _delta_decided.items() if key[1] >= newest - DELTA_STATE_TTL}
+    _delta_pruned_at = now
+
+def delta_forward(flow_id, window_start, score, reason, packets, total_bytes) -> bool:
+    now = time.time()
+    settings = _delta_settings()
+    with _delta_lock:
+        if now - _delta_pruned_at > 60:
+            _prune_delta_state(now)
+        key = (flow_id, window_start)
+        last = _delta_last.get(flow_id)
+        # Once a window's report was sent, its later versions must follow it,
+        # otherwise downstream would only see the retraction
+        if not settings["enabled"] or _delta_decided.get(key):
+            send, keyframe = True, False
+        elif last is None or now - last[4] >= float(settings["keyframe_seconds"]):
+            send, keyframe = True, last is not None
+        else:
+            keyframe = False
+            send = (
+                reason != last[1]
+                or abs((score or 0.0) - last[0]) >= float(settings["score"])
+                or _relative_change(packets, last[2]) >= float(settings["counters_pct"])
+                or _relative_change(total_bytes, last[3]) >= float(settings["counters_pct"])
+            )
+        if send:
+            _delta_last[flow_id] = (score or 0.0, reason, packets, total_bytes, now)
+            _delta_decided[key] = True
+            _delta_stats["forwarded"] += 1
+            _delta_stats["keyframes"] += keyframe
+        else:
+            _delta_decided[key] = False
+            _delta_stats["suppressed"] += 1
+        return send
+
+def delta_stats() -> dict:
+    total = _delta_stats["forwarded"] + _delta_stats["suppressed"]
+    return {
+        **_delta_stats,
+        "suppressed_ratio": round(_delta_stats["suppressed"] / total, 3) if total else 0.0,
+        "tracked_flows": len(_delta_last),
+    }
+
+# Not deterministic: Pathway memoizes the decision, so a row's retraction
+# follows the same path as its insertion
+@pw.udf
+def is_material_change(flow_id: str, window_start: float, score: float, reason: str, packets: int, total_bytes: int) -> bool:
+    return delta_forward(flow_id, window_start, score, reason, packets, total_bytes)
+
+flow_updates = flow_pulse.filter(
+    is_material_change(
+        pw.this.flow_id,
+        pw.this.window_start,
+        pw.this.anomaly_score,
+        pw.this.anomaly_reason,
+        pw.this.packet_count,
+        pw.this.total_bytes,
+    )
+).without(pw.this.window_start)
+
 
 # Filter for anomalies only (Shared logic)
 @pw.udf
@@ -483,35 +686,90 @@ def is_above_threshold(score: float) -> bool:
 #     pw.this.anomaly_score > 0.5
 # )
 # anomalous_pulse = flow_pulse.filter(~pw.this.whitelisted)
-anomalous_pulse = flow_pulse.filter(
+anomalous_pulse = flow_updates.filter(
     is_above_threshold(pw.this.anomaly_score) & (~pw.this.whitelisted)
 )
-port_monitor = flows_internal.filter(
-    pw.this.is_internal_target & (~pw.this.whitelisted)
-).groupby(
-    pw.this.dst_ip,
-    pw.this.dst_port
-).windowby(
-    pw.this.event_time,
-    window=pw.temporal.sliding(hop=1.0, duration=5.0),
-).reduce(
-    target=pw.reducers.max(pw.this.dst_ip),
-    port=pw.reducers.max(pw.this.dst_port),
-    packets=pw.reducers.sum(pw.this.packet_count),
-    bytes=pw.reducers.sum(pw.this.total_bytes),
-    event_time=pw.reducers.max(pw.this.event_time),
+
+# Dashboard sink: Django's /api/update/ (default) or the direct WebSocket
+# broadcaster (NETFLOW_DASHBOARD_SINK=broadcaster), see broadcast_client.py
+def _publish_row(key, row, time, is_addition):
+    # Retractions only matter to the HTTP sink's diff stream; browsers want the latest row
+    if is_addition:
+        publish({**row, "time": time, "diff": 1})
+
+def push_to_dashboard(table):
+    if DASHBOARD_SINK == "broadcaster":
+        pw.io.subscribe(table, on_change=_publish_row)
+    else:
+        pw.io.http.write(
+            table,
+            url=API_URL,
+            method="POST",
+            headers={"Content-Type": "application/json"}
+        )
+
+
+push_to_dashboard(anomalous_pulse)
+
+# --- Fast lane (see fast_lane.py) ---
+# Flag-based detections and flows with a critical reason skip the pulse
+# window and go straight to the dashboard as critical_alert messages.
+# Critical reasons are hot-reloaded from whitelist.json "fast_lane"; the
+# defaults are the cross-flow scan and flood detections. They are matched
+# by prefix rather than gated on the score, which host baselines and the
+# forest can push to 1.0 for an ordinary bulk transfer.
+FAST_LANE_DEFAULTS = {
+    "enabled": True,
+    "critical_reasons": ["SYN Flood", "Port Scan", "Host Sweep", "Potential DDoS"],
+}
+
+def _fast_lane_settings() -> dict:
+    _update_whitelist_if_needed()
+    return {**FAST_LANE_DEFAULTS, **WHITELIST.get("fast_lane", {})}
+
+@pw.udf
+def is_fast_lane_packet(abnormal_flags: str | None, whitelisted: bool) -> bool:
+    return abnormal_flags is not None and not whitelisted and bool(_fast_lane_settings()["enabled"])
+
+@pw.udf
+def is_critical(reason: str | None, whitelisted: bool) -> bool:
+    settings = _fast_lane_settings()
+    if not settings["enabled"] or whitelisted or not reason:
+        return False
+    prefixes = tuple(settings["critical_reasons"])
+    return any(part.strip().startswith(prefixes) for part in reason.split(";"))
+
+packets_checked = packets_with_key.select(
+    flow_id=format_flow_id_udf(
+        get_sip(pw.this.flow_key),
+        get_dip(pw.this.flow_key),
+        get_sport(pw.this.flow_key),
+        get_dport(pw.this.flow_key)
+    ),
+    src_ip=pw.this.src_ip,
+    dst_ip=pw.this.dst_ip,
+    src_port=pw.this.src_port,
+    dst_port=pw.this.dst_port,
+    tcp_flags_syn=pw.this.tcp_flags_syn,
+    tcp_flags_ack=pw.this.tcp_flags_ack,
+    tcp_flags_fin=pw.this.tcp_flags_fin,
+    tcp_flags_rst=pw.this.tcp_flags_rst,
+    abnormal_flags=pw.this.abnormal_flags,
+    size_int=pw.this.size_int,
+    timestamp=pw.this.timestamp,
+    whitelisted=is_whitelisted(pw.this.src_ip, pw.this.dst_ip, pw.this.src_port, pw.this.dst_port),
 )
-port_alerts = port_monitor.filter(
-    pw.this.packets > 0
+flagged_packets = packets_checked.filter(
+    is_fast_lane_packet(pw.this.abnormal_flags, pw.this.whitelisted)
 )
-
-pw.io.http.write(
-    anomalous_pulse,
-    url="http://localhost:8000/api/update/",
-    method="POST",
-    headers={"Content-Type": "application/json"}
+critical_flows = flow_analysis.filter(
+    is_critical(pw.this.anomaly_reason, pw.this.whitelisted)
 )
 
+fast_lane.log_enabled = lambda: _is_logging_enabled("critical_alerts")
+pw.io.subscribe(flagged_packets, on_change=fast_lane.on_packet)
+pw.io.subscribe(critical_flows, on_change=fast_lane.on_flow)
+
 # --- Graph Edge Aggregation ---
 # Group traffic by (source, target, port) to visualize connections
 # Window: 10s sliding (smoother graph updates)
@@ -549,28 +807,20 @@ pw.io.csv.write(
 )
 
 # Stream Graph Updates to same endpoint
-pw.io.http.write(
-    graph_edges,
-    url="http://localhost:8000/api/update/",
-    method="POST",
-    headers={"Content-Type": "application/json"}
-)
+push_to_dashboard(graph_edges)
 # ------------------------------
-port_alerts_stream = port_alerts.select(
-    target=pw.this.target,
-    port=pw.this.port,
-    packets=pw.this.packets,
-    bytes=pw.this.bytes,
-    time=pw.this.event_time,
-    type=pw.apply(lambda _: "port_alert", pw.this.port)
-)
-
-pw.io.http.write(
-    port_alerts_stream,
-    url="http://localhost:8000/api/update/",
-    method="POST",
-    headers={"Content-Type": "application/json"}
-)
+# Top sources, destinations, ports and flows over a 5 s window, published as
+# one top_talkers message per second from fixed-size sketches
+# (see features/feature_heavy_hitters.py)
+monitored_packets = packets_checked.filter(~pw.this.whitelisted)
+pw.io.subscribe(monitored_packets, on_change=heavy_hitters.record)
+# Distinct ports / hosts / sources per endpoint for scan and DDoS reasons in score_flows
+pw.io.subscribe(monitored_packets, on_change=cardinality.record)
+# Per-connection handshake state for SYN flood reasons in score_flows
+pw.io.subscribe(monitored_packets, on_change=tcp_state.record)
+# Per-host rate, bytes, peers, ports and active hours for baseline deviations
+# in score_flows (see features/feature_host_profiles.py)
+pw.io.subscribe(flows_with_whitelist.filter(~pw.this.whitelisted), on_change=host_profiles.record)
 
 
 # Anomaly log — gated by logging.anomalies flag
@@ -583,7 +833,7 @@ pw.io.csv.write(
     filename="docs/anomalies.csv"
 )
 
-# 6. Format for LLM Indexing (DocumentStore)
+# 6. Format anomaly documents for the AI context
 @pw.udf
 def format_doc_udf(flow_id, score, confidence, packets, bytes_sent, duration, reason) -> str:
     return (
@@ -608,72 +858,32 @@ live_docs = anomalous_pulse.select(
     )
 )
 
-@pw.udf
-def ensure_bytes(x) -> bytes:
-    if isinstance(x, bytes):
-        return x
-    return str(x).encode("utf-8")
-
-# FIX: Add static document to prevent Empty Index Panic during startup
-static_df = pd.DataFrame([
-    {
-        "data": b"Sentinel System initialized. Monitoring network traffic...",
-        "path": "static_init"
-    }
-])
-
-static_docs = pw.debug.table_from_pandas(static_df).select(
-    data=ensure_bytes(pw.this.data)
-)
-
 # --- SIDE-CAR RAG LOGIC ---
-# We write anomalies to a CSV and read them in the LLM UDF to bypass Pathway engine panics.
+# We write anomalies to a CSV log and embed them into a side-car vector index
+# that the LLM UDF queries, to bypass Pathway engine panics.
 # RAG context log — gated by logging.rag_context flag
 @pw.udf
 def _gate_rag(_unused: bytes) -> bool:
     return _is_logging_enabled("rag_context")
 
+rag_docs = live_docs.filter(_gate_rag(pw.this.data))
+
 pw.io.csv.write(
-    live_docs.filter(_gate_rag(pw.this.data)),
+    rag_docs,
     filename="docs/rag_context.csv"
 )
 
-from sentence_transformers import SentenceTransformer, util
-import torch
-
-_embedder_model = None
+# Embed each anomaly document once, as it is produced (see rag_index.py)
+def _index_rag_doc(key, row, time, is_addition):
+    if is_addition:
+        rag_index.add(row["data"])
 
-@pw.udf
-def semantic_search_udf(query: str, context_list: tuple) -> list:
-    global _embedder_model
-    if not context_list:
-        return []
-    
-    # We maintain only the last 50 chunks for performance and relevance
-    raw_list = list(context_list)
-    active_context = raw_list[-50:]
-    
-    if _embedder_model is None:
-        _embedder_model = SentenceTransformer("all-MiniLM-L6-v2")
-    
-    str_chunks = []
-    for c in active_context:
-        if isinstance(c, bytes):
-            str_chunks.append(c.decode("utf-8", errors="ignore"))
-        else:
-            str_chunks.append(str(c))
+pw.io.subscribe(rag_docs, on_change=_index_rag_doc)
 
-    query_emb = _embedder_model.encode(query, convert_to_tensor=True)
-    corpus_emb = _embedder_model.encode(str_chunks, convert_to_tensor=True)
-    
-    # Compute similarity
-    hits = util.semantic_search(query_emb, corpus_emb, top_k=3)[0]
-    
-    results = []
-    for hit in hits:
-        results.append({"text": str_chunks[hit["corpus_id"]]})
-    
-    return results
+# Long-horizon history for questions about earlier periods (see anomaly_history.py)
+pw.io.subscribe(anomalous_pulse, on_change=anomaly_history.record)
+# Per-host / per-period digests that lead the AI context (see anomaly_digest.py)
+pw.io.subscribe(anomalous_pulse, on_change=anomaly_digests.record)
 
 # Webserver & Queries
 query_server = pw.io.http.PathwayWebserver(host="0.0.0.0", port=8011)
@@ -684,13 +894,36 @@ class QuerySchema(pw.Schema):
     model: str | None
     selected_row: str | None
 
+# Questions are committed into the dataflow this often (ms)
+QUERY_COMMIT_MS = int(os.environ.get("NETFLOW_QUERY_COMMIT_MS", 50))
+
 queries, writer = pw.io.http.rest_connector(
     webserver=query_server,
     schema=QuerySchema,
-    autocommit_duration_ms=1000,
+    autocommit_duration_ms=QUERY_COMMIT_MS,
+    delete_completed_queries=True
+)
+
+# Readiness: GET /ready answers once the dataflow runs; "ready" turns true
+# after the embedding model has been warmed up (immediately in lite mode)
+class ReadySchema(pw.Schema):
+    probe: str | None = pw.column_definition(default_value=None)
+
+ready_queries, ready_writer = pw.io.http.rest_connector(
+    webserver=query_server,
+    route="/ready",
+    schema=ReadySchema,
+    methods=("GET",),
+    autocommit_duration_ms=100,
     delete_completed_queries=True
 )
 
+@pw.udf
+def engine_status_udf(_probe: str | None) -> pw.Json:
+    return pw.Json(engine_status())
+
+ready_writer(ready_queries.select(result=engine_status_udf(pw.this.probe)))
+
 # Process Queries
 # We use a unique string ID to avoid u128 index panics in older Pathway versions
 queries_pre = queries.select(
@@ -706,9 +939,6 @@ retrieved_documents = queries_pre.select(
     result = pw.apply(lambda _: [], pw.this.query)
 )
 
-import requests
-import json
-
 @pw.udf
 def build_prompts_udf(documents, query) -> str:
     if not documents:
@@ -746,115 +976,134 @@ prompts = retrieved_documents.select(
     selected_row=pw.this.selected_row
 )
 
-@pw.udf
-def call_openrouter(query: str, model: str | None, selected_row: str | None) -> str:
-    global _embedder_model
-    
-    # --- RAG SIDE-CAR: READ FROM CSV ---
-    context_str = ""
+# --- RAG SIDE-CAR: QUERY THE INCREMENTAL INDEX ---
+# Raw anomaly documents in the prompt. Broad questions are answered from the
+# digests; raw rows are for drill-down, or examples while no digest exists yet.
+RAW_EXAMPLES = 3
+RAW_DRILL_DOWN = 5
+
+def _flow_of(doc: str) -> str:
+    # History rows carry a "[time] " prefix
+    body = doc.split("] ", 1)[1] if doc.startswith("[") else doc
+    return body.split(" | ", 1)[0]
+
+def build_rag_context(query: str, query_vec=None) -> str:
     try:
-        csv_path = "docs/rag_context.csv"
-        # Check if it's a directory (Pathway can write CSVs as directories of parts)
-        if os.path.exists(csv_path):
-            import csv
-            all_rows = []
-            if os.path.isdir(csv_path):
-                import glob
-                for part in glob.glob(os.path.join(csv_path, "*.csv")):
-                    with open(part, "r") as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            # Only include active records (diff=1) and skip retracted ones
-                            if row.get("diff") == "1" and "data" in row:
-                                all_rows.append(row["data"])
-            else:
-                with open(csv_path, "r") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row.get("diff") == "1" and "data" in row:
-                            all_rows.append(row["data"])
-            
-            # Get last 200 for broader context coverage
-            active_context: Any = all_rows[-200:]
-            
-            if active_context:
-                # Keyword Boosting (IPs/Ports)
-                query_tokens = query.replace(":", " ").replace("-", " ").replace(".", " ").split()
-                keywords = [t for t in query_tokens if len(t) > 2] # Skip small tokens
-                
-                # Rows that exactly match a query token (IP, Port, etc.)
-                priority_docs = []
-                for doc in active_context:
-                    if any(kw.lower() in doc.lower() for kw in keywords):
-                        priority_docs.append(doc)
-                
-                # Semantic Search
-                if _embedder_model is None:
-                    _embedder_model = SentenceTransformer("all-MiniLM-L6-v2")
-                
-                query_emb = _embedder_model.encode(query, convert_to_tensor=True)
-                corpus_emb = _embedder_model.encode(active_context, convert_to_tensor=True)
-                # Increase top_k to 10 for better coverage
-                hits = util.semantic_search(query_emb, corpus_emb, top_k=min(10, len(active_context)))[0]
-                semantic_docs = [str(active_context[hit["corpus_id"]]) for hit in hits]
-                
-                # Combine: Keywords first, then Semantic
-                final_docs = []
-                seen = set()
-                # Prioritize keyword matches
-                for doc in priority_docs:
-                    if doc not in seen:
-                        final_docs.append(doc)
-                        seen.add(doc)
-                # Add semantic matches
-                for doc in semantic_docs:
-                    if doc not in seen:
-                        final_docs.append(doc)
-                        seen.add(doc)
-                
-                # Limit final context to 15 chunks (balanced)
-                context_str = " | ".join(final_docs[:15])
+        terms = query_terms(query)
+        ips = sorted(t[3:] for t in terms if t.startswith("ip:"))
+        drill_down = any(t.startswith(("ip:", "port:", "ep:", "flow:")) for t in terms)
+        time_range = parse_time_range(query)
+
+        # Digests first: the hosts asked about, or else the requested period
+        # (default: the last hour) and the busiest hosts
+        if ips:
+            digests = anomaly_digests.host_lines(ips)
+        else:
+            digests = []
+            if time_range is None or anomaly_digests.covers(time_range[0]):
+                digests.append(anomaly_digests.period_line(*(time_range or (None, None))))
+            digests.append(anomaly_digests.busiest_line())
+            digests = [line for line in digests if line]
+
+        if drill_down:
+            raw_limit = RAW_DRILL_DOWN
+        elif time_range and not anomaly_digests.covers(time_range[0]):
+            raw_limit = RAW_EXAMPLES  # older than the digests: history rows only
+        else:
+            raw_limit = 0 if digests else RAW_EXAMPLES
+
+        # Keyword Boosting: rows mentioning the question's IPs, ports, flows or reason words
+        priority_docs = rag_index.keyword_search(query, limit=15)
+
+        # Semantic Search: only the question is embedded here
+        semantic_docs = rag_index.search(query, k=10, query_vec=query_vec)
+
+        # History: older rows, restricted to a time phrase in the question if any
+        history_docs = anomaly_history.search(query, time_range, limit=15)
+
+        # Combine: Keywords first, then Semantic, then History.
+        # A question about a period ("last night") gets that period's rows first.
+        groups = [priority_docs, semantic_docs, history_docs]
+        if time_range:
+            groups = [history_docs, priority_docs, semantic_docs]
+        records = []
+        seen = set()
+        for doc in (doc for group in groups for doc in group):
+            if len(records) >= raw_limit:
+                break
+            # One document per flow: its repeated reports are near-identical
+            flow = _flow_of(doc)
+            if flow not in seen:
+                records.append(doc)
+                seen.add(flow)
+
+        sections = []
+        if digests:
+            sections.append("Summary:\n" + "\n".join(f"- {line}" for line in digests))
+        if records:
+            sections.append("Records:\n" + "\n".join(f"- {doc}" for doc in records))
+        return "\n".join(sections)
     except Exception as e:
-        context_str = f"RAG Side-car Error: {str(e)}"
+        return f"RAG Side-car Error: {str(e)}"
+
+
+def prepare_chat(query: str, model: str | None, selected_row: str | None):
+    """Retrieval and prompt assembly shared by the query endpoint and the
+    streaming side path. Returns (prompt, model, cache scope, query vector)."""
+    # The question vector is reused by retrieval and the cache's semantic tier
+    try:
+        query_vec = rag_index.embed_query(query)
+    except Exception:
+        query_vec = None
+    context_str = build_rag_context(query, query_vec)
 
     selected_context = selected_row if selected_row else ""
-    system_prompt = f"System: Network Context: {context_str}\n{selected_context}\n\nUse this context to answer precisely. If empty, answer generally."
+    system_prompt = f"System: Network Context:\n{context_str}\n{selected_context}\n\nUse this context to answer precisely. If empty, answer generally."
     user_query = f"User: {query}"
     full_prompt = f"{system_prompt}\n\n{user_query}"
-    
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
-        return "Error: OPENROUTER_API_KEY is not set."
-    
+
     target_model = str(model) if model else "arcee-ai/trinity-large-preview:free"
     if target_model.startswith("openrouter/"):
         target_model = target_model.replace("openrouter/", "", 1)
-        
+
+    # Same question, model, rows and retrieved context -> same answer
+    scope = chat_cache.scope(target_model, selected_row, context_str)
+    return full_prompt, target_model, scope, query_vec
+
+
+# Runs off the dataflow: rows are answered as their LLM calls finish, so a
+# slow question never holds up the ones behind it (see llm_client.py for
+# pooling, timeouts and the concurrency limit)
+@pw.udf(executor=pw.udfs.fully_async_executor(autocommit_duration_ms=QUERY_COMMIT_MS))
+async def call_openrouter(query: str, model: str | None, selected_row: str | None) -> str:
+    if not llm_client.has_credentials():
+        return "Error: OPENROUTER_API_KEY is not set."
+
+    # Embedding the question is CPU work; keep it off the event loop
+    full_prompt, target_model, scope, query_vec = await asyncio.to_thread(prepare_chat, query, model, selected_row)
+
+    cached = chat_cache.get(query, scope, query_vec)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": target_model,
-                "messages": [{"role": "user", "content": full_prompt}],
-            },
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    except requests.exceptions.RequestException as e:
-        if e.response is not None:
-            return f"LLM Error ({target_model}): {str(e)} - {e.response.text}"
+        started = time.time()
+        answer = await asyncio.to_thread(llm_client.chat, full_prompt, target_model)
+        chat_cache.put(query, scope, answer, time.time() - started, query_vec)
+        return answer
+    except LLMError as e:
         return f"LLM Error ({target_model}): {str(e)}"
     except Exception as e:
         return f"LLM Error ({target_model}): {str(e)}"
 
 responses = prompts.select(
     result = call_openrouter(pw.this.prompt_text, pw.this.model, pw.this.selected_row)
-)
+).await_futures()
 
 writer(responses)
-pw.run()
\ No newline at end of file
+
+# Token streaming beside the dataflow (port 8012, see chat_stream.py)
+chat_stream.serve(prepare_chat)
+
+threading.Thread(target=_warm_up, name="model-warmup", daemon=True).start()
+pw.run()
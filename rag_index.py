@@ -0,0 +1,430 @@
+"""
+Incremental vector index for the AI analyst's RAG side-car.
+
+Anomaly documents are embedded once, as the engine produces them, by a
+background worker that batches pending texts. Vectors live in a single
+normalized NumPy matrix keyed by content hash, so a chat query only embeds
+the question and does one matrix-vector product over at most MAX_DOCS rows.
+
+Alongside the vectors, an inverted index maps IPs, ports, endpoints, flow
+ids and anomaly reason words to documents, so keyword matches for a question
+are set lookups rather than a scan.
+
+The index is persisted to docs/rag_index.npz and reloaded on start.
+Documents older than MAX_AGE or beyond MAX_DOCS (oldest first) are evicted.
+Vectors come from embedders.py (NETFLOW_EMBEDDER=torch|onnx).
+"""
+import atexit
+import hashlib
+import heapq
+import math
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from embedders import EMBEDDER, embedder_id, load_embedder
+
+INDEX_PATH = os.environ.get("NETFLOW_RAG_INDEX", "docs/rag_index.npz")
+MAX_DOCS = int(os.environ.get("NETFLOW_RAG_MAX_DOCS", 20000))
+MAX_AGE = float(os.environ.get("NETFLOW_RAG_MAX_AGE_HOURS", 24)) * 3600
+
+# NETFLOW_MODE=lite runs without the ML stack: documents are only kept for
+# keyword matching and semantic search returns nothing
+EMBEDDINGS_ENABLED = os.environ.get("NETFLOW_MODE", "full") != "lite"
+
+BATCH_SIZE = 64
+BATCH_WAIT = 0.5
+SAVE_INTERVAL = 30.0
+
+_IPV4_RE = re.compile(r"(?:\d{1,3}\.){3}\d{1,3}")
+_WORD_RE = re.compile(r"[a-z]{3,}")
+_FLOW_RE = re.compile(r"(\S+:\S+)\s*->\s*(\S+:\S+)")
+_TOKEN_SPLIT_RE = re.compile(r"[\s,;()\[\]'\"?!]+")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _endpoint_terms(endpoint: str) -> set:
+    host, _, port = endpoint.rpartition(":")
+    terms = set()
+    if host and host != "?":
+        terms.add(f"ip:{host}")
+    if port.isdigit():
+        terms.add(f"port:{port}")
+    if len(terms) == 2:
+        terms.add(f"ep:{endpoint}")
+    return terms
+
+
+def doc_terms(text: str) -> set:
+    """Index terms of an anomaly document ("Flow: a:p -> b:q | Description: ... | ...")."""
+    fields = dict(part.split(": ", 1) for part in text.split(" | ") if ": " in part)
+    terms = set()
+    flow = fields.get("Flow", "")
+    src, _, dst = flow.partition(" -> ")
+    if dst:
+        terms.add(f"flow:{flow}")
+    for endpoint in (src, dst):
+        if endpoint:
+            terms |= _endpoint_terms(endpoint)
+    terms.update(f"word:{w}" for w in _WORD_RE.findall(fields.get("Description", "").lower()))
+    return terms
+
+
+def query_terms(query: str) -> set:
+    """Candidate index terms in a question; only those present in the index matter."""
+    terms = {f"flow:{src} -> {dst}" for src, dst in _FLOW_RE.findall(query)}
+    for token in _TOKEN_SPLIT_RE.split(query):
+        token = token.strip(".")
+        host, sep, port = token.rpartition(":")
+        if sep and port.isdigit() and _IPV4_RE.fullmatch(host):
+            terms |= {f"ep:{token}", f"ip:{host}", f"port:{port}"}
+        elif token.isdigit():
+            terms.add(f"port:{token}")
+        elif _IPV4_RE.fullmatch(token) or token.count(":") >= 2:
+            terms.add(f"ip:{token}")
+    terms.update(f"word:{w}" for w in _WORD_RE.findall(query.lower()))
+    return terms
+
+
+class KeywordIndex:
+    """Inverted index from document terms to document ids.
+
+    Documents are kept in insertion order (re-adding moves one to the end),
+    so eviction by age or count pops from the front. Not thread-safe; the
+    owning RagIndex calls it under its lock.
+    """
+
+    def __init__(self):
+        self._docs = OrderedDict()  # doc id -> (hash, text, time, terms), oldest first
+        self._ids = {}  # hash -> doc id
+        self._postings = defaultdict(set)  # term -> doc ids
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def terms(self) -> int:
+        return len(self._postings)
+
+    def add(self, key: str, text: str, ts: float):
+        if key in self._ids:
+            self._remove(self._ids[key])
+        doc_id = self._next_id
+        self._next_id += 1
+        terms = doc_terms(text)
+        self._docs[doc_id] = (key, text, ts, terms)
+        self._ids[key] = doc_id
+        for term in terms:
+            self._postings[term].add(doc_id)
+
+    def _remove(self, doc_id: int):
+        key, _, _, terms = self._docs.pop(doc_id)
+        del self._ids[key]
+        for term in terms:
+            posting = self._postings[term]
+            posting.discard(doc_id)
+            if not posting:
+                del self._postings[term]
+
+    def evict(self, max_docs: int, oldest: float) -> int:
+        evicted = 0
+        while self._docs:
+            doc_id, (_, _, ts, _) = next(iter(self._docs.items()))
+            if len(self._docs) <= max_docs and ts >= oldest:
+                break
+            self._remove(doc_id)
+            evicted += 1
+        return evicted
+
+    def search(self, query: str, limit: int) -> list:
+        """Documents sharing terms with `query`, rarest matches first, newest on ties."""
+        matched = [term for term in query_terms(query) if term in self._postings]
+        if not matched:
+            return []
+        total = len(self._docs)
+        # Terms in most documents ("potential") only count when nothing rarer matched
+        selective = [term for term in matched if 2 * len(self._postings[term]) <= total] or matched
+        scores = defaultdict(float)
+        for term in selective:
+            posting = self._postings[term]
+            weight = math.log(1 + total / len(posting))
+            for doc_id in posting:
+                scores[doc_id] += weight
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [self._docs[doc_id][1] for doc_id, _ in top]
+
+
+class RagIndex:
+    """Thread-safe append-only vector store with eviction.
+
+    `add` is cheap and never blocks on the model; `search` sees documents once
+    the worker has embedded them (typically within BATCH_WAIT seconds).
+    """
+
+    def __init__(self, path: str = INDEX_PATH, backend: str = EMBEDDER, embeddings: bool = EMBEDDINGS_ENABLED):
+        self.path = path
+        self.backend = backend
+        self.embedder_name = embedder_id(backend)
+        self.embeddings_enabled = embeddings
+        self._model = None
+        self._warmed = False
+        self._model_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._queued = set()
+
+        self._hashes = []
+        self._texts = []
+        self._times = np.empty(0, dtype=np.float64)
+        self._vectors = None  # (capacity, dim) float32, first `_size` rows live
+        self._size = 0
+        self._positions = {}
+        self.keywords = KeywordIndex()
+
+        self._dirty = False
+        self._last_save = time.time()
+        self.embedded = 0
+        self.evicted = 0
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        if embeddings:
+            self._load()
+
+    # --- Model ---------------------------------------------------------------
+    def get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = load_embedder(self.backend)
+        return self._model
+
+    @property
+    def ready(self) -> bool:
+        return not self.embeddings_enabled or self._warmed
+
+    def warm_up(self):
+        """Load the model and run one encode so the first question doesn't
+        pay for weight loading and kernel initialization."""
+        if self.embeddings_enabled:
+            self._embed(["warm-up"])
+            if not self._pending.empty():
+                self._ensure_worker()
+
+    def _embed(self, texts: list) -> np.ndarray:
+        vectors = self.get_model().encode(texts, batch_size=BATCH_SIZE)
+        self._warmed = True
+        return vectors
+
+    # --- Ingest --------------------------------------------------------------
+    def add(self, text: str):
+        if not text:
+            return
+        key = content_hash(text)
+        now = time.time()
+        with self._lock:
+            self.keywords.add(key, text, now)
+            self.keywords.evict(MAX_DOCS, now - MAX_AGE)
+            if not self.embeddings_enabled:
+                return
+            pos = self._positions.get(key)
+            if pos is not None:
+                self._times[pos] = now
+                return
+            if key not in self._queued:
+                self._queued.add(key)
+                self._pending.put((key, text, now))
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="rag-index", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._pending.get(timeout=SAVE_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + BATCH_WAIT
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    vectors = self._embed([text for _, text, _ in batch])
+                    self._append(batch, vectors)
+                except Exception as e:
+                    print(f"[RAG] Embedding batch of {len(batch)} failed: {e}", file=sys.stderr)
+                    with self._lock:
+                        self._queued.difference_update(key for key, _, _ in batch)
+            self._evict()
+            if self._dirty and time.time() - self._last_save > SAVE_INTERVAL:
+                self.save()
+
+    def _append(self, batch: list, vectors: np.ndarray):
+        with self._lock:
+            needed = self._size + len(batch)
+            if self._vectors is None or self._vectors.shape[1] != vectors.shape[1]:
+                self._vectors = np.empty((max(needed, 1024), vectors.shape[1]), dtype=np.float32)
+            elif needed > len(self._vectors):
+                grown = np.empty((max(needed, 2 * len(self._vectors)), vectors.shape[1]), dtype=np.float32)
+                grown[: self._size] = self._vectors[: self._size]
+                self._vectors = grown
+            self._vectors[self._size:needed] = vectors
+            self._times = np.concatenate([self._times[: self._size], [t for _, _, t in batch]])
+            for key, text, _ in batch:
+                self._positions[key] = len(self._hashes)
+                self._hashes.append(key)
+                self._texts.append(text)
+                self._queued.discard(key)
+            self._size = needed
+            self.embedded += len(batch)
+            self._dirty = True
+
+    def _evict(self):
+        with self._lock:
+            self.keywords.evict(MAX_DOCS, time.time() - MAX_AGE)
+            if not self._size:
+                return
+            keep = self._times[: self._size] >= time.time() - MAX_AGE
+            if keep.sum() > MAX_DOCS:
+                cutoff = np.sort(self._times[: self._size][keep])[-MAX_DOCS]
+                keep &= self._times[: self._size] >= cutoff
+            if keep.all():
+                return
+            idx = np.flatnonzero(keep)
+            self.evicted += self._size - len(idx)
+            # Fresh arrays, so matrices handed out to in-flight searches stay valid
+            self._vectors = self._vectors[idx].copy()
+            self._times = self._times[idx]
+            self._hashes = [self._hashes[i] for i in idx]
+            self._texts = [self._texts[i] for i in idx]
+            self._positions = {key: i for i, key in enumerate(self._hashes)}
+            self._size = len(idx)
+            self._dirty = True
+
+    # --- Query ---------------------------------------------------------------
+    def embed_query(self, query: str) -> np.ndarray | None:
+        if not self.embeddings_enabled:
+            return None
+        return self._embed([query])[0]
+
+    def search(self, query: str, k: int = 10, query_vec: np.ndarray | None = None) -> list:
+        """Top-k documents for `query`; pass `query_vec` if already embedded."""
+        if not self.embeddings_enabled:
+            return []
+        with self._lock:
+            size = self._size
+            if not size:
+                return []
+            vectors = self._vectors[:size]
+            texts = self._texts
+        if query_vec is None:
+            query_vec = self._embed([query])[0]
+        scores = vectors @ query_vec
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [texts[i] for i in top]
+
+    def keyword_search(self, query: str, limit: int = 15) -> list:
+        """Documents mentioning the question's IPs, ports, flows or reason words."""
+        with self._lock:
+            return self.keywords.search(query, limit)
+
+    def stats(self) -> dict:
+        return {
+            "documents": self._size,
+            "pending": self._pending.qsize(),
+            "embedded": self.embedded,
+            "evicted": self.evicted,
+            "keyword_documents": len(self.keywords),
+            "keyword_terms": self.keywords.terms,
+            "embeddings": self.embeddings_enabled,
+            "embedder": self.embedder_name,
+            "model_loaded": self._model is not None,
+        }
+
+    # --- Persistence ---------------------------------------------------------
+    def save(self):
+        if not self.embeddings_enabled:
+            return
+        with self._lock:
+            if self._vectors is None:
+                return
+            data = {
+                "model": np.array(self.embedder_name),
+                "hashes": np.array(self._hashes, dtype=str),
+                "texts": np.array(self._texts, dtype=str),
+                "times": self._times[: self._size].copy(),
+                "vectors": self._vectors[: self._size].copy(),
+            }
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[RAG] Could not save index to {self.path}: {e}", file=sys.stderr)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["model"]) != self.embedder_name:
+                    # Different embedder: keep the documents, re-embed them in the background
+                    texts, times = [str(t) for t in data["texts"]], data["times"]
+                    print(f"[RAG] {self.path} was built with {data['model']}, re-embedding "
+                          f"{len(texts)} documents with {self.embedder_name}", file=sys.stderr)
+                    for text, ts in zip(texts, times):
+                        key = content_hash(text)
+                        if key not in self._queued:
+                            self._queued.add(key)
+                            self._pending.put((key, text, float(ts)))
+                    self._index_keywords(texts, times)
+                    return
+                self._hashes = [str(h) for h in data["hashes"]]
+                self._texts = [str(t) for t in data["texts"]]
+                self._times = data["times"].astype(np.float64)
+                self._vectors = data["vectors"].astype(np.float32)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"[RAG] Could not load index from {self.path}: {e}", file=sys.stderr)
+            return
+        self._size = len(self._hashes)
+        self._positions = {key: i for i, key in enumerate(self._hashes)}
+        self._index_keywords(self._texts, self._times)
+        self._evict()
+        print(f"[RAG] Loaded {self._size} indexed documents from {self.path}")
+
+    def _index_keywords(self, texts: list, times):
+        for i in np.argsort(times, kind="stable"):
+            self.keywords.add(content_hash(texts[i]), texts[i], float(times[i]))
+
+
+rag_index = RagIndex()
+atexit.register(rag_index.save)
@@ -0,0 +1,356 @@
+"""
+Declarative detection rules.
+
+Rules live in rules.json beside whitelist.json (NETFLOW_RULES_PATH) as a
+list of objects:
+
+    {"name": "telnet", "reason": "Telnet session", "weight": 0.3,
+     "when": {"port": {"in": [23]}, "packet_count": {">": 5}}}
+
+`when` holds conditions on flow features, all of which must hold; an
+"any" key takes a list of such objects, one of which must hold:
+
+- numbers: packet_count, total_bytes, duration, mean_size, rate,
+  syn_count, fin_count, rst_count, abnormal_count (packets with an
+  abnormal flag combination), src_port, dst_port and port (either side),
+  compared with ">", ">=", "<", "<=", "==", "!=", "in" or "not_in";
+- addresses: src_ip, dst_ip and ip (either side), with "in_cidr" or
+  "not_in_cidr" and a list of networks;
+- flags: established (TCP state table), handshake and fanout (the flow
+  has TCP state or cardinality reasons), compared with true / false.
+
+A matching rule adds its `weight` to the flow's score and its `reason` to
+the flow's reasons, in file order. A rule with "reasons_from": "handshake"
+or "fanout" adds those detectors' reasons instead. Rules with
+"enabled": false are skipped.
+
+The file is compiled into NumPy predicates over a whole batch of flows
+(see scoring.py) and is checked once per second; a file that fails to
+compile keeps the previous rules. Without the file, DEFAULT_RULES (the
+engine's built-in checks) apply. stats() reports matches and time per rule.
+"""
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+RULES_PATH = os.environ.get("NETFLOW_RULES_PATH", "rules.json")
+CHECK_INTERVAL = 1.0
+# Parsed addresses cached between batches
+ADDRESS_CACHE = 65536
+
+NUMBERS = ("packet_count", "total_bytes", "duration", "mean_size", "rate", "syn_count", "fin_count", "rst_count", "abnormal_count", "src_port", "dst_port")
+FLAGS = ("established", "handshake", "fanout")
+ADDRESSES = ("src_ip", "dst_ip")
+EITHER = {"port": ("src_port", "dst_port"), "ip": ("src_ip", "dst_ip")}
+COMPARISONS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal, "==": np.equal, "!=": np.not_equal}
+
+DEFAULT_RULES = [
+    {"name": "syn_scan", "reason": "Potential SYN Flood / Scan",
+     "when": {"rate": {">": 20}, "mean_size": {"<": 100}, "established": False}},
+    {"name": "syn_flood", "reasons_from": "handshake"},
+    {"name": "exfiltration", "reason": "High Volume Transfer (Potential Exfiltration)",
+     "when": {"total_bytes": {">": 50000}, "packet_count": {">": 100}}},
+    {"name": "slow_dos", "reason": "Potential Slow DoS Pattern",
+     "when": {"duration": {">": 2.0}, "packet_count": {">": 20}}},
+    {"name": "scans_and_floods", "reasons_from": "fanout"},
+    {"name": "small_packet_burst", "weight": 0.4,
+     "when": {"packet_count": {">": 50}, "mean_size": {"<": 120}, "established": False}},
+    {"name": "bulk_transfer", "weight": 0.3, "when": {"total_bytes": {">": 2000}}},
+    {"name": "long_flow", "weight": 0.3, "when": {"duration": {">": 5}}},
+    # Each flow of a scan or flood is small; the fan-out / fan-in is what counts
+    {"name": "scan_or_flood_score", "weight": 0.5, "when": {"any": [{"handshake": True}, {"fanout": True}]}},
+]
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _port(value) -> int:
+    try:
+        return int(value) if value else 0
+    except ValueError:
+        return 0
+
+
+class _Addresses:
+    """A batch of addresses: IPv4 as a uint32 column, IPv6 as objects."""
+
+    _cache = {}
+
+    def __init__(self, values: list):
+        parsed = [self._parse(v) for v in values]
+        self.v4 = np.fromiter((int(a) if a is not None and a.version == 4 else 0 for a in parsed), dtype=np.uint32, count=len(parsed))
+        self.is_v4 = np.fromiter((a is not None and a.version == 4 for a in parsed), dtype=bool, count=len(parsed))
+        self.v6 = [(i, a) for i, a in enumerate(parsed) if a is not None and a.version == 6]
+
+    @classmethod
+    def _parse(cls, value):
+        address = cls._cache.get(value, False)
+        if address is False:
+            try:
+                address = ipaddress.ip_address(str(value or "").split(",")[0])
+            except ValueError:
+                address = None
+            if len(cls._cache) >= ADDRESS_CACHE:
+                cls._cache.clear()
+            cls._cache[value] = address
+        return address
+
+
+class Columns(dict):
+    """Feature columns of a batch. Ports and addresses arrive as the raw
+    strings and are parsed the first time a rule needs them."""
+
+    def __init__(self, raw: dict, **columns):
+        super().__init__(columns)
+        self.raw = raw
+        self.rows = len(next(iter(columns.values())))
+
+    def __missing__(self, key):
+        if key in ("src_port", "dst_port"):
+            value = np.fromiter((_port(p) for p in self.raw[key]), dtype=np.int64, count=self.rows)
+        elif key in ADDRESSES:
+            value = _Addresses(self.raw[key])
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
+def _cidr_predicate(feature: str, networks) -> callable:
+    try:
+        networks = [ipaddress.ip_network(n, strict=False) for n in networks]
+    except (TypeError, ValueError) as e:
+        raise RuleError(f"bad network for {feature}: {e}")
+    v4 = [n for n in networks if n.version == 4]
+    v6 = [n for n in networks if n.version == 6]
+    prefixes = np.array([int(n.network_address) for n in v4], dtype=np.uint32)
+    masks = np.array([int(n.netmask) for n in v4], dtype=np.uint32)
+
+    def predicate(columns):
+        addresses = columns[feature]
+        hit = np.zeros(columns.rows, dtype=bool)
+        if len(prefixes):
+            hit |= addresses.is_v4 & ((addresses.v4[:, None] & masks) == prefixes).any(axis=1)
+        for i, address in (addresses.v6 if v6 else ()):
+            hit[i] = any(address in n for n in v6)
+        return hit
+    return predicate
+
+
+def _condition(feature: str, condition) -> list:
+    """Predicates (columns -> bool array) for one feature's condition."""
+    if feature in EITHER:
+        sides = [_condition(side, condition) for side in EITHER[feature]]
+        return [lambda c, a=_all(sides[0]), b=_all(sides[1]): a(c) | b(c)]
+    if feature in FLAGS:
+        if not isinstance(condition, bool):
+            raise RuleError(f"{feature} takes true or false")
+        return [lambda c, f=feature, v=condition: c[f] == v]
+    if not isinstance(condition, dict) or not condition:
+        raise RuleError(f"{feature} needs an object of comparisons")
+    predicates = []
+    for op, value in condition.items():
+        if feature in ADDRESSES:
+            if op not in ("in_cidr", "not_in_cidr") or not isinstance(value, list):
+                raise RuleError(f"{feature} takes in_cidr / not_in_cidr with a list of networks")
+            match = _cidr_predicate(feature, value)
+            predicates.append(match if op == "in_cidr" else lambda c, m=match: ~m(c))
+        elif feature in NUMBERS:
+            if op in ("in", "not_in"):
+                if not isinstance(value, list):
+                    raise RuleError(f"{feature} {op} takes a list")
+                values = np.array(sorted({float(v) for v in value}))
+                predicates.append(lambda c, f=feature, v=values, keep=op == "in": np.isin(c[f], v) == keep)
+            elif op in COMPARISONS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                predicates.append(lambda c, f=feature, cmp=COMPARISONS[op], v=float(value): cmp(c[f], v))
+            else:
+                raise RuleError(f"bad comparison {op!r}: {value!r} for {feature}")
+        else:
+            raise RuleError(f"unknown feature {feature!r}")
+    return predicates
+
+
+def _all(predicates: list) -> callable:
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def predicate(columns):
+        hit = np.ones(columns.rows, dtype=bool)
+        for p in predicates:
+            hit &= p(columns)
+        return hit
+    return predicate
+
+
+def _when(when: dict) -> callable:
+    if not isinstance(when, dict):
+        raise RuleError("when must be an object")
+    predicates = []
+    for feature, condition in when.items():
+        if feature == "any":
+            if not isinstance(condition, list) or not condition:
+                raise RuleError("any takes a non-empty list")
+            options = [_when(option) for option in condition]
+            predicates.append(lambda c, options=options: np.logical_or.reduce([o(c) for o in options]))
+        else:
+            predicates.extend(_condition(feature, condition))
+    if not predicates:
+        return lambda c: np.ones(c.rows, dtype=bool)
+    return _all(predicates)
+
+
+class Rule:
+    __slots__ = ("name", "reason", "reasons_from", "weight", "predicate", "evaluations", "matches", "seconds")
+
+    def __init__(self, spec: dict):
+        if not isinstance(spec, dict) or not spec.get("name"):
+            raise RuleError(f"every rule needs a name: {spec!r}")
+        self.name = str(spec["name"])
+        self.reason = spec.get("reason")
+        self.reasons_from = spec.get("reasons_from")
+        if self.reasons_from not in (None, "handshake", "fanout"):
+            raise RuleError(f"{self.name}: reasons_from must be handshake or fanout")
+        try:
+            self.weight = float(spec.get("weight", 0.0))
+            when = dict(spec.get("when", {}))
+            if self.reasons_from:
+                when.setdefault(self.reasons_from, True)
+            self.predicate = _when(when)
+        except (TypeError, ValueError) as e:
+            raise RuleError(f"{self.name}: {e}")
+        self.evaluations = 0
+        self.matches = 0
+        self.seconds = 0.0
+
+
+def compile_rules(specs) -> list:
+    if not isinstance(specs, list):
+        raise RuleError("rules must be a list")
+    rules = [Rule(spec) for spec in specs if not isinstance(spec, dict) or spec.get("enabled", True)]
+    names = [r.name for r in rules]
+    if len(set(names)) != len(names):
+        raise RuleError("rule names must be unique")
+    return rules
+
+
+class RuleSet:
+    def __init__(self, path: str = RULES_PATH):
+        self.path = path
+        self.rules = compile_rules(DEFAULT_RULES)
+        self.source = "defaults"
+        self._mtime = None
+        self._checked = 0.0
+        self._texts = {}  # matched-reason bitmask -> reason text
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.errors = 0
+
+    def refresh(self):
+        """Recompiles the rules file if it changed (at most once per CHECK_INTERVAL)."""
+        now = time.time()
+        if now - self._checked < CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        if mtime is None:
+            rules, source = compile_rules(DEFAULT_RULES), "defaults"
+        else:
+            try:
+                with open(self.path) as f:
+                    spec = json.load(f)
+                rules, source = compile_rules(spec.get("rules") if isinstance(spec, dict) else spec), self.path
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                print(f"[Rules] Keeping previous rules, {self.path}: {e}", file=sys.stderr)
+                return
+        # Counters carry over for rules that kept their name
+        previous = {r.name: r for r in self.rules}
+        for rule in rules:
+            if rule.name in previous:
+                old = previous[rule.name]
+                rule.evaluations, rule.matches, rule.seconds = old.evaluations, old.matches, old.seconds
+        with self._lock:
+            self.rules, self.source, self._texts = rules, source, {}
+        self.loads += 1
+        print(f"[Rules] Loaded {len(rules)} rules from {source}")
+
+    def evaluate(self, columns: Columns, handshake: list, fanout: list) -> tuple[np.ndarray, list]:
+        """Score contribution and reason text per flow."""
+        with self._lock:
+            rules, texts = self.rules, self._texts
+        score = np.zeros(columns.rows)
+        hits = []
+        for rule in rules:
+            started = time.perf_counter()
+            hit = rule.predicate(columns)
+            if rule.weight:
+                score += rule.weight * hit
+            rule.seconds += time.perf_counter() - started
+            rule.evaluations += columns.rows
+            rule.matches += int(np.count_nonzero(hit))
+            if rule.reason or rule.reasons_from:
+                hits.append((rule, hit))
+        if not hits:
+            return score, [""] * columns.rows
+
+        # Rows are grouped by which reason rules matched; the text of each
+        # combination is built once, except for rows quoting other detectors
+        if len(hits) > 62:
+            texts = {}
+            codes = [sum(1 << bit for bit, (_, hit) in enumerate(hits) if hit[i]) for i in range(columns.rows)]
+        else:
+            codes = np.zeros(columns.rows, dtype=np.int64)
+            for bit, (_, hit) in enumerate(hits):
+                codes |= hit.astype(np.int64) << bit
+            codes = codes.tolist()
+        spliced = np.zeros(columns.rows, dtype=bool)
+        for rule, hit in hits:
+            if rule.reasons_from:
+                spliced |= hit
+        reasons = []
+        for i, code in enumerate(codes):
+            if not code:
+                reasons.append("")
+            elif spliced[i]:
+                parts = []
+                for bit, (rule, _) in enumerate(hits):
+                    if code >> bit & 1:
+                        parts.extend((handshake if rule.reasons_from == "handshake" else fanout)[i] if rule.reasons_from else [rule.reason])
+                reasons.append("; ".join(parts))
+            else:
+                text = texts.get(code)
+                if text is None:
+                    text = texts[code] = "; ".join(rule.reason for bit, (rule, _) in enumerate(hits) if code >> bit & 1)
+                reasons.append(text)
+        return score, reasons
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "loads": self.loads,
+            "errors": self.errors,
+            "rules": {
+                r.name: {
+                    "matches": r.matches,
+                    "evaluations": r.evaluations,
+                    "ns_per_row": round(r.seconds / r.evaluations * 1e9, 1) if r.evaluations else None,
+                }
+                for r in self.rules
+            },
+        }
+
+
+rule_set = RuleSet()
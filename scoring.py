@@ -0,0 +1,277 @@
+"""
+Vectorized flow scoring.
+
+The engine scores flow windows in micro-batches (a Pathway batch UDF in
+main.py) instead of one Python call per row per rule. A batch becomes a
+feature matrix (log packets, bytes, duration, rate and mean size) and
+three scorers run over it with NumPy:
+
+- rules: the declarative rules of rules.json (see rules.py), which can
+  also quote the handshake and fan-out reasons main.py looks up per flow;
+- host baselines: each endpoint's profile (features/feature_host_profiles.py).
+  A flow far above either endpoint's usual rate, bytes, peers or ports, or
+  in an hour it is rarely active, adds "Unusual for host (...)" naming
+  what stood out;
+- isolation forest: trained offline from logged flows by
+  train_scoring_model.py. Flows that isolate quickly add
+  "Outlier flow (isolation forest)".
+
+The model file (MODEL_PATH) is checked once per second and swapped in when
+it changes, so retraining needs no engine restart. Model weights and
+thresholds come from whitelist.json "scoring" (see main.py).
+"""
+import math
+import os
+import sys
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from features.feature_host_profiles import ASPECTS, host_profiles
+from rules import Columns, rule_set
+
+MODEL_PATH = os.environ.get("NETFLOW_SCORING_MODEL", "models/isolation_forest.npz")
+FEATURES = ("log_packets", "log_bytes", "log_duration", "log_rate", "log_mean_size")
+# Rows per batch UDF call
+BATCH_SIZE = 1024
+MODEL_CHECK_INTERVAL = 1.0
+FLAG_COUNTS = ("syn_count", "fin_count", "rst_count", "abnormal_count")
+
+BASELINE_REASON = "Unusual for host ({})"
+FOREST_REASON = "Outlier flow (isolation forest)"
+
+def feature_matrix(packet_count, total_bytes, duration, mean_size) -> np.ndarray:
+    packets = np.asarray(packet_count, dtype=np.float64)
+    bytes_ = np.asarray(total_bytes, dtype=np.float64)
+    duration = np.maximum(np.asarray(duration, dtype=np.float64), 0.001)
+    mean_size = np.asarray(mean_size, dtype=np.float64)
+    return np.log1p(np.column_stack([packets, bytes_, duration, packets / duration, mean_size]))
+
+
+def confidences(packets: np.ndarray, duration: np.ndarray) -> np.ndarray:
+    """0.9 / 0.7 / 0.5 for dense / moderate / sparse flows (packets per
+    second over 50 / 10), 0 for flows without a duration."""
+    density = np.divide(packets, duration, out=np.zeros_like(packets), where=duration != 0)
+    return np.select([duration == 0, density > 50, density > 10], [0.0, 0.9, 0.7], 0.5)
+
+
+# --- Isolation forest --------------------------------------------------------
+
+def _average_path(n) -> np.ndarray:
+    """Average path length of an unsuccessful BST search over n points."""
+    n = np.asarray(n, dtype=np.float64)
+    safe = np.maximum(n, 2.0)
+    c = 2.0 * (np.log(safe - 1.0) + 0.5772156649) - 2.0 * (safe - 1.0) / safe
+    return np.where(n > 2, c, np.where(n == 2, 1.0, 0.0))
+
+
+class IsolationForest:
+    """Isolation forest with every tree in one flat node array, so a batch
+    walks all trees one level at a time with a few array lookups.
+
+    Children are stored next to each other (right = left + 1) and leaves
+    point to themselves with an infinite threshold, so the walk needs no
+    masking: after `depth` steps every row sits in a leaf, whose precomputed
+    path length (depth + expected depth of the points left in it) is summed.
+    """
+
+    def __init__(self, feature, threshold, left, size, sample_size: int, meta: dict | None = None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.size = size
+        self.sample_size = int(sample_size)
+        self.meta = meta or {}
+        self.depth = int(math.ceil(math.log2(max(self.sample_size, 2))))
+
+        trees, nodes = feature.shape
+        leaf = (feature < 0).ravel()
+        offset = np.repeat(np.arange(trees) * nodes, nodes)
+        self._roots = np.arange(trees) * nodes
+        self._feature = np.where(leaf, 0, feature.ravel()).astype(np.intp)
+        self._threshold = np.where(leaf, np.inf, threshold.ravel())
+        self._left = np.where(leaf, np.arange(trees * nodes), left.ravel() + offset).astype(np.intp)
+        node_depth = np.zeros(trees * nodes)
+        inner = np.flatnonzero(~leaf)
+        for _ in range(self.depth):
+            node_depth[self._left[inner]] = node_depth[self._left[inner] + 1] = node_depth[inner] + 1
+        self._path = node_depth + _average_path(size.ravel())
+
+    @classmethod
+    def fit(cls, x: np.ndarray, trees: int = 100, sample_size: int = 256, seed: int = 0) -> "IsolationForest":
+        rng = np.random.default_rng(seed)
+        sample_size = min(sample_size, len(x))
+        max_depth = int(math.ceil(math.log2(max(sample_size, 2))))
+        nodes = 2 * sample_size - 1
+        feature = np.full((trees, nodes), -1, dtype=np.int16)
+        threshold = np.zeros((trees, nodes))
+        left = np.zeros((trees, nodes), dtype=np.int32)
+        size = np.zeros((trees, nodes), dtype=np.int32)
+        for t in range(trees):
+            sample = x[rng.choice(len(x), sample_size, replace=False)]
+            stack = [(0, sample, 0)]
+            next_node = 1
+            while stack:
+                node, rows, depth = stack.pop()
+                size[t, node] = len(rows)
+                if depth >= max_depth or len(rows) <= 1:
+                    continue
+                spread = rows.max(axis=0) - rows.min(axis=0)
+                splittable = np.flatnonzero(spread > 0)
+                if not len(splittable):
+                    continue
+                f = rng.choice(splittable)
+                cut = rng.uniform(rows[:, f].min(), rows[:, f].max())
+                feature[t, node], threshold[t, node] = f, cut
+                left[t, node] = next_node  # the right child is next_node + 1
+                go_left = rows[:, f] < cut
+                stack.append((next_node, rows[go_left], depth + 1))
+                stack.append((next_node + 1, rows[~go_left], depth + 1))
+                next_node += 2
+        return cls(feature, threshold, left, size, sample_size)
+
+    def score(self, x: np.ndarray) -> np.ndarray:
+        """Anomaly score per row in (0, 1); above ~0.6 is unusual."""
+        n = len(x)
+        columns = np.ascontiguousarray(x.T).ravel()
+        rows = np.tile(np.arange(n), len(self._roots))
+        node = np.repeat(self._roots, n)
+        for _ in range(self.depth):
+            value = columns[self._feature[node] * n + rows]
+            node = self._left[node] + (value >= self._threshold[node])
+        path = self._path[node].reshape(len(self._roots), n).mean(axis=0)
+        return 2.0 ** (-path / _average_path(self.sample_size))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp, feature=self.feature, threshold=self.threshold, left=self.left, size=self.size, sample_size=self.sample_size, features=np.array(FEATURES),
+            trained_at=time.time(), rows=self.meta.get("rows", 0),
+        )
+        # Atomic, so the engine never loads a half-written model
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IsolationForest":
+        with np.load(path) as data:
+            if tuple(data["features"].tolist()) != FEATURES:
+                raise ValueError(f"model features {data['features'].tolist()} don't match {list(FEATURES)}")
+            return cls(
+                data["feature"], data["threshold"], data["left"], data["size"],
+                int(data["sample_size"]), {"trained_at": float(data["trained_at"]), "rows": int(data["rows"])},
+            )
+
+
+# --- Scorer ------------------------------------------------------------------
+
+class Scorer:
+    def __init__(self, model_path: str = MODEL_PATH, profiles=host_profiles, rules=rule_set):
+        self.model_path = model_path
+        self.profiles = profiles
+        self.rules = rules
+        self.model = None
+        self._model_mtime = 0.0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.model_loads = 0
+
+    def _refresh_model(self):
+        now = time.time()
+        if now - self._checked < MODEL_CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return
+        if mtime <= self._model_mtime:
+            return
+        self._model_mtime = mtime
+        try:
+            self.model = IsolationForest.load(self.model_path)
+            self.model_loads += 1
+            print(f"[Scoring] Loaded {self.model_path} ({self.model.meta.get('rows', 0)} training rows)")
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            print(f"[Scoring] Keeping previous model, failed to load {self.model_path}: {e}", file=sys.stderr)
+
+    def score(self, flows: dict, established, handshake, fanout, settings: dict):
+        """Scores a batch of flow windows. `flows` maps each flow feature
+        (packet_count, mean_size, total_bytes, duration, src_ip, dst_ip,
+        src_port, dst_port, event_time and the flag counts) to its column;
+        `established`, `handshake` and `fanout` (TCP state and cardinality
+        reasons per flow) come from main.py's per-flow lookups. Returns a
+        (score, reason, confidence) tuple per flow."""
+        started = time.perf_counter()
+        packets = np.asarray(flows["packet_count"], dtype=np.float64)
+        mean = np.asarray(flows["mean_size"], dtype=np.float64)
+        bytes_ = np.asarray(flows["total_bytes"], dtype=np.float64)
+        dur = np.asarray(flows["duration"], dtype=np.float64)
+        x = feature_matrix(packets, bytes_, dur, mean)
+        columns = Columns(
+            flows,
+            packet_count=packets, mean_size=mean, total_bytes=bytes_, duration=dur,
+            rate=packets / np.maximum(dur, 0.001),
+            established=np.asarray(established, dtype=bool),
+            handshake=np.fromiter(map(bool, handshake), dtype=bool, count=len(handshake)),
+            fanout=np.fromiter(map(bool, fanout), dtype=bool, count=len(fanout)),
+            **{name: np.asarray(flows[name], dtype=np.float64) for name in FLAG_COUNTS},
+        )
+        self.rules.refresh()
+        score, reasons = self.rules.evaluate(columns, handshake, fanout)
+        confidence = confidences(packets, dur)
+
+        # A model adds half its weight at its threshold and all of it at 1.5x;
+        # a weight of 0 switches it off
+        baseline_weight = float(settings["baseline_weight"])
+        forest_weight = float(settings["forest_weight"])
+        unusual = outlier = np.zeros(len(x), dtype=bool)
+        with self._lock:
+            self._refresh_model()
+            model = self.model if forest_weight > 0 else None
+        if baseline_weight > 0:
+            z_limit = float(settings["baseline_z"])
+            z, rare_hour = self.profiles.deviation(flows["src_ip"], flows["dst_ip"], packets, bytes_, dur, flows["event_time"])
+            aspects = np.column_stack([z >= z_limit, rare_hour])
+            unusual = aspects.any(axis=1)
+            top = z.max(axis=1)
+            strength = np.maximum(np.clip((top - z_limit) / z_limit + 0.5, 0.0, 1.0) * (top >= z_limit), 0.5 * rare_hour)
+            score = score + baseline_weight * strength
+        if model is not None:
+            outlier_limit = float(settings["forest_threshold"])
+            isolation = model.score(x)
+            outlier = isolation >= outlier_limit
+            score = score + forest_weight * np.clip((isolation - outlier_limit) / (1 - outlier_limit) + 0.5, 0.0, 1.0) * outlier
+        score = np.minimum(score, 1.0)
+
+        for i in np.flatnonzero(unusual | outlier).tolist():
+            parts = [reasons[i]] if reasons[i] else []
+            if unusual[i]:
+                parts.append(BASELINE_REASON.format(", ".join(name for name, hit in zip(ASPECTS + ("hour",), aspects[i]) if hit)))
+            if outlier[i]:
+                parts.append(FOREST_REASON)
+            reasons[i] = "; ".join(parts)
+        results = list(zip(score.tolist(), reasons, confidence.tolist()))
+
+        self.batches += 1
+        self.rows += len(x)
+        self.seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / self.seconds) if self.seconds else None,
+            "model": self.model_path if self.model is not None else None,
+            "model_rows": self.model.meta.get("rows") if self.model is not None else None,
+            "model_loads": self.model_loads,
+        }
+
+
+scorer = Scorer()
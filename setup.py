@@ -173,7 +173,33 @@ def setup_directories():
                 "all_packets": True,
                 "anomalies": True,
                 "rag_context": True,
-                "graph_edges": True
+                "graph_edges": True,
+                "critical_alerts": True
+            },
+            "cardinality": {
+                "scan_ports": 100,
+                "scan_hosts": 50,
+                "ddos_sources": 200
+            },
+            "tcp_state": {
+                "syn_half_open": 100,
+                "syn_min_completion": 0.2
+            },
+            "scoring": {
+                "baseline_weight": 0.3,
+                "baseline_z": 4.0,
+                "forest_weight": 0.3,
+                "forest_threshold": 0.62
+            },
+            "fast_lane": {
+                "enabled": True,
+                "critical_reasons": ["SYN Flood", "Port Scan", "Host Sweep", "Potential DDoS"]
+            },
+            "delta_suppression": {
+                "enabled": True,
+                "score": 0.05,
+                "counters_pct": 0.2,
+                "keyframe_seconds": 30
             }
         }
         wl_path.write_text(json.dumps(default_wl, indent=2))
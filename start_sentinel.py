@@ -3,8 +3,64 @@ import time
 import os
 import signal
 import sys
+import argparse
+import shutil
+import socket
 
-def start():
+INGEST_PORT = 8002
+REDIS_PORT = 6379
+
+def ensure_redis(root):
+    """Start a throwaway local Redis for the shared channel layer if none is running."""
+    try:
+        socket.create_connection(("127.0.0.1", REDIS_PORT), timeout=1).close()
+        print(f"Using existing Redis on port {REDIS_PORT}")
+        return None
+    except OSError:
+        pass
+    redis_server = shutil.which("redis-server")
+    if not redis_server:
+        print("Error: multi-worker mode needs redis-server (sudo apt install redis-server)")
+        sys.exit(1)
+    print(f"Launching Redis channel layer (Port {REDIS_PORT})...")
+    return subprocess.Popen(
+        [redis_server, "--port", str(REDIS_PORT), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+        stdout=open(f"{root}/redis.log", "w"),
+        stderr=subprocess.STDOUT
+    )
+
+def launch_django_workers(root, daphne, workers):
+    """N daphne processes accepting on one shared listening socket.
+
+    The kernel spreads browser connections across workers. Worker 0 also
+    listens on the local ingest port so that all engine updates (and hence the
+    coalescer's snapshot state) land in a single process.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", 8000))
+    listener.listen(1024)
+    fd = listener.fileno()
+
+    env = {**os.environ, "NETFLOW_CHANNEL_LAYER": "redis"}
+    procs = {}
+    for i in range(workers):
+        cmd = [daphne, "--fd", str(fd)]
+        if i == 0:
+            cmd += ["-e", f"tcp:port={INGEST_PORT}:interface=127.0.0.1"]
+        cmd.append("backend.asgi:application")
+        procs[f"Django-{i}"] = subprocess.Popen(
+            cmd,
+            cwd=f"{root}/dashboard/backend",
+            stdout=open(f"{root}/django.log" if i == 0 else f"{root}/django-{i}.log", "w"),
+            stderr=subprocess.STDOUT,
+            pass_fds=(fd,),
+            env=env
+        )
+    listener.close()
+    return procs
+
+def start(use_broadcaster=False, workers=1, lite=False):
     root = os.getcwd()
     venv_python = f"{root}/.venv/bin/python"
     daphne = f"{root}/.venv/bin/daphne"
@@ -12,7 +68,7 @@ def start():
     # 1. Cleanup
     print("--- Sentinel Orchestrator ---")
     print("Stopping existing services...")
-    subprocess.run("lsof -ti:5173,8000,8011 | xargs kill -9", shell=True, stderr=subprocess.DEVNULL)
+    subprocess.run(f"lsof -ti:5173,8000,8001,{INGEST_PORT},8011,8012 | xargs kill -9", shell=True, stderr=subprocess.DEVNULL)
     subprocess.run("pkill -f live_capture.py", shell=True, stderr=subprocess.DEVNULL)
     subprocess.run("pkill -f tshark", shell=True, stderr=subprocess.DEVNULL)
     subprocess.run("sudo pkill -f arpspoof", shell=True, stderr=subprocess.DEVNULL)
@@ -28,16 +84,34 @@ def start():
     time.sleep(2)
 
     # 2. Start Django
-    print("Launching Django Backend (Port 8000)...")
-    django_proc = subprocess.Popen(
-        [daphne, "-b", "0.0.0.0", "-p", "8000", "backend.asgi:application"],
-        cwd=f"{root}/dashboard/backend",
-        stdout=open(f"{root}/django.log", "w"),
-        stderr=subprocess.STDOUT
-    )
+    sink_env = {}
+    redis_proc = None
+    if workers > 1:
+        redis_proc = ensure_redis(root)
+        print(f"Launching Django Backend (Port 8000, {workers} workers, ingest on {INGEST_PORT})...")
+        django_procs = launch_django_workers(root, daphne, workers)
+        sink_env["NETFLOW_UPDATE_URL"] = f"http://localhost:{INGEST_PORT}/api/update/"
+    else:
+        print("Launching Django Backend (Port 8000)...")
+        django_procs = {"Django": subprocess.Popen(
+            [daphne, "-b", "0.0.0.0", "-p", "8000", "backend.asgi:application"],
+            cwd=f"{root}/dashboard/backend",
+            stdout=open(f"{root}/django.log", "w"),
+            stderr=subprocess.STDOUT
+        )}
+
+    # 2b. Optional direct WebSocket broadcaster (engine -> Unix socket -> browsers)
+    broadcaster_proc = None
+    if use_broadcaster:
+        print("Launching WebSocket Broadcaster (Port 8001)...")
+        broadcaster_proc = subprocess.Popen(
+            [venv_python, f"{root}/ws_broadcaster.py", "--port", "8001"],
+            stdout=open(f"{root}/broadcaster.log", "w"),
+            stderr=subprocess.STDOUT
+        )
+        sink_env["NETFLOW_DASHBOARD_SINK"] = "broadcaster"
 
     # 3. Start Live Capture
-    import shutil
     tshark_path = shutil.which("tshark")
     if not tshark_path and os.path.exists("/usr/bin/tshark"):
         tshark_path = "/usr/bin/tshark"
@@ -54,13 +128,15 @@ def start():
         capture_proc = None
 
     # 4. Start Pathway Engine
-    print("Launching Pathway Engine (Port 8011)...")
+    print(f"Launching Pathway Engine (Ports 8011, 8012{', lite mode' if lite else ''})...")
     time.sleep(5) 
     # Use the original user's huggingface cache to avoid re-downloading
     engine_env = {
         **os.environ, 
         "RUST_BACKTRACE": "1",
-        "HF_HOME": "/home/vinay/.cache/huggingface"
+        "HF_HOME": "/home/vinay/.cache/huggingface",
+        "NETFLOW_MODE": "lite" if lite else "full",
+        **sink_env
     }
     pathway_proc = subprocess.Popen(
         [venv_python, f"{root}/main.py"],
@@ -75,7 +151,8 @@ def start():
         ["npm", "run", "dev", "--", "--host", "0.0.0.0"],
         cwd=f"{root}/dashboard/frontend",
         stdout=open(f"{root}/vite.log", "w"),
-        stderr=subprocess.STDOUT
+        stderr=subprocess.STDOUT,
+        env={**os.environ, "VITE_WS_PORT": "8001" if use_broadcaster else "8000"}
     )
 
     print("\n[SUCCESS] Sentinel is fully operational!")
@@ -84,20 +161,26 @@ def start():
     print("Press Ctrl+C to stop all services.")
     
     procs = {
-        "Django": django_proc,
+        **django_procs,
         "Pathway": pathway_proc,
         "Vite": vite_proc
     }
+    if redis_proc:
+        procs["Redis"] = redis_proc
 
     # 6. Start System Monitor
     print("Launching System Monitor...")
     monitor_proc = subprocess.Popen(
         [venv_python, f"{root}/system_monitor.py"],
         stdout=open(f"{root}/monitor.log", "w"),
-        stderr=subprocess.STDOUT
+        stderr=subprocess.STDOUT,
+        env={**os.environ, **sink_env}
     )
     procs["SystemMonitor"] = monitor_proc
 
+    if broadcaster_proc:
+        procs["Broadcaster"] = broadcaster_proc
+
     if capture_proc:
         procs["Capture"] = capture_proc
 
@@ -116,4 +199,18 @@ def start():
         print("All services stopped.")
 
 if __name__ == "__main__":
-    start()
+    parser = argparse.ArgumentParser(description="Start all NetFlow Sentinel services")
+    parser.add_argument(
+        "--broadcaster", action="store_true",
+        help="Stream dashboard updates through ws_broadcaster.py (port 8001) instead of Django"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of daphne workers sharing port 8000 (>1 uses a local Redis channel layer)"
+    )
+    parser.add_argument(
+        "--lite", action="store_true",
+        help="Run the engine without the ML stack (AI context uses keyword matching only)"
+    )
+    args = parser.parse_args()
+    start(use_broadcaster=args.broadcaster, workers=max(1, args.workers), lite=args.lite)
@@ -0,0 +1,139 @@
+"""
+Engine startup benchmark.
+
+Launches main.py once per mode, feeds it synthetic packets and polls
+GET /ready on port 8011 to report time-to-first-packet-processed,
+time-to-ready (embedding model warmed up) and resident memory.
+
+Each run works in a scratch directory: the packet stream, CSV logs, RAG
+index, anomaly history and host profiles all live there, and dashboard
+updates go to an unused broadcaster socket. The synthetic SYN packets
+never reach live_data/stream.jsonl or the engine's saved state.
+
+Usage:
+    python startup_bench.py [--modes full lite] [--timeout 180]
+
+Stop the running engine first; the benchmark needs port 8011.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+READY_URL = "http://localhost:8011/ready"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Read-only configuration the engine should see as in production
+CONFIG_FILES = ("whitelist.json", "rules.json")
+
+
+def scratch_env(workdir: str) -> dict:
+    """Engine environment with every input and state path inside `workdir`."""
+    for name in ("docs", "logs", "live_data", "models"):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    for name in CONFIG_FILES:
+        if os.path.exists(os.path.join(ROOT, name)):
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    return {
+        "NETFLOW_STREAM_FILE": os.path.join(workdir, "live_data", "stream.jsonl"),
+        "NETFLOW_RAG_INDEX": os.path.join(workdir, "docs", "rag_index.npz"),
+        "NETFLOW_HISTORY_DB": os.path.join(workdir, "docs", "anomaly_history.db"),
+        "NETFLOW_HOST_PROFILES_PATH": os.path.join(workdir, "models", "host_profiles.npz"),
+        "NETFLOW_SCORING_MODEL": os.path.join(ROOT, "models", "isolation_forest.npz"),
+        "NETFLOW_RULES_PATH": os.path.join(workdir, "rules.json"),
+        # Nobody listens here, so updates are dropped instead of reaching a dashboard
+        "NETFLOW_DASHBOARD_SINK": "broadcaster",
+        "NETFLOW_BROADCAST_SOCKET": os.path.join(workdir, "live_data", "broadcast.sock"),
+    }
+
+
+def synthetic_packet() -> dict:
+    return {
+        "timestamp": time.time(),
+        "protocols": "eth:ethertype:ip:tcp",
+        "src_ip": "10.0.0.2",
+        "dst_ip": "10.0.0.1",
+        "src_port": "40000",
+        "dst_port": "80",
+        "packet_size": "60",
+        "payload_len": "0",
+        "info": "startup_bench",
+        "tcp_seq": "0",
+        "tcp_flags_syn": "True",
+        "tcp_flags_ack": "False",
+        "tcp_flags_fin": "False",
+        "tcp_flags_rst": "False",
+        "tcp_flags_psh": "False",
+        "tcp_flags_urg": "False",
+        "tcp_retransmission": None,
+        "tcp_window_size": "64240",
+        "ttl_hop_limit": "64",
+        "fragmentation": None,
+    }
+
+
+def run_mode(mode: str, timeout: float, workdir: str) -> dict:
+    env = {**os.environ, **scratch_env(workdir), "NETFLOW_MODE": mode, "NETFLOW_WARMUP_DELAY": "0"}
+    started = time.time()
+    # Relative paths (CSV logs, whitelist.json) resolve inside the scratch directory
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "main.py")],
+        cwd=workdir,
+        stdout=open(f"startup_bench_{mode}.log", "w"),
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+    result = {"mode": mode, "endpoint_seconds": None, "ready_seconds": None}
+    try:
+        with open(env["NETFLOW_STREAM_FILE"], "a", buffering=1) as stream:
+            while time.time() - started < timeout:
+                if proc.poll() is not None:
+                    result["error"] = f"engine exited with {proc.returncode}"
+                    break
+                stream.write(json.dumps(synthetic_packet()) + "\n")
+                try:
+                    status = requests.get(READY_URL, timeout=2).json()
+                except (requests.exceptions.RequestException, ValueError):
+                    time.sleep(0.2)
+                    continue
+                if result["endpoint_seconds"] is None:
+                    result["endpoint_seconds"] = round(time.time() - started, 2)
+                result["first_packet_seconds"] = status.get("first_packet_seconds")
+                result["rss_mb"] = status.get("rss_mb")
+                if status.get("ready") and status.get("first_packet_seconds") is not None:
+                    result["ready_seconds"] = round(time.time() - started, 2)
+                    break
+                time.sleep(0.2)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetFlow engine startup benchmark")
+    parser.add_argument("--modes", nargs="+", default=["lite", "full"])
+    parser.add_argument("--timeout", type=float, default=180.0)
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory(prefix=f"netflow-bench-{mode}-") as workdir:
+            results.append(run_mode(mode, args.timeout, workdir))
+
+    print(f"\n{'mode':<6} {'first packet (s)':>17} {'/ready up (s)':>14} {'ready (s)':>10} {'RSS (MB)':>9}")
+    for r in results:
+        print(f"{r['mode']:<6} {str(r.get('first_packet_seconds')):>17} {str(r['endpoint_seconds']):>14} "
+              f"{str(r['ready_seconds']):>10} {str(r.get('rss_mb')):>9}  {r.get('error', '')}")
+
+
+if __name__ == "__main__":
+    main()
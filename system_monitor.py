@@ -1,10 +1,8 @@
 import time
-import requests
 import json
 import sys
 
-# Configuration
-API_URL = "http://localhost:8000/api/update/"
+from broadcast_client import publish
 
 def get_cpu_usage():
     """Calculates CPU usage percentage from /proc/stat."""
@@ -74,12 +72,9 @@ def main():
             "timestamp": time.time()
         }
         
-        # Send to Backend
-        try:
-            requests.post(API_URL, json=payload, timeout=1)
-            # print(f"Sent Stats: CPU {cpu_percent}% | RAM {ram_percent}%")
-        except Exception as e:
-            print(f"Failed to send stats: {e}", file=sys.stderr)
+        # Send to Backend (Django or the direct broadcaster, see broadcast_client.py)
+        if not publish(payload):
+            print("Failed to send stats", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
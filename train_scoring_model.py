@@ -0,0 +1,70 @@
+"""
+Trains the isolation forest used by scoring.py from logged flow windows.
+
+Reads the flow log written by the engine (docs/anomalies.csv) and writes
+the model to scoring.MODEL_PATH. The log only holds flows at or above
+anomaly_threshold, so collect training data with the threshold at 0 to
+let the model see normal traffic. A running engine picks the new
+file up within a second; no restart is needed.
+
+Usage:
+    python train_scoring_model.py [--input docs/anomalies.csv] [--trees 100] [--sample-size 256]
+"""
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+import scoring
+
+
+def load_flows(path: str) -> np.ndarray:
+    """Feature matrix of the logged flow windows (latest version of each row)."""
+    packets, bytes_, durations = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if row.get("diff", "1") != "1":
+                continue
+            try:
+                count = int(float(row["packet_count"]))
+                total = int(float(row["total_bytes"]))
+                duration = float(row["duration"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if count <= 0:
+                continue
+            packets.append(count)
+            bytes_.append(total)
+            durations.append(duration)
+    packets = np.array(packets, dtype=np.float64)
+    bytes_ = np.array(bytes_, dtype=np.float64)
+    return scoring.feature_matrix(packets, bytes_, np.array(durations), bytes_ / np.maximum(packets, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the NetFlow isolation forest")
+    parser.add_argument("--input", default="docs/anomalies.csv")
+    parser.add_argument("--output", default=scoring.MODEL_PATH)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--sample-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        x = load_flows(args.input)
+    except OSError as e:
+        sys.exit(f"Cannot read {args.input}: {e}")
+    if len(x) < 2:
+        sys.exit(f"Not enough flows in {args.input} to train ({len(x)})")
+
+    model = scoring.IsolationForest.fit(x, trees=args.trees, sample_size=args.sample_size, seed=args.seed)
+    model.meta["rows"] = len(x)
+    model.save(args.output)
+    scores = model.score(x)
+    print(f"Trained on {len(x)} flows -> {args.output}")
+    print(f"Training scores: p50 {np.median(scores):.3f}, p99 {np.quantile(scores, 0.99):.3f}, max {scores.max():.3f}")
+
+
+if __name__ == "__main__":
+    main()
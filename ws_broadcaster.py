@@ -0,0 +1,263 @@
+"""
+Direct engine-to-browser WebSocket broadcaster.
+
+Replaces the engine -> HTTP -> DRF -> channel layer -> consumer path for the
+live packet stream. Producers (main.py, system_monitor.py) connect to a Unix
+socket and write one JSON document per line. Each line is framed once as a
+WebSocket text frame and the same bytes are written to every connected
+client, so per-client cost is a single transport.write().
+
+Django keeps serving REST and the chat proxy on port 8000.
+
+This is the legacy stream: updates are forwarded one by one as the engine
+produced them. Django's coalescing, encodings, subscriptions, snapshots and
+flow control do not apply. Each client is greeted with a HELLO frame
+announcing that, so the dashboard stops sending acks, and subscribe /
+resume requests are answered with an error instead of being ignored.
+
+Usage:
+    python ws_broadcaster.py [--port 8001] [--socket live_data/broadcast.sock]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import time
+
+WS_PATH = "/ws/packets/"
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+# A client whose kernel + transport buffer exceeds this is too far behind
+# to be useful and gets disconnected instead of slowing everyone else down.
+MAX_CLIENT_BUFFER = 4 * 1024 * 1024
+MAX_HANDSHAKE_BYTES = 8192
+MAX_CLIENT_FRAME = 64 * 1024
+STATS_INTERVAL = 10.0
+
+# First frame to every client: no features beyond the raw update stream
+HELLO = json.dumps({"type": "hello", "server": "ws_broadcaster", "legacy": True, "features": []}).encode()
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT) -> bytes:
+    """Build an unmasked, unfragmented server-to-client frame."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    """Read one (masked) client frame. Raises on EOF or oversized frames."""
+    b0, b1 = await reader.readexactly(2)
+    opcode = b0 & 0x0F
+    length = b1 & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_CLIENT_FRAME:
+        raise ValueError(f"client frame too large ({length} bytes)")
+    mask = await reader.readexactly(4) if b1 & 0x80 else b"\x00\x00\x00\x00"
+    data = await reader.readexactly(length)
+    if length:
+        key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+        data = (int.from_bytes(data, "big") ^ key).to_bytes(length, "big")
+    return opcode, data
+
+
+class Broadcaster:
+    def __init__(self):
+        self.clients: set[asyncio.StreamWriter] = set()
+        self.producers = 0
+        self.messages = 0
+        self.bytes_out = 0
+        self.dropped_clients = 0
+        self.started_at = time.time()
+
+    # --- Fan-out -----------------------------------------------------------
+    def broadcast(self, payload: bytes):
+        frame = encode_frame(payload)
+        self.messages += 1
+        for writer in list(self.clients):
+            transport = writer.transport
+            if transport.is_closing():
+                self.clients.discard(writer)
+                continue
+            if transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                self._drop(writer)
+                continue
+            transport.write(frame)
+            self.bytes_out += len(frame)
+
+    def _drop(self, writer: asyncio.StreamWriter):
+        self.clients.discard(writer)
+        self.dropped_clients += 1
+        peer = writer.get_extra_info("peername")
+        print(f"[Broadcaster] Dropping slow client {peer}")
+        writer.transport.abort()
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.clients),
+            "producers": self.producers,
+            "messages": self.messages,
+            "bytes_out": self.bytes_out,
+            "dropped_clients": self.dropped_clients,
+            "uptime": round(time.time() - self.started_at, 1),
+        }
+
+    # --- Producers (Unix socket, newline-delimited JSON) ---------------------
+    async def handle_producer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.producers += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.rstrip(b"\r\n")
+                if line:
+                    # Already serialized by the producer; forward the bytes as-is
+                    self.broadcast(line)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"[Broadcaster] Producer error: {e}")
+        finally:
+            self.producers -= 1
+            writer.close()
+
+    # --- Browsers (HTTP upgrade to WebSocket) --------------------------------
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else ""
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if path == "/stats":
+            body = json.dumps(self.stats()).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+            writer.close()
+            return
+
+        key = headers.get("sec-websocket-key")
+        if path != WS_PATH or "websocket" not in headers.get("upgrade", "").lower() or not key:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+            + encode_frame(HELLO)
+        )
+        self.clients.add(writer)
+
+        # Answer pings and closes; stream control requests get an error once per action
+        refused = set()
+        try:
+            while True:
+                opcode, data = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(data[:2], OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(data, OP_PONG))
+                elif opcode == OP_TEXT:
+                    action = self._action(data)
+                    if action and action not in refused:
+                        refused.add(action)
+                        error = {"type": "error", "error": f"{action} is not supported by the direct broadcaster"}
+                        writer.write(encode_frame(json.dumps(error).encode()))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _action(data: bytes) -> str | None:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return None
+        action = message.get("action") if isinstance(message, dict) else None
+        return str(action) if action else None
+
+    async def report_stats(self):
+        last_messages = 0
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            stats = self.stats()
+            rate = (stats["messages"] - last_messages) / STATS_INTERVAL
+            last_messages = stats["messages"]
+            print(
+                f"[Broadcaster] clients={stats['clients']} producers={stats['producers']} "
+                f"msg/s={rate:.1f} dropped_clients={stats['dropped_clients']}",
+                flush=True,
+            )
+
+
+async def serve(host: str, port: int, socket_path: str):
+    broadcaster = Broadcaster()
+
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    ingest = await asyncio.start_unix_server(
+        broadcaster.handle_producer, path=socket_path, limit=1024 * 1024
+    )
+    web = await asyncio.start_server(
+        broadcaster.handle_client, host=host, port=port, limit=MAX_HANDSHAKE_BYTES
+    )
+    print(f"[Broadcaster] Ingest on {socket_path}, WebSocket on ws://{host}:{port}{WS_PATH}", flush=True)
+
+    asyncio.create_task(broadcaster.report_stats())
+    async with ingest, web:
+        await asyncio.gather(ingest.serve_forever(), web.serve_forever())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetFlow WebSocket broadcaster")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("NETFLOW_BROADCAST_PORT", 8001)))
+    parser.add_argument("--socket", default=os.environ.get("NETFLOW_BROADCAST_SOCKET", "live_data/broadcast.sock"))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        print("\nStopping broadcaster.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+WebSocket fan-out load test.
+
+Opens many dashboard-like WebSocket clients, feeds synthetic flow updates
+into the backend at a fixed rate and reports aggregate delivery throughput
+and update-to-client latency. Run it against a single daphne worker and
+against `start_sentinel.py --workers N` to see broadcast capacity scale.
+
+Usage:
+    python ws_load_test.py --clients 500 --rate 200 --duration 20
+    python ws_load_test.py --clients 500 --procs 4 --ingest http://localhost:8002/api/update/
+    python ws_load_test.py --url ws://localhost:8001/ws/packets/ --socket live_data/broadcast.sock
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import statistics
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from broadcast_client import SocketPublisher
+from ws_broadcaster import OP_CLOSE, OP_TEXT, read_frame
+
+FLOW_KEYS = 40  # stays under the coalescer's per-frame top-N cap
+
+
+def encode_client_frame(payload: bytes, opcode: int = OP_TEXT) -> bytes:
+    """Client-to-server frames must be masked."""
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+    key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+    masked = (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big") if length else b""
+    return header + mask + masked
+
+
+async def run_client(url: str, deadline: float, ack: bool, stats: dict):
+    parsed = urlparse(url)
+    reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(
+        f"GET {parsed.path or '/'} HTTP/1.1\r\nHost: {parsed.netloc}\r\n"
+        "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode()
+    )
+    response = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in response.split(b"\r\n", 1)[0]:
+        stats["failed"] += 1
+        writer.close()
+        return
+    stats["connected"] += 1
+
+    try:
+        while time.time() < deadline:
+            try:
+                opcode, data = await asyncio.wait_for(read_frame(reader), timeout=deadline - time.time())
+            except asyncio.TimeoutError:
+                break
+            if opcode == OP_CLOSE:
+                stats["closed_by_server"] += 1
+                return
+            if opcode != OP_TEXT:
+                continue
+            now = time.time()
+            message = json.loads(data)
+            stats["frames"] += 1
+            stats["bytes"] += len(data)
+            updates = message["updates"] if isinstance(message, dict) and "updates" in message else [message]
+            for update in updates:
+                sent_at = update.get("sent_at") if isinstance(update, dict) else None
+                if sent_at:
+                    stats["updates"] += 1
+                    if len(stats["latencies"]) < 200000:
+                        stats["latencies"].append(now - sent_at)
+            if ack and isinstance(message, dict) and message.get("seq") is not None:
+                writer.write(encode_client_frame(json.dumps({"action": "ack", "seq": message["seq"]}).encode()))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        stats["closed_by_server"] += 1
+    finally:
+        writer.close()
+
+
+def client_process(url, clients, deadline, ack, results):
+    stats = {"connected": 0, "failed": 0, "closed_by_server": 0, "frames": 0,
+             "updates": 0, "bytes": 0, "latencies": []}
+
+    async def main():
+        tasks = []
+        for _ in range(clients):
+            tasks.append(asyncio.create_task(run_client(url, deadline, ack, stats)))
+            await asyncio.sleep(0.002)  # don't SYN-flood the server
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    results.put(stats)
+
+
+def produce(args, start: float, stop: float):
+    """Push `rate` updates/s in 10 batches per second."""
+    session = requests.Session()
+    publisher = SocketPublisher(args.socket) if args.socket else None
+    per_tick = max(1, args.rate // 10)
+    padding = "x" * args.payload
+    i = 0
+    while time.time() < start:
+        time.sleep(0.01)
+    while time.time() < stop:
+        tick = time.time()
+        batch = []
+        for _ in range(per_tick):
+            batch.append({
+                "flow": f"10.0.0.{i % FLOW_KEYS}:40000 -> 192.168.1.10:80",
+                "anomaly_score": (i % 100) / 100,
+                "packet_count": i,
+                "last_packet_info": padding,
+                "sent_at": time.time(),
+            })
+            i += 1
+        try:
+            if publisher:
+                for update in batch:
+                    publisher.publish(update)
+            else:
+                session.post(args.ingest, json=batch, timeout=2)
+        except requests.exceptions.RequestException as e:
+            print(f"Producer error: {e}")
+        time.sleep(max(0.0, 0.1 - (time.time() - tick)))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetFlow WebSocket fan-out load test")
+    parser.add_argument("--url", default="ws://localhost:8000/ws/packets/")
+    parser.add_argument("--ingest", default="http://localhost:8000/api/update/",
+                        help="PacketUpdateView URL (use the worker-0 ingest port in multi-worker mode)")
+    parser.add_argument("--socket", default=None, help="Feed ws_broadcaster.py through its Unix socket instead")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Client processes (keep the load generator from being the bottleneck)")
+    parser.add_argument("--rate", type=int, default=100, help="Updates per second fed to the backend")
+    parser.add_argument("--payload", type=int, default=200, help="Padding bytes per update")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds allowed for clients to connect")
+    parser.add_argument("--no-ack", action="store_true", help="Don't ack frames (disables server flow control)")
+    args = parser.parse_args()
+
+    start = time.time() + args.warmup
+    deadline = start + args.duration
+    results = multiprocessing.Queue()
+    per_proc = [args.clients // args.procs + (1 if i < args.clients % args.procs else 0) for i in range(args.procs)]
+    procs = [
+        multiprocessing.Process(target=client_process, args=(args.url, n, deadline, not args.no_ack, results))
+        for n in per_proc if n
+    ]
+    for p in procs:
+        p.start()
+
+    producer = threading.Thread(target=produce, args=(args, start, deadline), daemon=True)
+    producer.start()
+
+    totals = {"connected": 0, "failed": 0, "closed_by_server": 0, "frames": 0, "updates": 0, "bytes": 0}
+    latencies = []
+    for _ in procs:
+        stats = results.get()
+        for k in totals:
+            totals[k] += stats[k]
+        latencies.extend(stats["latencies"])
+    for p in procs:
+        p.join()
+
+    print(f"Clients connected:     {totals['connected']} / {args.clients} (failed {totals['failed']}, "
+          f"closed by server {totals['closed_by_server']})")
+    print(f"Frames delivered/s:    {totals['frames'] / args.duration:,.0f}")
+    print(f"Updates delivered/s:   {totals['updates'] / args.duration:,.0f}")
+    print(f"Bytes delivered/s:     {totals['bytes'] / args.duration / 1e6:,.2f} MB")
+    if latencies:
+        print(f"Update -> client (ms): p50 {percentile(latencies, 50) * 1000:.1f}  "
+              f"p99 {percentile(latencies, 99) * 1000:.1f}  "
+              f"mean {statistics.fmean(latencies) * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()